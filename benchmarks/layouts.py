@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# --------------------------------------------------------------
+# Benchmark of the partitioning layouts (see
+# euppparquet.server.layout). Builds the same synthetic archive
+# (forecasts and reforecasts) in several layouts and reports the
+# number of files, size on disk, time needed to write, and the
+# latency of typical queries.
+#
+# Examples:
+#   python benchmarks/layouts.py
+#   python benchmarks/layouts.py --days 120 --members 50 --repeat 5
+#   python benchmarks/layouts.py --layouts version-product-ymd date-step
+# --------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import datetime as dt
+
+from euppparquet.server import IndexParser, LAYOUTS, synthetic
+from euppparquet.client import Dataset
+
+# Layouts compared by default
+DEFAULT = ["version-product-ymd", "version-product-date", "date", "ymd-step", "ymd-param"]
+
+# Synthetic surface parameters
+PARAMS = ["2t", "10u", "10v", "msl", "tcc", "tp", "sd", "cape"]
+
+
+def make_archive(dir, days, members, steps):
+    """make_archive(dir, days, members, steps)
+
+    Daily ensemble forecasts and (Monday/Thursday) reforecasts starting
+    2017-01-02 (see euppparquet.server.synthetic). Returns the list of
+    GRIB index files.
+    """
+    first = dt.date(2017, 1, 2)
+    return synthetic.make_archive(dir, first, first + dt.timedelta(days - 1), types = ["forecast", "reforecast"],
+                                  products = ["ens"], kinds = ["surf"], params = dict(surf = PARAMS),
+                                  steps = steps, members = members, hindcast_years = 1, format = "gzip")
+
+
+def disk_usage(dataset):
+    """disk_usage(dataset)
+
+    Returns number of parquet files and their total size in bytes.
+    """
+    nfiles, nbytes = 0, 0
+    for root, dirs, files in os.walk(dataset):
+        for file in files:
+            if not file.endswith(".parquet"): continue
+            nfiles += 1
+            nbytes += os.path.getsize(os.path.join(root, file))
+    return nfiles, nbytes
+
+
+def timeit(fun, repeat):
+    """timeit(fun, repeat)
+
+    Returns the median wall time (seconds) and the result of the last call.
+    """
+    res, times = None, []
+    for i in range(repeat):
+        t0  = time.perf_counter()
+        res = fun()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), res
+
+
+def run(layout, files, srcdir, workdir, days, repeat):
+    """run(layout, files, srcdir, workdir, days, repeat)
+
+    Builds the archive in one layout and runs the queries.
+    Returns a dictionary with the results.
+    """
+    cwd = os.getcwd()
+    os.makedirs(workdir)
+    os.chdir(workdir)
+    try:
+        parser = IndexParser(dict(forecast = layout, reforecast = layout))
+        t0 = time.perf_counter()
+        for file in files: parser.process_file(os.path.join(srcdir, file))
+        parser.flush()
+        res = dict(layout = layout, write = time.perf_counter() - t0)
+
+        for product in ["forecast", "reforecast"]:
+            res[f"{product}_files"], res[f"{product}_bytes"] = disk_usage(f"{product}.parquet")
+
+        first, last = dt.date(2017, 1, 2), dt.date(2017, 1, 2) + dt.timedelta(days - 1)
+        mid = first + dt.timedelta(days // 2)
+
+        # Opening the dataset (discovery of the fragments)
+        res["open"], fcs = timeit(lambda: Dataset("forecast.parquet"), repeat)
+        rfcs = Dataset("reforecast.parquet")
+
+        # Typical query shapes; fresh handle each time (footers not yet cached)
+        queries = dict(
+            single_day = lambda: Dataset("forecast.parquet").query(mid),
+            one_param  = lambda: Dataset("forecast.parquet").query(first, last, param = "2t"),
+            one_step   = lambda: Dataset("reforecast.parquet").query(first, last, step = 24))
+        for name, fun in queries.items():
+            res[name], tab = timeit(fun, repeat)
+            res[f"{name}_rows"] = tab.num_rows
+    finally:
+        os.chdir(cwd)
+    return res
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Benchmark of the partitioning layouts.")
+    parser.add_argument("--layouts", type = str, nargs = "+", default = DEFAULT,
+            choices = list(LAYOUTS.keys()), help = f"Layouts to compare, defaults to {DEFAULT}.")
+    parser.add_argument("--days", type = int, default = 60,
+            help = "Number of days of the synthetic archive, defaults to 60.")
+    parser.add_argument("--members", type = int, default = 10,
+            help = "Number of ensemble members, defaults to 10.")
+    parser.add_argument("--repeat", type = int, default = 3,
+            help = "Number of repetitions per query (median reported), defaults to 3.")
+    parser.add_argument("--dir", type = str, default = None,
+            help = "Working directory; defaults to a temporary directory (removed when done).")
+    parser.add_argument("--json", type = str, default = None,
+            help = "If set, the results are also written into this file (JSON).")
+    args = parser.parse_args()
+
+    dir = tempfile.mkdtemp(prefix = "eupp-layouts-") if args.dir is None else args.dir
+    srcdir = os.path.join(dir, "_index")
+    os.makedirs(srcdir, exist_ok = True)
+
+    try:
+        files = make_archive(srcdir, args.days, args.members, list(range(0, 121, 6)))
+        print(f"Synthetic archive: {len(files)} GRIB index files in {srcdir}")
+
+        results = []
+        for layout in args.layouts:
+            workdir = os.path.join(dir, layout)
+            if os.path.isdir(workdir): shutil.rmtree(workdir)
+            print(f"Layout {layout} ...")
+            results.append(run(layout, files, srcdir, workdir, args.days, args.repeat))
+    finally:
+        if args.dir is None: shutil.rmtree(dir)
+
+    # Summary
+    fmt = "{:<22s} {:>7s} {:>10s} {:>7s} {:>10s} {:>8s} {:>8s} {:>10s} {:>10s} {:>10s}"
+    print(fmt.format("layout", "files", "MiB", "rfiles", "rMiB", "write", "open",
+                     "single_day", "one_param", "one_step"))
+    for res in results:
+        print(fmt.format(res["layout"], str(res["forecast_files"]),
+                         f"{res['forecast_bytes'] / 2**20:.2f}", str(res["reforecast_files"]),
+                         f"{res['reforecast_bytes'] / 2**20:.2f}", f"{res['write']:.2f}s",
+                         f"{res['open'] * 1e3:.0f}ms", f"{res['single_day'] * 1e3:.0f}ms",
+                         f"{res['one_param'] * 1e3:.0f}ms", f"{res['one_step'] * 1e3:.0f}ms"))
+
+    if args.json is not None:
+        with open(args.json, "w") as fid: json.dump(results, fid, indent = 2)
+        print(f"Results written to {args.json}")
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+# --------------------------------------------------------------
+# Benchmark suite for ingestion (IndexParser.process_file) and
+# the query path (client.Dataset) on a synthetic archive (see
+# euppparquet.server.synthetic). Each phase runs in its own
+# process to measure its peak memory (RSS). Results are appended
+# to benchmarks/results.jsonl together with the git commit such
+# that regressions between commits are visible (--compare).
+#
+# Examples:
+#   python benchmarks/suite.py
+#   python benchmarks/suite.py --months 2 --members 20 --compare
+#   python benchmarks/suite.py --chunksize 50000 --no-store
+# --------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+import datetime as dt
+
+# Stored results (one JSON record per line)
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+# Metrics where larger values are better (all others: smaller is better)
+HIGHER_IS_BETTER = ["rows_per_s"]
+
+
+def _peak_rss_():
+    """_peak_rss_()
+
+    Peak resident set size of this process in MiB.
+    """
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def _timeit_(fun, repeat):
+    """_timeit_(fun, repeat)
+
+    Returns the median wall time (seconds) and the result of the last call.
+    """
+    res, times = None, []
+    for i in range(repeat):
+        t0  = time.perf_counter()
+        res = fun()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), res
+
+
+def _disk_usage_(dataset):
+    """_disk_usage_(dataset)
+
+    Returns the number of parquet files and their total size in bytes.
+    """
+    nfiles, nbytes = 0, 0
+    for root, dirs, files in os.walk(dataset):
+        for file in files:
+            if not file.endswith(".parquet"): continue
+            nfiles += 1
+            nbytes += os.path.getsize(os.path.join(root, file))
+    return nfiles, nbytes
+
+
+def phase_ingest(srcdir, workdir, files, chunksize):
+    """phase_ingest(srcdir, workdir, files, chunksize)
+
+    Ingests all files with one IndexParser (as process_files does).
+    """
+    import pyarrow.parquet as parquet
+    from euppparquet.server import IndexParser
+
+    os.chdir(workdir)
+    rss0   = _peak_rss_()
+    parser = IndexParser()
+    t0     = time.perf_counter()
+    for file in files: parser.process_file(os.path.join(srcdir, file), chunksize = chunksize)
+    parser.flush()
+    secs   = time.perf_counter() - t0
+
+    res = dict(seconds = secs, peak_rss_mib = _peak_rss_(), base_rss_mib = rss0, files = len(files))
+    rows = 0
+    for type in ["analysis", "forecast", "reforecast"]:
+        if not os.path.isdir(f"{type}.parquet"): continue
+        res[f"{type}_files"], res[f"{type}_bytes"] = _disk_usage_(f"{type}.parquet")
+        rows += parquet.read_metadata(os.path.join(f"{type}.parquet", "_metadata")).num_rows
+    res["rows"]       = rows
+    res["rows_per_s"] = rows / secs
+    return res
+
+
+def phase_query(workdir, begin, end, repeat):
+    """phase_query(workdir, begin, end, repeat)
+
+    Latency of typical queries; 'cold' uses a new Dataset handle for
+    each query (discovery and footers included), 'warm' one handle.
+    """
+    from euppparquet.client import Dataset
+
+    os.chdir(workdir)
+    mid = begin + (end - begin) / 2
+    res = dict()
+
+    queries = dict()
+    if os.path.isdir("forecast.parquet"):
+        queries.update(
+            fc_single_day = ("forecast.parquet", dict(begin = mid)),
+            fc_one_param  = ("forecast.parquet", dict(begin = begin, end = end, param = "2t")),
+            fc_one_step   = ("forecast.parquet", dict(begin = begin, end = end, step = 24)),
+            fc_member     = ("forecast.parquet", dict(begin = begin, end = end, param = "2t", step = 24, number = 1)))
+    if os.path.isdir("reforecast.parquet"):
+        queries.update(rfc_one_param = ("reforecast.parquet", dict(begin = begin, end = end, param = "2t")))
+    if os.path.isdir("analysis.parquet"):
+        queries.update(ana_one_param = ("analysis.parquet", dict(begin = begin, end = end, param = "2t")))
+
+    handles = dict()
+    for dataset in set([x[0] for x in queries.values()]):
+        res[f"open_{dataset.split('.')[0]}"], handles[dataset] = _timeit_(lambda: Dataset(dataset), repeat)
+
+    for name, (dataset, query) in queries.items():
+        res[f"{name}_cold"], tab = _timeit_(lambda: Dataset(dataset).query(**query), repeat)
+        res[f"{name}_warm"], tab = _timeit_(lambda: handles[dataset].query(**query), repeat)
+        res[f"{name}_rows"]      = tab.num_rows
+
+    res["peak_rss_mib"] = _peak_rss_()
+    return res
+
+
+def _run_phase_(fun, *args):
+    """_run_phase_(fun, *args)
+
+    Runs one phase in a new process (its own peak RSS); returns its result.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(fun, args)
+
+
+def _commit_():
+    """_commit_()
+
+    Returns the current git commit (short) and whether the tree has
+    uncommitted changes; (None, None) outside of a git repository.
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd = cwd,
+                                         stderr = subprocess.DEVNULL).decode().strip()
+        dirty  = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd = cwd,
+                                         stderr = subprocess.DEVNULL).decode().strip() != ""
+    except Exception:
+        return None, None
+    return commit, dirty
+
+
+def compare(record, file):
+    """compare(record, file)
+
+    Prints the change of each metric relative to the last stored
+    record with the same configuration. Changes by more than 10
+    percent for the worse are marked.
+    """
+    if not os.path.isfile(file): return
+    with open(file, "r") as fid: old = [json.loads(x) for x in fid if x.strip()]
+    old = [x for x in old if x["config"] == record["config"] and not x is record]
+    if len(old) == 0:
+        print("No stored results with the same configuration to compare with.")
+        return
+    old = old[-1]
+    print(f"Compared to {old['commit']} ({old['date']}):")
+    for phase, metrics in record["results"].items():
+        for key, val in metrics.items():
+            ref = old["results"].get(phase, {}).get(key)
+            if not isinstance(val, float) or not isinstance(ref, float) or ref == 0: continue
+            change = (val - ref) / ref * 100
+            worse  = -change if key in HIGHER_IS_BETTER else change
+            print(f"    {phase + '.' + key:<32s} {ref:>12.4g} -> {val:>12.4g} {change:+7.1f}%" + \
+                  ("   <<< regression" if worse > 10 else ""))
+
+
+if __name__ == "__main__":
+
+    from euppparquet.server.synthetic import make_archive, SURF_PARAMS, STEPS
+
+    parser = argparse.ArgumentParser(description = "Benchmark suite for ingestion and queries.")
+    parser.add_argument("--begin", type = str, default = "2017-01-01",
+            help = "First date of the synthetic archive, defaults to 2017-01-01.")
+    parser.add_argument("--months", type = int, default = 1,
+            help = "Number of months of the synthetic archive, defaults to 1.")
+    parser.add_argument("--types", type = str, nargs = "+", default = ["analysis", "forecast", "reforecast"],
+            choices = ["analysis", "forecast", "reforecast"], help = "Dataset types, defaults to all.")
+    parser.add_argument("--params", type = str, nargs = "+", default = SURF_PARAMS,
+            help = "Surface parameters (pressure level parameters are always included).")
+    parser.add_argument("--steps", type = int, nargs = "+", default = STEPS,
+            help = "Forecast steps in hours, defaults to 0 to 120 every 6 hours.")
+    parser.add_argument("--members", type = int, default = 10,
+            help = "Number of ensemble members, defaults to 10.")
+    parser.add_argument("--chunksize", type = int, default = 100000,
+            help = "Batch size for process_file, defaults to 100000.")
+    parser.add_argument("--repeat", type = int, default = 3,
+            help = "Number of repetitions per query (median reported), defaults to 3.")
+    parser.add_argument("--dir", type = str, default = None,
+            help = "Working directory; defaults to a temporary directory (removed when done).")
+    parser.add_argument("--results", type = str, default = RESULTS,
+            help = f"File the results are appended to, defaults to {os.path.relpath(RESULTS)}.")
+    parser.add_argument("--no-store", action = "store_true", default = False,
+            help = "Do not store the results.")
+    parser.add_argument("--compare", action = "store_true", default = False,
+            help = "Compare with the last stored results of the same configuration.")
+    args = parser.parse_args()
+
+    if not args.months > 0: parser.error("--months must be a positive integer.")
+    begin = dt.datetime.strptime(args.begin, "%Y-%m-%d").date()
+    end   = dt.date(begin.year + (begin.month + args.months - 1) // 12,
+                    (begin.month + args.months - 1) % 12 + 1, 1) - dt.timedelta(1)
+    end   = max(begin, end)
+
+    config = dict(begin = str(begin), end = str(end), types = args.types, params = args.params,
+                  steps = args.steps, members = args.members, chunksize = args.chunksize, repeat = args.repeat)
+
+    dir = tempfile.mkdtemp(prefix = "eupp-bench-") if args.dir is None else args.dir
+    srcdir, workdir = os.path.join(dir, "_index"), os.path.join(dir, "work")
+    for x in [srcdir, workdir]:
+        if os.path.isdir(x): shutil.rmtree(x)
+        os.makedirs(x)
+
+    try:
+        t0    = time.perf_counter()
+        files = make_archive(srcdir, begin, end, types = args.types, params = dict(surf = args.params,
+                             pressure = ["t", "z", "u", "v", "q"]), steps = args.steps, members = args.members)
+        print(f"Synthetic archive: {len(files)} GRIB index files ({time.perf_counter() - t0:.1f}s)")
+
+        results = dict()
+        print("Ingest ...")
+        results["ingest"] = _run_phase_(phase_ingest, srcdir, workdir, files, args.chunksize)
+        print("Queries ...")
+        results["query"]  = _run_phase_(phase_query, workdir, begin, end, args.repeat)
+    finally:
+        if args.dir is None: shutil.rmtree(dir)
+
+    import pyarrow
+    commit, dirty = _commit_()
+    record = dict(commit = commit, dirty = dirty, date = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                  host = platform.node(), python = platform.python_version(), pyarrow = pyarrow.__version__,
+                  config = config, results = results)
+
+    ing = results["ingest"]
+    print(f"Ingest: {ing['rows']} rows in {ing['seconds']:.2f}s ({ing['rows_per_s']:.0f} rows/s), " + \
+          f"peak RSS {ing['peak_rss_mib']:.0f} MiB")
+    for type in args.types:
+        print(f"    {type:<12s} {ing[type + '_files']:>6d} files {ing[type + '_bytes'] / 2**20:>9.2f} MiB")
+    print(f"Queries (peak RSS {results['query']['peak_rss_mib']:.0f} MiB):")
+    for key, val in results["query"].items():
+        if key.endswith("_cold") or key.startswith("open_"):
+            name = key[:-5] if key.endswith("_cold") else key
+            warm = results["query"].get(f"{name}_warm")
+            rows = results["query"].get(f"{name}_rows")
+            print(f"    {name:<16s} {val * 1e3:>8.1f}ms" + \
+                  ("" if warm is None else f" (warm {warm * 1e3:.1f}ms, {rows} rows)"))
+
+    if args.compare: compare(record, args.results)
+    if not args.no_store:
+        with open(args.results, "a") as fid: fid.write(json.dumps(record) + "\n")
+        print(f"Results appended to {args.results}")
@@ -1,4 +1,11 @@
 
 
 ##from .IndexParser import IndexParser
-## Loading 'client' functions. Currently none.
+## Loading 'client' functions.
+from .client import Dataset
+from .client import Fetcher
+from .client import MessageCache
+from .client import ResultCache
+from .client import LookupIndex
+from .client import QueryService
+from .client import ServiceClient
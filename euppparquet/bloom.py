@@ -0,0 +1,168 @@
+
+
+# --------------------------------------------------------------
+# Reader for the (split block) bloom filters stored in parquet
+# files. pyarrow writes bloom filters (see bloom_filter_options)
+# but offers no way to read them; used by the client to skip row
+# groups not containing a value (e.g., param = 't700').
+# --------------------------------------------------------------
+
+_M64 = 0xFFFFFFFFFFFFFFFF
+_P1, _P2, _P3 = 11400714785074694791, 14029467366897019727, 1609587929392839161
+_P4, _P5      = 9650029242287828579, 2870177450012600261
+
+# Salt of the split block bloom filter (parquet-format BloomFilter.md)
+_SALT = [0x47b6137b, 0x44974d91, 0x8824ad5b, 0xa2b7289d,
+         0x705495c7, 0x2df1424b, 0x9efc4947, 0x5c6bfb31]
+
+
+def _rotl_(x, r):
+    return ((x << r) | (x >> (64 - r))) & _M64
+
+
+def _round_(acc, lane):
+    acc = (acc + lane * _P2) & _M64
+    return (_rotl_(acc, 31) * _P1) & _M64
+
+
+def xxh64(data, seed = 0):
+    """xxh64(data, seed = 0)
+
+    64 bit xxHash of 'data' (bytes); the hash used by parquet bloom filters.
+    """
+    n, i = len(data), 0
+    u64 = lambda i: int.from_bytes(data[i:i + 8], "little")
+    if n >= 32:
+        v = [(seed + _P1 + _P2) & _M64, (seed + _P2) & _M64, seed, (seed - _P1) & _M64]
+        while i + 32 <= n:
+            v = [_round_(v[k], u64(i + 8 * k)) for k in range(4)]
+            i += 32
+        h = (_rotl_(v[0], 1) + _rotl_(v[1], 7) + _rotl_(v[2], 12) + _rotl_(v[3], 18)) & _M64
+        for k in range(4):
+            h = (((h ^ _round_(0, v[k])) * _P1) + _P4) & _M64
+    else:
+        h = (seed + _P5) & _M64
+    h = (h + n) & _M64
+    while i + 8 <= n:
+        h = (_rotl_(h ^ _round_(0, u64(i)), 27) * _P1 + _P4) & _M64
+        i += 8
+    if i + 4 <= n:
+        h = (_rotl_(h ^ ((int.from_bytes(data[i:i + 4], "little") * _P1) & _M64), 23) * _P2 + _P3) & _M64
+        i += 4
+    while i < n:
+        h = (_rotl_(h ^ ((data[i] * _P5) & _M64), 11) * _P1) & _M64
+        i += 1
+    h = ((h ^ (h >> 33)) * _P2) & _M64
+    h = ((h ^ (h >> 29)) * _P3) & _M64
+    return h ^ (h >> 32)
+
+
+def _varint_(buf, pos):
+    res, shift = 0, 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        res |= (b & 0x7F) << shift
+        if not b & 0x80: return res, pos
+        shift += 7
+
+
+def _skip_struct_(buf, pos):
+    """_skip_struct_(buf, pos)
+
+    Reads a thrift (compact protocol) struct consisting of i32 and
+    struct fields (sufficient for the BloomFilterHeader). Returns the
+    i32 fields as dictionary {field id: value} and the position after
+    the struct.
+    """
+    res, fid = dict(), 0
+    while True:
+        head = buf[pos]
+        pos += 1
+        if head == 0: return res, pos
+        delta, type = head >> 4, head & 0x0F
+        if delta == 0:
+            raise ValueError("Unsupported thrift field header in bloom filter.")
+        fid += delta
+        if type == 5:      # i32 (zigzag varint)
+            val, pos = _varint_(buf, pos)
+            res[fid] = (val >> 1) ^ -(val & 1)
+        elif type == 12:   # struct
+            tmp, pos = _skip_struct_(buf, pos)
+        else:
+            raise ValueError(f"Unsupported thrift type {type} in bloom filter header.")
+
+
+class BloomFilter:
+    """BloomFilter(bitset, physical_type = "BYTE_ARRAY")
+
+    Split block bloom filter of one column chunk (see read_bloom_filter).
+
+    Parameters
+    ==========
+    bitset : bytes
+        Bitset of the filter (multiple of 32 bytes).
+    physical_type : str
+        Parquet physical type of the column ('BYTE_ARRAY', 'INT32', 'INT64').
+    """
+
+    def __init__(self, bitset, physical_type = "BYTE_ARRAY"):
+        if len(bitset) == 0 or len(bitset) % 32 != 0:
+            raise ValueError("Invalid bloom filter bitset.")
+        self.bitset        = bitset
+        self.blocks        = len(bitset) // 32
+        self.physical_type = physical_type
+
+    def __repr__(self):
+        return f"<BloomFilter {len(self.bitset)} bytes>"
+
+    def __contains__(self, value):
+        return self.might_contain(value)
+
+    def might_contain(self, value):
+        """might_contain(value)
+
+        Returns False if 'value' (str, bytes, or int) is definitely not in
+        the column chunk, True if it might be.
+        """
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        elif isinstance(value, int):
+            if not self.physical_type in ["INT32", "INT64"]:
+                raise TypeError(f"Integer value for a {self.physical_type} column.")
+            value = value.to_bytes(4 if self.physical_type == "INT32" else 8, "little", signed = True)
+        h     = xxh64(value)
+        block = ((h >> 32) * self.blocks) >> 32
+        key   = h & 0xFFFFFFFF
+        for i in range(8):
+            bit  = ((key * _SALT[i]) & 0xFFFFFFFF) >> 27
+            word = int.from_bytes(self.bitset[block * 32 + 4 * i:block * 32 + 4 * i + 4], "little")
+            if not word & (1 << bit): return False
+        return True
+
+
+def read_bloom_filter(fid, column_chunk):
+    """read_bloom_filter(fid, column_chunk)
+
+    Reads the bloom filter of a column chunk.
+
+    Parameters
+    ==========
+    fid : binary file object
+        Open (seekable) parquet file.
+    column_chunk : pyarrow.parquet.ColumnChunkMetaData
+
+    Returns
+    =======
+    BloomFilter or None if the column chunk has no bloom filter.
+    """
+    offset = column_chunk.bloom_filter_offset
+    if offset is None or offset <= 0: return None
+    length = column_chunk.bloom_filter_length
+    fid.seek(offset)
+    buf    = fid.read(length if length is not None and length > 0 else 64)
+    header, pos = _skip_struct_(buf, 0)
+    nbytes = header[1]
+    if len(buf) < pos + nbytes:
+        buf += fid.read(pos + nbytes - len(buf))
+    return BloomFilter(bytes(buf[pos:pos + nbytes]), column_chunk.physical_type)
@@ -0,0 +1,451 @@
+
+
+
+import datetime as dt
+
+class Dataset:
+    """Dataset(path, filesystem = None, summary = True, cache = None)
+
+    Persistent handle to one of the parquet datasets (analysis, forecast,
+    reforecast). The fragments (parquet files) and their partition keys
+    are discovered once when the object is created; the file metadata
+    (footers) are read once when a fragment is first used and kept for
+    later queries. If the dataset has a summary ('_metadata', see
+    server.summary) fragments and footers are taken from this one file
+    instead; no listing of the partitions and no footer reads.
+
+    Queries are translated into exact partition predicates; fragments
+    not matching are dropped before anything is read, including date
+    ranges across months and years (e.g., 2017-01-25 to 2017-02-05).
+    Within the fragments, row groups are skipped using the column
+    statistics and the bloom filters on 'param' and '_path'.
+
+    Published datasets (see server.publish_dataset) are read as of
+    their current snapshot; files being uploaded are not visible.
+
+    If a cache (see ResultCache) is set, query results are memoized;
+    queries which only differ in the order or duplicates of values or
+    filters share one entry. Entries are bound to the token of the
+    dataset (see token) and invalidated once the fragments or the
+    snapshot change (i.e., after refresh).
+
+    Parameters
+    ==========
+    path : str
+        Path to the dataset (e.g., 'forecast.parquet').
+    filesystem : None or pyarrow.fs.FileSystem
+        Filesystem the dataset is stored on; defaults to local files.
+    summary : bool
+        If True (default) the summary ('_metadata') is used if available.
+    cache : None or ResultCache
+        Cache for query results; not used if None (default).
+
+    Examples
+    ========
+    >>> from euppparquet.client import Dataset
+    >>> ds = Dataset("forecast.parquet")
+    >>> ds.query("2017-01-25", "2017-02-05", param = "2t", step = 24)
+    """
+
+    def __init__(self, path, filesystem = None, summary = True, cache = None):
+        from .result_cache import ResultCache
+        if not isinstance(path, str):
+            raise TypeError("Input 'path' must be string.")
+        if not cache is None and not isinstance(cache, ResultCache):
+            raise TypeError("Input 'cache' must be None or ResultCache.")
+        self.path       = path
+        self.filesystem = filesystem
+        self.summary    = summary
+        self.cache      = cache
+        self.refresh()
+
+    def __repr__(self):
+        return f"<Dataset {self.path}: {len(self._fragments)} fragments>"
+
+    def refresh(self):
+        """refresh()
+
+        (Re-)discovers the fragments of the dataset; needed if the
+        dataset has been modified since the object has been created.
+        """
+        import pyarrow.dataset as ds
+
+        files, summary = self._snapshot_files_()
+        if summary is not None:
+            # Fragments and row group statistics from one file; no listing
+            self._dataset = ds.parquet_dataset(summary, partitioning = "hive", filesystem = self.filesystem)
+        elif files is None:
+            self._dataset = ds.dataset(self.path, format = "parquet", partitioning = "hive",
+                                       filesystem = self.filesystem)
+        else:
+            self._dataset = ds.dataset(files, format = "parquet", partitioning = "hive",
+                                       partition_base_dir = self.path, filesystem = self.filesystem)
+        self._fragments = list(self._dataset.get_fragments())
+        self._keys      = [ds.get_partition_keys(x.partition_expression) for x in self._fragments]
+        self._dates     = [self._date_key_(x) for x in self._keys]
+        self._blooms    = dict()
+
+        # Token of this state of the dataset (fragments, snapshot); see ResultCache
+        import hashlib
+        token = hashlib.sha1(str(self._snapshot).encode())
+        for x in sorted([frag.path for frag in self._fragments]): token.update(b"\n" + x.encode())
+        self.token = token.hexdigest()
+
+    def _snapshot_files_(self):
+        """_snapshot_files_()
+
+        Used internally; returns a tuple with the parquet files of the
+        current snapshot if the dataset has been published (see
+        server.publish_dataset), else None (all files of the dataset are
+        used), and the path of the summary ('_metadata') or None if the
+        dataset has no summary or 'summary = False'.
+        """
+        import json
+        import pyarrow.fs
+
+        fs   = pyarrow.fs.LocalFileSystem() if self.filesystem is None else self.filesystem
+        root = self.path.rstrip("/")
+        try:
+            with fs.open_input_stream(f"{root}/_snapshot.json") as fid: pointer = json.loads(fid.read())
+            with fs.open_input_stream(f"{root}/{pointer['manifest']}") as fid: manifest = json.loads(fid.read())
+        except FileNotFoundError:
+            manifest = None
+        self._snapshot = None if manifest is None else pointer["manifest"]
+
+        if manifest is None:
+            files   = None
+            summary = f"{root}/_metadata"
+            if not fs.get_file_info(summary).type == pyarrow.fs.FileType.File: summary = None
+        else:
+            keys    = [x["key"] for x in manifest["files"].values()]
+            files   = [f"{root}/{x}" for x in sorted(keys)
+                       if x.endswith(".parquet") and not x.rsplit("/", 1)[-1][0] in "._"]
+            summary = manifest["files"].get("_metadata")
+            summary = None if summary is None else f"{root}/{summary['key']}"
+        return files, summary if self.summary else None
+
+    @property
+    def schema(self):
+        """Schema of the dataset (pyarrow.Schema) including partition columns."""
+        return self._dataset.schema
+
+    @property
+    def fragments(self):
+        """List of all fragments (pyarrow.dataset.ParquetFileFragment)."""
+        return self._fragments
+
+    def _date_key_(self, keys):
+        """_date_key_(keys)
+
+        Used internally; returns the date of a fragment as an integer
+        (YYYYMMDD) from its partition keys ('date' or 'year', 'month',
+        and 'day'), or None if the dataset is not partitioned by date.
+        """
+        if "date" in keys:
+            return int(keys["date"])
+        if all([x in keys for x in ["year", "month", "day"]]):
+            return int(keys["year"]) * 10000 + int(keys["month"]) * 100 + int(keys["day"])
+        return None
+
+    @staticmethod
+    def _to_date_(x):
+        """_to_date_(x)
+
+        Used internally; converts x (str 'YYYY-MM-DD', datetime.date or
+        datetime.datetime) into an integer YYYYMMDD.
+        """
+        if isinstance(x, str):
+            x = dt.datetime.strptime(x, "%Y-%m-%d")
+        if not isinstance(x, (dt.date, dt.datetime)):
+            raise TypeError("Dates must be str ('YYYY-MM-DD'), datetime.date, or datetime.datetime.")
+        return x.year * 10000 + x.month * 100 + x.day
+
+    def select_fragments(self, begin = None, end = None, **kwargs):
+        """select_fragments(begin = None, end = None, **kwargs)
+
+        Returns the fragments matching the date range and the (optional)
+        conditions on other partition keys (e.g., product = 'ens').
+        Conditions on columns stored in the files (e.g., product = 'ens'
+        if the dataset is not partitioned by product) and date ranges
+        on datasets not partitioned by date do not select fragments;
+        they are applied on the rows (see scanner).
+
+        Parameters
+        ==========
+        begin : None, str, datetime.date or datetime.datetime
+            First date (inclusive).
+        end : None, str, datetime.date or datetime.datetime
+            Last date (inclusive). If None, 'begin' is used (one day).
+        **kwargs :
+            Partition key or column and value (or list of values).
+
+        Returns
+        =======
+        List of fragments.
+
+        Raises
+        ======
+        ValueError: If a key in 'kwargs' is neither a partition key nor a column.
+        """
+        b = None if begin is None else self._to_date_(begin)
+        e = b if end is None else self._to_date_(end)
+        for key in kwargs.keys():
+            if not key in self.schema.names:
+                raise ValueError(f"Dataset '{self.path}' has no partition key or column '{key}'.")
+
+        res = []
+        for frag, keys, date in zip(self._fragments, self._keys, self._dates):
+            if not date is None:
+                if not b is None and date < b: continue
+                if not e is None and date > e: continue
+            ok = True
+            for key, val in kwargs.items():
+                if val is None or not key in keys: continue
+                val = val if isinstance(val, (list, tuple)) else [val]
+                if not keys[key] in val and not str(keys[key]) in [str(x) for x in val]:
+                    ok = False
+                    break
+            if ok: res.append(frag)
+        return res
+
+    def _filter_(self, param = None, step = None, number = None, time = None, path = None, **kwargs):
+        """_filter_(param = None, step = None, number = None, time = None, path = None, **kwargs)
+
+        Used internally; creates the row filter (pyarrow.dataset.Expression)
+        for columns stored in the files; 'kwargs' are further columns and
+        values (see scanner). Returns None if no filter is set, else a tuple
+        with the filter and a dictionary with the condition on each column.
+        """
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        names = self.schema.names
+        expr  = dict()
+        def isin(name, val):
+            if val is None: return
+            if not name in names:
+                raise ValueError(f"Dataset '{self.path}' has no column '{name}'.")
+            val  = list(val) if isinstance(val, (list, tuple)) else [val]
+            type = self.schema.field(name).type
+            if pa.types.is_dictionary(type): type = type.value_type
+            val  = pa.array([str(x) for x in val] if pa.types.is_string(type) else val).cast(type)
+            expr[name] = ds.field(name).isin(val)
+
+        isin("param",  param)
+        isin("step",   step)
+        isin("number", number)
+        isin("_path",  path)
+        for key, val in kwargs.items(): isin(key, val)
+
+        # Time of day; column 'time' stores HHMM (e.g., '1200' for 12 UTC)
+        if not time is None:
+            if not "time" in names:
+                raise ValueError(f"Dataset '{self.path}' does not store the time of day (no column 'time').")
+            time = list(time) if isinstance(time, (list, tuple)) else [time]
+            type = self.schema.field("time").type
+            if pa.types.is_dictionary(type): type = type.value_type
+            isin("time", [f"{x * 100:04d}" if pa.types.is_string(type) else x * 100 for x in time])
+
+        if len(expr) == 0: return None
+        res = None
+        for x in expr.values(): res = x if res is None else res & x
+        return res, expr
+
+    def _date_filter_(self, begin, end):
+        """_date_filter_(begin, end)
+
+        Used internally; creates the row filter (pyarrow.dataset.Expression)
+        for the date range on datasets not partitioned by date (see
+        _date_key_) using the columns 'date' or 'year', 'month', and 'day'.
+        Returns None if no date range is set.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+
+        b = None if begin is None else self._to_date_(begin)
+        e = b if end is None else self._to_date_(end)
+        if b is None and e is None: return None
+        if "date" in self.schema.names:
+            date = ds.field("date").cast(pa.int32())
+        else:
+            date = pc.add(pc.add(pc.multiply(ds.field("year").cast(pa.int32()), 10000),
+                                 pc.multiply(ds.field("month").cast(pa.int32()), 100)),
+                          ds.field("day").cast(pa.int32()))
+        if b is None: return date <= e
+        if e is None: return date >= b
+        return (date >= b) & (date <= e)
+
+    def _bloom_(self, frag, fid, row_group, column):
+        """_bloom_(frag, fid, row_group, column)
+
+        Used internally; returns the bloom filter (see bloom.BloomFilter)
+        of a column in a row group of a fragment or None. Kept for
+        later queries.
+        """
+        from ..bloom import read_bloom_filter
+        key = (frag.path, row_group, column)
+        if not key in self._blooms:
+            meta = frag.metadata
+            if not column in meta.schema.names:
+                self._blooms[key] = None
+            else:
+                chunk = meta.row_group(row_group).column(meta.schema.names.index(column))
+                if fid[0] is None: fid[0] = self._dataset.filesystem.open_input_file(frag.path)
+                self._blooms[key] = read_bloom_filter(fid[0], chunk)
+        return self._blooms[key]
+
+    def _prune_(self, frags, expr, values):
+        """_prune_(frags, expr, values)
+
+        Used internally; drops the row groups which cannot contain
+        matching rows. First using the column statistics (min/max),
+        then using the bloom filters for the values given.
+
+        Parameters
+        ==========
+        frags : list of pyarrow.dataset.ParquetFileFragment
+        expr : dict
+            Conditions on the columns (see _filter_); only conditions on
+            columns stored in the files (not partition keys) are used.
+        values : dict
+            Column name and list of values to be looked up in the bloom filters.
+
+        Returns
+        =======
+        List of fragments (subsets of the row groups).
+        """
+        res = []
+        for frag in frags:
+            names  = frag.physical_schema.names
+            filter = None
+            for name, x in expr.items():
+                if name in names: filter = x if filter is None else filter & x
+            ids = list(range(frag.num_row_groups)) if filter is None else \
+                  [x.id for x in frag.subset(filter = filter).row_groups]
+            fid = [None]
+            for column, val in values.items():
+                ids = [i for i in ids if self._bloom_(frag, fid, i, column) is None or \
+                       any([x in self._bloom_(frag, fid, i, column) for x in val])]
+            if fid[0] is not None: fid[0].close()
+            if len(ids) == 0: continue
+            res.append(frag if len(ids) == frag.num_row_groups else frag.subset(row_group_ids = ids))
+        return res
+
+    def scanner(self, begin = None, end = None, param = None, step = None, number = None,
+                time = None, columns = None, path = None, filters = None, **kwargs):
+        """scanner(begin = None, end = None, param = None, step = None, number = None,
+                time = None, columns = None, path = None, filters = None, **kwargs)
+
+        Returns a pyarrow.dataset.Scanner for the query; see query for details.
+        """
+        import pyarrow.dataset as ds
+
+        frags  = self.select_fragments(begin, end, **kwargs)
+        # Reads the footer once; kept by the fragment for later queries
+        for frag in frags: frag.ensure_complete_metadata()
+        # Keys which are not partition keys are conditions on the rows
+        keys   = set([k for x in self._keys for k in x.keys()])
+        filter = self._filter_(param, step, number, time, path,
+                               **dict([(k, v) for k, v in kwargs.items() if not k in keys]))
+        if not filter is None:
+            filter, expr = filter
+            values = dict([(k, [str(x) for x in (v if isinstance(v, (list, tuple)) else [v])])
+                           for k, v in [("param", param), ("_path", path)] if not v is None])
+            frags  = self._prune_(frags, expr, values)
+        # Date range on datasets not partitioned by date
+        if any([x is None for x in self._dates]):
+            dates  = self._date_filter_(begin, end)
+            if not dates is None: filter = dates if filter is None else filter & dates
+        if not filters is None and len(filters) > 0:
+            import pyarrow.parquet as pq
+            extra  = pq.filters_to_expression(filters)
+            filter = extra if filter is None else filter & extra
+        sub    = ds.FileSystemDataset(frags, self.schema, self._dataset.format, self._dataset.filesystem)
+        return sub.scanner(columns = columns, filter = filter)
+
+    def query(self, begin = None, end = None, param = None, step = None, number = None,
+              time = None, columns = None, as_pandas = False, path = None, filters = None, **kwargs):
+        """query(begin = None, end = None, param = None, step = None, number = None,
+              time = None, columns = None, as_pandas = False, path = None, filters = None, **kwargs)
+
+        Retrieves the GRIB index information matching the query.
+
+        Parameters
+        ==========
+        begin : None, str, datetime.date or datetime.datetime
+            First date (inclusive), 'YYYY-MM-DD' if str. Valid date for
+            analysis, date of model initialization for (re)forecasts.
+        end : None, str, datetime.date or datetime.datetime
+            Last date (inclusive). If None, 'begin' is used (one day).
+        param : None, str or list of str
+            Parameter name(s), e.g., '2t' or 't700'.
+        step : None, int or list of int
+            Forecast step(s) in hours.
+        number : None, int or list of int
+            Ensemble member(s); 0 is the control run.
+        time : None, int or list of int
+            Time of the day (hour, UTC).
+        columns : None or list of str
+            Columns to be returned; all if None.
+        as_pandas : bool
+            If True, a pandas.DataFrame is returned instead of a pyarrow.Table.
+        path : None, str or list of str
+            GRIB file(s) ('_path') the messages are stored in.
+        filters : None or list
+            Additional conditions as used by pyarrow.parquet.read_table,
+            e.g., [('month', '=', 1), ('day', '<', 10)].
+        **kwargs :
+            Further partition keys or columns (e.g., product = 'ens', version = 0).
+
+        Returns
+        =======
+        pyarrow.Table or pandas.DataFrame.
+        """
+        if self.cache is None:
+            res = self.scanner(begin, end, param, step, number, time, columns, path, filters, **kwargs).to_table()
+        else:
+            from .result_cache import normalize_filters, _normalize_values_
+            # One entry for all orders of the columns; reordered below
+            cols = None if columns is None else sorted(set(columns))
+            b    = None if begin is None else self._to_date_(begin)
+            qry  = dict(begin = b, end = b if end is None else self._to_date_(end), columns = cols,
+                        filters = normalize_filters(filters))
+            for k, v in dict(param = param, step = step, number = number, time = time, path = path, **kwargs).items():
+                qry[k] = _normalize_values_(v)
+            key = self.cache.key(self.path, self.token, qry)
+            res = self.cache.get(key)
+            if res is None:
+                res = self.scanner(begin, end, param, step, number, time, cols, path, filters, **kwargs).to_table()
+                self.cache.put(key, res)
+            if not columns is None: res = res.select(list(columns))
+        return res.to_pandas() if as_pandas else res
+
+    def write(self, file, format = None, begin = None, end = None, param = None, step = None,
+              number = None, time = None, columns = None, path = None, filters = None, **kwargs):
+        """write(file, format = None, begin = None, end = None, param = None, step = None,
+              number = None, time = None, columns = None, path = None, filters = None, **kwargs)
+
+        Streams the result of a query batch by batch into a file or stream
+        (see output.write_batches); the result is never held in memory
+        as a whole (the cache, if set, is not used).
+
+        Parameters
+        ==========
+        file : str or file-like object
+            Name of the output file or binary file-like object (e.g.,
+            sys.stdout.buffer).
+        format : None or str
+            One of 'arrow' (IPC stream), 'parquet', 'jsonl', or 'csv'. If
+            None, guessed from the file extension (see output.output_format).
+        begin, end, param, step, number, time, columns, path, filters, **kwargs :
+            See query.
+
+        Returns
+        =======
+        Number of rows written.
+        """
+        from .output import output_format, write_batches
+        format  = output_format(file, format)
+        scanner = self.scanner(begin, end, param, step, number, time, columns, path, filters, **kwargs)
+        return write_batches(scanner.to_batches(), scanner.projected_schema, file, format)
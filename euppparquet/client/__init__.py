@@ -0,0 +1,8 @@
+
+
+from .Dataset import Dataset
+from .fetch import Fetcher
+from .cache import MessageCache
+from .result_cache import ResultCache
+from .lookup import LookupIndex
+from .service import QueryService, ServiceClient
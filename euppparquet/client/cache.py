@@ -0,0 +1,290 @@
+
+
+# --------------------------------------------------------------
+# Local on-disk cache for GRIB messages (see Fetcher). Messages
+# are appended to a few large blob files; an SQLite index keeps
+# track of where each message is stored and when it has been
+# used last. Blobs are evicted least recently used first once
+# the cache exceeds its size.
+# --------------------------------------------------------------
+
+import os
+import time
+import uuid
+import sqlite3
+import threading
+
+
+class MessageCache:
+    """MessageCache(dir, max_size = 10737418240, blob_size = None)
+
+    Size-bounded cache for GRIB messages keyed by ('_path', '_offset',
+    '_length', 'version').
+
+    Messages are appended to blob files ('blob-*.bin'); each process
+    writes its own blob so several processes can share one cache
+    directory. The index ('index.sqlite', WAL mode) allows concurrent
+    readers. If the total size exceeds 'max_size' whole blobs are
+    removed, starting with the blob used least recently.
+
+    Parameters
+    ==========
+    dir : str
+        Directory of the cache (created if needed).
+    max_size : positive int
+        Maximum size of the cache in bytes, defaults to 10 GiB.
+    blob_size : None or positive int
+        Size at which a new blob is started; defaults to 1/16 of
+        'max_size' (granularity of the eviction).
+
+    Examples
+    ========
+    >>> from euppparquet.client import Dataset, Fetcher, MessageCache
+    >>> cache = MessageCache("_grib_cache", max_size = 2**30)
+    >>> res   = Dataset("analysis.parquet").query("2017-01-01", "2017-01-31", param = "2t")
+    >>> Fetcher(cache = cache).to_file(res, "2t.grb")
+    >>> cache.stats
+    """
+
+    INDEX = "index.sqlite"
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS messages (
+               path    TEXT NOT NULL,
+               offset  INTEGER NOT NULL,
+               length  INTEGER NOT NULL,
+               version INTEGER NOT NULL,
+               blob    TEXT NOT NULL,
+               pos     INTEGER NOT NULL,
+               atime   REAL NOT NULL,
+               PRIMARY KEY (path, offset, length, version))""",
+        """CREATE INDEX IF NOT EXISTS messages_blob ON messages (blob)""",
+        """CREATE TABLE IF NOT EXISTS blobs (
+               blob    TEXT PRIMARY KEY,
+               size    INTEGER NOT NULL DEFAULT 0)"""
+    ]
+
+    def __init__(self, dir, max_size = 10737418240, blob_size = None):
+        if not isinstance(dir, str):
+            raise TypeError("Input 'dir' must be string.")
+        if blob_size is None: blob_size = max(1, max_size // 16) if isinstance(max_size, int) else None
+        for x in [max_size, blob_size]:
+            if not isinstance(x, int) or not x > 0:
+                raise ValueError("Inputs 'max_size' and 'blob_size' must be positive integers.")
+        if not os.path.isdir(dir): os.makedirs(dir)
+        self.dir       = dir
+        self.max_size  = max_size
+        self.blob_size = blob_size
+        self.stats     = dict(hits = 0, misses = 0, bytes_hit = 0, bytes_stored = 0, evicted = 0)
+        self._lock     = threading.Lock()
+        self._blob     = None      # Blob this object appends to
+        self._con      = sqlite3.connect(os.path.join(dir, self.INDEX), timeout = 30,
+                                         check_same_thread = False)
+        self._con.execute("PRAGMA journal_mode = WAL")
+        for sql in self.SCHEMA: self._con.execute(sql)
+        self._con.commit()
+
+    def __repr__(self):
+        info = self.info()
+        return f"<MessageCache {self.dir}: {info['messages']} messages, {info['size']} of {self.max_size} bytes>"
+
+    def close(self):
+        """close()
+
+        Closes the index of the cache.
+        """
+        with self._lock:
+            if not self._con is None:
+                self._con.close()
+                self._con = None
+
+    def info(self):
+        """info()
+
+        Returns a dictionary with the number of 'messages', 'blobs',
+        and the total 'size' (bytes) of the cache.
+        """
+        with self._lock:
+            n    = self._con.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            b, s = self._con.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return dict(messages = n, blobs = b, size = s)
+
+    def _file_(self, blob):
+        return os.path.join(self.dir, f"blob-{blob}.bin")
+
+    def find_many(self, keys):
+        """find_many(keys)
+
+        Looks up which messages are in the cache without reading them
+        (see get_many); keys not found are counted as misses.
+
+        Parameters
+        ==========
+        keys : list of tuple
+            Tuples ('_path', '_offset', '_length', 'version').
+
+        Returns
+        =======
+        Set with the index (in 'keys') of all messages found.
+        """
+        res = set()
+        with self._lock:
+            for i, key in enumerate(keys):
+                row = self._con.execute("""SELECT 1 FROM messages WHERE path = ? AND offset = ?
+                                           AND length = ? AND version = ?""",
+                                        (str(key[0]), int(key[1]), int(key[2]), int(key[3]))).fetchone()
+                if not row is None: res.add(i)
+            self.stats["misses"] += len(keys) - len(res)
+        return res
+
+    def get_many(self, keys):
+        """get_many(keys)
+
+        Looks up messages.
+
+        Parameters
+        ==========
+        keys : list of tuple
+            Tuples ('_path', '_offset', '_length', 'version').
+
+        Returns
+        =======
+        Dictionary with the index (in 'keys') and the message (bytes)
+        of all messages found.
+        """
+        res, found = dict(), []
+        with self._lock:
+            for i, key in enumerate(keys):
+                row = self._con.execute("""SELECT blob, pos FROM messages WHERE path = ? AND offset = ?
+                                           AND length = ? AND version = ?""",
+                                        (str(key[0]), int(key[1]), int(key[2]), int(key[3]))).fetchone()
+                if row is None: continue
+                found.append((i, key, row))
+
+        # Reading the messages; blobs may have been evicted meanwhile
+        fids = dict()
+        try:
+            for i, key, (blob, pos) in found:
+                try:
+                    if not blob in fids: fids[blob] = open(self._file_(blob), "rb")
+                    fids[blob].seek(pos)
+                    data = fids[blob].read(int(key[2]))
+                except FileNotFoundError:
+                    continue
+                if len(data) == int(key[2]): res[i] = data
+        finally:
+            for fid in fids.values(): fid.close()
+
+        with self._lock:
+            now = time.time()
+            with self._con:
+                self._con.executemany("""UPDATE messages SET atime = ? WHERE path = ? AND offset = ?
+                                         AND length = ? AND version = ?""",
+                                      [(now, str(keys[i][0]), int(keys[i][1]), int(keys[i][2]), int(keys[i][3]))
+                                       for i in res.keys()])
+            self.stats["hits"]      += len(res)
+            self.stats["misses"]    += len(keys) - len(res)
+            self.stats["bytes_hit"] += sum([len(x) for x in res.values()])
+        return res
+
+    def get(self, path, offset, length, version = 0):
+        """get(path, offset, length, version = 0)
+
+        Returns the message (bytes) or None if not in the cache.
+        """
+        return self.get_many([(path, offset, length, version)]).get(0)
+
+    def put(self, path, offset, length, data, version = 0):
+        """put(path, offset, length, data, version = 0)
+
+        Stores a message; see put_many.
+        """
+        self.put_many([(path, offset, length, version)], [data])
+
+    def put_many(self, keys, data):
+        """put_many(keys, data)
+
+        Stores messages; evicts blobs if the cache grows larger
+        than 'max_size'.
+
+        Parameters
+        ==========
+        keys : list of tuple
+            Tuples ('_path', '_offset', '_length', 'version').
+        data : list of bytes
+            The messages.
+        """
+        if not len(keys) == len(data):
+            raise ValueError("Inputs 'keys' and 'data' must be of same length.")
+        for key, x in zip(keys, data):
+            if not len(x) == int(key[2]):
+                raise ValueError("Length of the message does not match '_length'.")
+        if len(keys) == 0: return
+
+        with self._lock:
+            todo = list(zip(keys, data))
+            while len(todo) > 0:
+                self._current_()
+                rows, size = [], 0
+                now  = time.time()
+                with open(self._file_(self._blob), "ab") as fid:
+                    # Append until the blob is full (at least one message)
+                    while len(todo) > 0 and (len(rows) == 0 or fid.tell() < self.blob_size):
+                        key, x = todo.pop(0)
+                        rows.append((str(key[0]), int(key[1]), int(key[2]), int(key[3]), self._blob, fid.tell(), now))
+                        fid.write(x)
+                        size += len(x)
+                with self._con:
+                    self._con.executemany("""INSERT OR REPLACE INTO messages (path, offset, length, version, blob, pos, atime)
+                                             VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+                    self._con.execute("UPDATE blobs SET size = size + ? WHERE blob = ?", (size, self._blob))
+                self.stats["bytes_stored"] += size
+                self._evict_()
+
+    def _current_(self):
+        """_current_()
+
+        Used internally (lock held); starts a new blob if there is none
+        yet, the current one is full, or has been evicted by another process.
+        """
+        if self._blob is None or not os.path.isfile(self._file_(self._blob)) or \
+           os.path.getsize(self._file_(self._blob)) >= self.blob_size or \
+           self._con.execute("SELECT 1 FROM blobs WHERE blob = ?", (self._blob,)).fetchone() is None:
+            self._blob = uuid.uuid4().hex
+            with self._con:
+                self._con.execute("INSERT INTO blobs (blob, size) VALUES (?, 0)", (self._blob,))
+
+    def _evict_(self):
+        """_evict_()
+
+        Used internally (lock held); removes the least recently used
+        blobs until the cache is not larger than 'max_size'. The blob
+        currently written is never removed.
+        """
+        while True:
+            size = self._con.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if size <= self.max_size: return
+            row = self._con.execute("""SELECT b.blob FROM blobs b LEFT JOIN messages m ON b.blob = m.blob
+                                       WHERE b.blob != ? GROUP BY b.blob
+                                       ORDER BY COALESCE(MAX(m.atime), 0) ASC LIMIT 1""",
+                                    (self._blob,)).fetchone()
+            if row is None: return
+            with self._con:
+                n = self._con.execute("DELETE FROM messages WHERE blob = ?", row).rowcount
+                self._con.execute("DELETE FROM blobs WHERE blob = ?", row)
+            if os.path.isfile(self._file_(row[0])): os.remove(self._file_(row[0]))
+            self.stats["evicted"] += n
+
+    def clear(self):
+        """clear()
+
+        Removes all messages from the cache.
+        """
+        with self._lock:
+            blobs = [x[0] for x in self._con.execute("SELECT blob FROM blobs").fetchall()]
+            with self._con:
+                self._con.execute("DELETE FROM messages")
+                self._con.execute("DELETE FROM blobs")
+            for blob in blobs:
+                if os.path.isfile(self._file_(blob)): os.remove(self._file_(blob))
+            self._blob = None
@@ -0,0 +1,319 @@
+
+
+# --------------------------------------------------------------
+# Retrieval of the GRIB messages located by a query (_path,
+# _offset, _length). Messages are grouped by GRIB file, nearby
+# byte ranges merged, and fetched with concurrent HTTP Range
+# requests over one pooled session.
+# --------------------------------------------------------------
+
+import os
+
+from ..session import get_session
+
+# Server the GRIB files are stored on; '_path' is relative to it
+BASEURL = "https://storage.ecmwf.europeanweather.cloud/benchmark-dataset"
+
+# Number of messages read from (or added to) the cache at once
+CACHE_BATCH = 256
+
+
+def _columns_(result, version = False):
+    """_columns_(result, version = False)
+
+    Used internally; returns the lists '_path', '_offset', and '_length'
+    of a query result (pyarrow.Table, pandas.DataFrame, or dict of lists).
+    If 'version = True' the list 'version' is appended (0 if the result
+    has no column 'version', e.g., analysis).
+    """
+    res   = []
+    names = ["_path", "_offset", "_length"] + (["version"] if version else [])
+    for name in names:
+        if hasattr(result, "column_names"):
+            if not name in result.column_names:
+                if name == "version": res.append([0] * result.num_rows); continue
+                raise ValueError(f"Column '{name}' missing in query result.")
+            res.append(result.column(name).to_pylist())
+        else:
+            if not name in result:
+                if name == "version": res.append([0] * len(res[0])); continue
+                raise ValueError(f"Column '{name}' missing in query result.")
+            col = result[name]
+            res.append(col.tolist() if hasattr(col, "tolist") else list(col))
+    return res
+
+
+def coalesce(paths, offsets, lengths, gap = 0, max_size = None):
+    """coalesce(paths, offsets, lengths, gap = 0, max_size = None)
+
+    Groups messages by GRIB file and merges their byte ranges if the
+    gap between two messages is not larger than 'gap' bytes.
+
+    Parameters
+    ==========
+    paths : list of str
+        GRIB files ('_path').
+    offsets : list of int
+        Start of the messages ('_offset').
+    lengths : list of int
+        Length of the messages ('_length').
+    gap : int
+        Maximum gap (bytes) between two messages fetched by one request.
+    max_size : None or int
+        If set, ranges are not extended beyond this size (bytes); single
+        messages larger than 'max_size' are fetched as one range.
+
+    Returns
+    =======
+    List of dictionaries with 'path', 'start', 'end' (exclusive), and
+    'rows' (index of the messages in the input) sorted by file and offset.
+    """
+    if not len(paths) == len(offsets) == len(lengths):
+        raise ValueError("Inputs 'paths', 'offsets', and 'lengths' must be of same length.")
+    if not isinstance(gap, int) or gap < 0:
+        raise ValueError("Input 'gap' must be a non-negative integer.")
+
+    res = []
+    cur = None
+    for i in sorted(range(len(paths)), key = lambda i: (paths[i], offsets[i])):
+        start, end = int(offsets[i]), int(offsets[i]) + int(lengths[i])
+        if cur is not None and cur["path"] == paths[i] and start <= cur["end"] + gap and \
+           (max_size is None or max(cur["end"], end) - cur["start"] <= max_size):
+            cur["end"] = max(cur["end"], end)
+            cur["rows"].append(i)
+        else:
+            cur = dict(path = paths[i], start = start, end = end, rows = [i])
+            res.append(cur)
+    return res
+
+
+class Fetcher:
+    """Fetcher(baseurl = BASEURL, gap = 131072, max_size = 33554432, jobs = 8,
+            check = True, session = None, cache = None)
+
+    Fetches the GRIB messages of a query result (see Dataset.query).
+    Messages are grouped by GRIB file and nearby byte ranges merged
+    (see coalesce); the ranges are downloaded with concurrent HTTP Range
+    requests. Servers ignoring the Range header are supported (the
+    response is read up to the end of the range).
+
+    Parameters
+    ==========
+    baseurl : str
+        URL the GRIB files ('_path') are relative to. Can also be a local
+        HTTP server (e.g., 'http://localhost:8000').
+    gap : int
+        Maximum gap (bytes) between two messages merged into one request,
+        defaults to 128 KiB. 0 only merges adjacent messages.
+    max_size : int
+        Maximum size of a merged range (bytes), defaults to 32 MiB.
+    jobs : positive int
+        Number of concurrent requests, defaults to 8.
+    check : bool
+        If True (default) each message is checked to start with 'GRIB'
+        and end with '7777'.
+    session : None or requests.Session
+        Session to be used; a pooled session is created if None.
+    cache : None or MessageCache
+        If set, messages are looked up in the cache first; messages
+        downloaded are added to the cache.
+
+    Examples
+    ========
+    >>> from euppparquet.client import Dataset, Fetcher
+    >>> res = Dataset("analysis.parquet").query("2017-01-01", "2017-01-31", param = "2t")
+    >>> Fetcher().to_file(res, "2t.grb")
+    """
+
+    def __init__(self, baseurl = BASEURL, gap = 131072, max_size = 33554432, jobs = 8,
+                 check = True, session = None, cache = None):
+        if not isinstance(baseurl, str):
+            raise TypeError("Input 'baseurl' must be string.")
+        for x in [max_size, jobs]:
+            if not isinstance(x, int) or not x > 0:
+                raise ValueError("Inputs 'max_size' and 'jobs' must be positive integers.")
+        self.baseurl  = baseurl.rstrip("/")
+        self.gap      = gap
+        self.max_size = max_size
+        self.jobs     = jobs
+        self.check    = check
+        self.session  = get_session(jobs, retries = 3) if session is None else session
+        self.cache    = cache
+        self.stats    = dict(messages = 0, requests = 0, bytes_requested = 0, bytes_messages = 0)
+
+    def __repr__(self):
+        return f"<Fetcher {self.baseurl} (gap = {self.gap}, jobs = {self.jobs})>"
+
+    def url(self, path):
+        """url(path)
+
+        Returns the URL of a GRIB file ('_path').
+        """
+        if path.startswith("http://") or path.startswith("https://"): return path
+        return f"{self.baseurl}/{path.lstrip('/')}"
+
+    def plan(self, result):
+        """plan(result)
+
+        Returns the byte ranges needed for a query result (see coalesce).
+        """
+        paths, offsets, lengths = _columns_(result)
+        return coalesce(paths, offsets, lengths, gap = self.gap, max_size = self.max_size)
+
+    def _get_(self, path, start, end):
+        """_get_(path, start, end)
+
+        Used internally; downloads bytes [start, end) of a GRIB file.
+        """
+        url = self.url(path)
+        req = self.session.get(url, headers = {"Range": f"bytes={start}-{end - 1}"}, stream = True)
+        try:
+            if req.status_code == 206:
+                data = req.content
+            elif req.status_code == 200:
+                # Range not supported by the server; skip to the start
+                data, pos = [], 0
+                for chunk in req.iter_content(1024 * 1024):
+                    if pos + len(chunk) > start: data.append(chunk[max(0, start - pos):end - pos])
+                    pos += len(chunk)
+                    if pos >= end: break
+                data = b"".join(data)
+            else:
+                raise Exception(f"Got {req.status_code} for {url}")
+        finally:
+            req.close()
+        if not len(data) == end - start:
+            raise Exception(f"Got {len(data)} instead of {end - start} bytes from {url}")
+        return data
+
+    def _fetch_range_(self, rng, offsets, lengths):
+        """_fetch_range_(rng, offsets, lengths)
+
+        Used internally; downloads one range and splits it into messages.
+        Returns a list of tuples (row, bytes).
+        """
+        data = self._get_(rng["path"], rng["start"], rng["end"])
+        res  = []
+        for i in rng["rows"]:
+            pos = int(offsets[i]) - rng["start"]
+            msg = data[pos:pos + int(lengths[i])]
+            if self.check and not (msg[:4] == b"GRIB" and msg[-4:] == b"7777"):
+                raise Exception(f"Not a GRIB message: {rng['path']} at offset {offsets[i]}")
+            res.append((i, msg))
+        return res
+
+    def iter_messages(self, result):
+        """iter_messages(result)
+
+        Generator yielding the messages of a query result as tuples
+        (row, bytes) where 'row' is the index of the message in 'result'.
+        Messages are yielded ordered by GRIB file and offset; at most
+        2 * 'jobs' ranges are held in memory. If a cache is set, only
+        messages not found in the cache are downloaded; cached messages
+        are read in batches of CACHE_BATCH messages when needed (messages
+        evicted meanwhile are downloaded).
+
+        Parameters
+        ==========
+        result : pyarrow.Table or pandas.DataFrame
+            Query result with the columns '_path', '_offset', and '_length'.
+        """
+        paths, offsets, lengths, versions = _columns_(result, version = True)
+        order = sorted(range(len(paths)), key = lambda i: (paths[i], offsets[i]))
+
+        key    = lambda i: (paths[i], offsets[i], lengths[i], versions[i])
+        found  = set() if self.cache is None else self.cache.find_many([key(i) for i in order])
+        cached = [order[k] for k in sorted(found)]
+        where  = dict([(i, k) for k, i in enumerate(cached)])
+
+        # Messages to be downloaded (same order as 'order')
+        miss    = [i for i in order if not i in where]
+        fetched = self._fetch_ranges_([paths[i] for i in miss], [offsets[i] for i in miss],
+                                      [lengths[i] for i in miss])
+        hits, loaded, store = dict(), set(), []
+        for i in order:
+            if i in where:
+                # Next batch of cached messages
+                if not i in loaded:
+                    batch  = cached[where[i]:where[i] + CACHE_BATCH]
+                    hits   = dict([(batch[k], v) for k, v in self.cache.get_many([key(x) for x in batch]).items()])
+                    loaded = set(batch)
+                msg = hits.pop(i, None)
+                if msg is None:
+                    # Evicted since looked up
+                    rng = dict(path = paths[i], start = int(offsets[i]), end = int(offsets[i]) + int(lengths[i]))
+                    msg = self._fetch_range_(dict(rng, rows = [i]), offsets, lengths)[0][1]
+                    self.stats["requests"]        += 1
+                    self.stats["bytes_requested"] += len(msg)
+                    store.append((i, msg))
+            else:
+                row, msg = next(fetched)
+                if not self.cache is None: store.append((i, msg))
+            # Messages are added to the cache in batches
+            if len(store) >= CACHE_BATCH or (len(store) > 0 and i == order[-1]):
+                self.cache.put_many([(paths[k], offsets[k], lengths[k], versions[k]) for k, x in store],
+                                    [x for k, x in store])
+                store = []
+            self.stats["messages"]       += 1
+            self.stats["bytes_messages"] += len(msg)
+            yield i, msg
+
+    def _fetch_ranges_(self, paths, offsets, lengths):
+        """_fetch_ranges_(paths, offsets, lengths)
+
+        Generator used internally; downloads the messages (see coalesce)
+        with up to 'jobs' concurrent requests. Yields tuples (index, bytes)
+        ordered by GRIB file and offset.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from collections import deque
+
+        ranges = coalesce(paths, offsets, lengths, gap = self.gap, max_size = self.max_size)
+        if len(ranges) == 0: return
+
+        with ThreadPoolExecutor(max_workers = self.jobs) as pool:
+            queue = deque()
+            todo  = iter(ranges)
+            def submit():
+                rng = next(todo, None)
+                if rng is not None: queue.append((rng, pool.submit(self._fetch_range_, rng, offsets, lengths)))
+            for i in range(2 * self.jobs): submit()
+            while len(queue) > 0:
+                rng, future = queue.popleft()
+                msgs = future.result()
+                submit()
+                self.stats["requests"]        += 1
+                self.stats["bytes_requested"] += rng["end"] - rng["start"]
+                for row, msg in msgs: yield row, msg
+
+    def to_file(self, result, file):
+        """to_file(result, file)
+
+        Writes all messages of a query result into one (combined) GRIB
+        file, ordered by GRIB file and offset. The file is written under
+        a temporary name first and renamed once complete.
+
+        Parameters
+        ==========
+        result : pyarrow.Table or pandas.DataFrame
+            Query result with the columns '_path', '_offset', and '_length'.
+        file : str
+            Name of the GRIB file to be written.
+
+        Returns
+        =======
+        Number of messages written.
+        """
+        if not isinstance(file, str):
+            raise TypeError("Input 'file' must be string.")
+        tmp = f"{file}.part"
+        n   = 0
+        try:
+            with open(tmp, "wb") as fid:
+                for row, msg in self.iter_messages(result):
+                    fid.write(msg)
+                    n += 1
+            os.replace(tmp, file)
+        finally:
+            if os.path.isfile(tmp): os.remove(tmp)
+        return n
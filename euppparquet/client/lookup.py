@@ -0,0 +1,244 @@
+
+
+# --------------------------------------------------------------
+# Point lookups (date, time, step, number, param, ...) to message
+# locations ('_path', '_offset', '_length') without scanning the
+# parquet dataset. The index (see server.lookup.update_lookup) is
+# stored in '<dataset>/_lookup' as one or more segments; each
+# segment holds the keys (integer coded, sorted) and the message
+# locations as numpy arrays which are memory-mapped. Requires
+# numpy only.
+# --------------------------------------------------------------
+
+import os
+import json
+import datetime as dt
+
+# Directory of the index inside the dataset and list of segments
+LOOKUP_DIR   = "_lookup"
+LOOKUP_FILE  = "index.json"
+
+# Key fields in the order used for the (composite) key; fields not
+# available in a dataset are skipped (e.g., 'hdate' for forecasts)
+LOOKUP_FIELDS = ["date", "time", "step", "number", "param", "hdate", "version", "product"]
+
+# Fields stored as strings; all others as integers (missing: -1)
+LOOKUP_STRINGS = ["param", "product"]
+
+# Arrays of a segment (file name: numpy file)
+LOOKUP_ARRAYS = ["keys", "path", "offset", "length"]
+
+
+def _to_array_(x, dtype = None):
+    """_to_array_(x, dtype = None)
+
+    Used internally; converts a scalar or sequence (list, numpy array,
+    pandas or pyarrow array) into a one dimensional numpy array.
+    """
+    import numpy as np
+    if isinstance(x, (str, bytes, dt.date)) or np.ndim(x) == 0: x = [x]
+    return np.asarray(x if isinstance(x, np.ndarray) else list(x), dtype = dtype).reshape(-1)
+
+
+def _to_int_date_(x):
+    """_to_int_date_(x)
+
+    Used internally; converts dates (int YYYYMMDD, str 'YYYY-MM-DD',
+    datetime.date, or datetime.datetime; scalar or sequence) into an
+    array of integers (YYYYMMDD).
+    """
+    import numpy as np
+    x = _to_array_(x)
+    if x.dtype.kind in "iu": return x.astype(np.int64)
+    def conv(x):
+        if isinstance(x, str):    x = dt.datetime.strptime(x, "%Y-%m-%d")
+        if isinstance(x, (dt.date, dt.datetime)): return x.year * 10000 + x.month * 100 + x.day
+        return int(x)
+    return np.asarray([conv(v) for v in x], dtype = np.int64)
+
+
+class LookupIndex:
+    """LookupIndex(dataset)
+
+    Memory-mapped point-lookup index of a dataset (see
+    server.lookup.update_lookup). Answers batches of lookups
+    (e.g., member 17, '2t', step 96 of the 2017-06-03 00 UTC
+    run) with a binary search on the sorted keys, without
+    reading the dataset.
+
+    Parameters
+    ==========
+    dataset : str
+        Path to the (local) parquet dataset (e.g., 'forecast.parquet').
+
+    Examples
+    ========
+    >>> from euppparquet.client import LookupIndex
+    >>> idx = LookupIndex("forecast.parquet")
+    >>> idx.lookup(date = "2017-06-03", param = "2t", step = [96, 102], number = 17, product = "ens")
+    """
+
+    def __init__(self, dataset):
+        if not isinstance(dataset, str):
+            raise TypeError("Input 'dataset' must be string.")
+        self.dataset = dataset
+        self.refresh()
+
+    def __repr__(self):
+        return f"<LookupIndex {self.dataset}: {len(self._segments)} segments, {len(self)} messages>"
+
+    def __len__(self):
+        return sum([len(x["keys"]) for x in self._segments])
+
+    def refresh(self):
+        """refresh()
+
+        (Re-)loads the segments of the index; needed if the index has
+        been updated since the object has been created.
+        """
+        import numpy as np
+
+        dir  = os.path.join(self.dataset, LOOKUP_DIR)
+        file = os.path.join(dir, LOOKUP_FILE)
+        if not os.path.isfile(file):
+            raise Exception(f"Dataset '{self.dataset}' has no lookup index (see server.lookup.update_lookup).")
+        with open(file, "r") as fid: self.info = json.load(fid)
+
+        self._segments = []
+        for name in self.info["segments"]:
+            with open(os.path.join(dir, name, "meta.json"), "r") as fid: meta = json.load(fid)
+            seg = dict([(x, np.load(os.path.join(dir, name, f"{x}.npy"), mmap_mode = "r")) for x in LOOKUP_ARRAYS])
+            seg["paths"]  = np.asarray(meta["paths"], dtype = str)
+            seg["fields"] = [(x["name"], np.asarray(x["values"], dtype = str if x["name"] in LOOKUP_STRINGS \
+                              else np.int64), x["shift"]) for x in meta["fields"]]
+            self._segments.append(seg)
+
+    @property
+    def fields(self):
+        """Key fields of the index (list of str)."""
+        return [x for x in LOOKUP_FIELDS if x in self.info["fields"]]
+
+    def _query_(self, query):
+        """_query_(query)
+
+        Used internally; converts the values of the lookup into numpy
+        arrays of the same length (scalars are broadcasted). Returns
+        the number of lookups and the dictionary of arrays.
+        """
+        import numpy as np
+
+        for key in query.keys():
+            if not key in self.fields:
+                raise ValueError(f"Lookup index of '{self.dataset}' has no field '{key}' (fields: {self.fields}).")
+
+        res = dict()
+        for key, val in query.items():
+            if val is None: continue
+            if key in ["date", "hdate"]:
+                val = _to_int_date_(val)
+            elif key in LOOKUP_STRINGS:
+                val = _to_array_(val, str)
+            else:
+                val = _to_array_(val, np.int64)
+                if key == "time": val = val * 100         # Hour to HHMM (as stored)
+            res[key] = val
+
+        n = max([len(x) for x in res.values()] + [1])
+        for key, val in res.items():
+            if len(val) == 1:
+                res[key] = np.repeat(val, n)
+            elif not len(val) == n:
+                raise ValueError("All inputs must be scalars or of the same length.")
+        return n, res
+
+    def _search_(self, seg, n, query):
+        """_search_(seg, n, query)
+
+        Used internally; searches one segment. Fields not specified match
+        any value (lookups are expanded for each value of the field).
+        Returns the index of the lookup and the first and last (exclusive)
+        position of the matching records in the segment.
+        """
+        import numpy as np
+
+        qidx = np.arange(n)
+        keys = np.zeros(n, dtype = np.uint64)
+        ok   = np.ones(n, dtype = bool)
+        for name, values, shift in seg["fields"]:
+            if name in query:
+                val  = query[name][qidx]
+                pos  = np.searchsorted(values, val)
+                ok  &= (pos < len(values)) & (values[np.minimum(pos, len(values) - 1)] == val)
+                code = pos
+            else:
+                k    = len(values)
+                qidx = np.repeat(qidx, k)
+                keys = np.repeat(keys, k)
+                ok   = np.repeat(ok, k)
+                code = np.tile(np.arange(k), len(qidx) // k)
+            keys |= code.astype(np.uint64) << np.uint64(shift)
+
+        qidx, keys = qidx[ok], keys[ok]
+        lo = np.searchsorted(seg["keys"], keys, side = "left")
+        hi = np.searchsorted(seg["keys"], keys, side = "right")
+        hit = hi > lo
+        return qidx[hit], lo[hit], hi[hit]
+
+    def lookup(self, all = False, **query):
+        """lookup(all = False, **query)
+
+        Returns the location of the GRIB messages for a batch of lookups.
+
+        Parameters
+        ==========
+        all : bool
+            If False (default), the first match of each lookup is returned
+            (arrays aligned with the lookups). If True, all matches are
+            returned; 'query' then holds the index of the lookup.
+        **query :
+            Values (scalar or list/array; all of the same length) of the
+            key fields (see fields): 'date' (YYYYMMDD, 'YYYY-MM-DD', or
+            datetime.date), 'time' (hour, UTC), 'step' (hours), 'number'
+            (0 for the control run), 'param', 'hdate', 'version', 'product'.
+            Fields not specified match any value.
+
+        Returns
+        =======
+        Dictionary of numpy arrays '_path', '_offset', and '_length';
+        'found' (bool) if 'all = False' ('_offset' and '_length' -1, '_path'
+        empty if not found), 'query' if 'all = True'.
+        """
+        import numpy as np
+
+        n, query = self._query_(query)
+
+        if not all:
+            found  = np.zeros(n, dtype = bool)
+            path   = np.full(n, "", dtype = object)
+            offset = np.full(n, -1, dtype = np.int64)
+            length = np.full(n, -1, dtype = np.int64)
+            for seg in self._segments:
+                qidx, lo, hi = self._search_(seg, n, query)
+                # First match of each lookup (not found in previous segments)
+                keep = ~found[qidx]
+                qidx, lo = qidx[keep], lo[keep]
+                qidx, first = np.unique(qidx, return_index = True)
+                lo = lo[first]
+                found[qidx]  = True
+                path[qidx]   = seg["paths"][seg["path"][lo]]
+                offset[qidx] = seg["offset"][lo]
+                length[qidx] = seg["length"][lo]
+            return dict(_path = path.astype(str), _offset = offset, _length = length, found = found)
+
+        res = dict(query = [], _path = [], _offset = [], _length = [])
+        for seg in self._segments:
+            qidx, lo, hi = self._search_(seg, n, query)
+            cnt = hi - lo
+            pos = np.repeat(lo - np.cumsum(cnt) + cnt, cnt) + np.arange(cnt.sum())
+            res["query"].append(np.repeat(qidx, cnt))
+            res["_path"].append(seg["paths"][seg["path"][pos]])
+            res["_offset"].append(np.asarray(seg["offset"][pos]))
+            res["_length"].append(np.asarray(seg["length"][pos]))
+        res = dict([(k, np.concatenate(v) if len(v) > 0 else np.array([], dtype = np.int64)) for k, v in res.items()])
+        order = np.argsort(res["query"], kind = "stable")
+        return dict([(k, v[order]) for k, v in res.items()])
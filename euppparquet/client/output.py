@@ -0,0 +1,128 @@
+
+
+# --------------------------------------------------------------
+# Streaming output of query results (see Dataset.write). Record
+# batches are written as they come from the dataset scanner as
+# Arrow IPC stream, Parquet, JSON lines, or CSV; memory does not
+# depend on the number of rows matching.
+# --------------------------------------------------------------
+
+import os
+import json
+
+OUTPUT_FORMATS = ["arrow", "parquet", "jsonl", "csv"]
+
+# File extensions used to guess the format (see output_format)
+OUTPUT_EXTENSIONS = {".arrow": "arrow", ".arrows": "arrow", ".ipc": "arrow", ".parquet": "parquet",
+                     ".jsonl": "jsonl", ".ndjson": "jsonl", ".csv": "csv"}
+
+# Rows buffered per Parquet row group
+PARQUET_ROW_GROUP = 65536
+
+
+def output_format(file, format = None):
+    """output_format(file, format = None)
+
+    Returns the output format; 'format' if set, else guessed from the
+    extension of 'file'. Raises a ValueError if neither is possible.
+    """
+    if format is None:
+        ext = os.path.splitext(file)[1].lower() if isinstance(file, str) else ""
+        if not ext in OUTPUT_EXTENSIONS:
+            raise ValueError(f"Cannot guess the output format of '{file}'; one of {OUTPUT_FORMATS} required.")
+        format = OUTPUT_EXTENSIONS[ext]
+    if not format in OUTPUT_FORMATS:
+        raise ValueError(f"Input 'format' must be one of {OUTPUT_FORMATS}.")
+    return format
+
+
+def _plain_schema_(schema):
+    """_plain_schema_(schema)
+
+    Used internally; schema with dictionary columns replaced by their
+    value type. Dictionaries differ between fragments, which the IPC
+    stream, CSV, and JSON outputs cannot represent.
+    """
+    import pyarrow as pa
+    return pa.schema([pa.field(x.name, x.type.value_type, x.nullable) if pa.types.is_dictionary(x.type) else x
+                      for x in schema])
+
+
+def _plain_batch_(batch, schema):
+    """_plain_batch_(batch, schema)
+
+    Used internally; decodes the dictionary columns of a record batch.
+    """
+    import pyarrow as pa
+    cols = [x.dictionary_decode() if pa.types.is_dictionary(x.type) else x for x in batch.columns]
+    return pa.RecordBatch.from_arrays(cols, schema = schema)
+
+
+def write_batches(batches, schema, sink, format):
+    """write_batches(batches, schema, sink, format)
+
+    Writes record batches one by one into a file or stream. Batches are
+    neither collected nor sorted; except for Parquet (rows buffered up to
+    one row group) each batch is written and flushed when it arrives.
+
+    Parameters
+    ==========
+    batches : iterable of pyarrow.RecordBatch
+        E.g., from pyarrow.dataset.Scanner.to_batches.
+    schema : pyarrow.Schema
+        Schema of the batches.
+    sink : str or file-like object
+        Name of the output file or binary file-like object (e.g.,
+        sys.stdout.buffer).
+    format : str
+        One of 'arrow' (IPC stream), 'parquet', 'jsonl', or 'csv'.
+
+    Returns
+    =======
+    Number of rows written.
+    """
+    import pyarrow as pa
+
+    if not format in OUTPUT_FORMATS:
+        raise ValueError(f"Input 'format' must be one of {OUTPUT_FORMATS}.")
+
+    fid  = open(sink, "wb") if isinstance(sink, str) else sink
+    out  = pa.PythonFile(fid, mode = "w")
+    rows = 0
+    try:
+        if format == "parquet":
+            import pyarrow.parquet as pq
+            buffer, n = [], 0
+            with pq.ParquetWriter(out, schema) as writer:
+                for batch in batches:
+                    buffer.append(batch)
+                    n += batch.num_rows
+                    if n >= PARQUET_ROW_GROUP:
+                        writer.write_table(pa.Table.from_batches(buffer, schema = schema))
+                        rows, buffer, n = rows + n, [], 0
+                if n > 0: writer.write_table(pa.Table.from_batches(buffer, schema = schema))
+                rows += n
+        else:
+            plain = _plain_schema_(schema)
+            if format == "arrow":
+                import pyarrow.ipc
+                writer = pa.ipc.new_stream(out, plain)
+            elif format == "csv":
+                import pyarrow.csv
+                writer = pa.csv.CSVWriter(out, plain)
+            else:
+                writer = None
+            for batch in batches:
+                if batch.num_rows == 0: continue
+                batch = _plain_batch_(batch, plain)
+                if writer is None:
+                    fid.write("".join([json.dumps(x) + "\n" for x in batch.to_pylist()]).encode())
+                else:
+                    writer.write_batch(batch)
+                fid.flush()
+                rows += batch.num_rows
+            if writer is not None: writer.close()
+        fid.flush()
+    finally:
+        if isinstance(sink, str): fid.close()
+    return rows
@@ -0,0 +1,272 @@
+
+
+# --------------------------------------------------------------
+# Cache for query results (see Dataset.query). Results are keyed
+# by the normalized query (order and duplicates of values and
+# filters do not matter) and the token of the dataset (set of
+# fragments, snapshot); results of a previous token are removed
+# when first seen with a new token. Kept in memory (LRU) and as
+# Arrow (Feather) files on disk.
+# --------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def _normalize_values_(x):
+    """_normalize_values_(x)
+
+    Used internally; returns the sorted list of distinct values (as str)
+    or None.
+    """
+    if x is None: return None
+    x = list(x) if isinstance(x, (list, tuple, set)) else [x]
+    return sorted(set([str(v) for v in x]))
+
+
+def normalize_filters(filters):
+    """normalize_filters(filters)
+
+    Normalizes filters as used by pyarrow.parquet.read_table (list of
+    tuples, or list of lists of tuples for disjunctions). Conditions are
+    sorted, duplicates removed ('==' is the same as '='); values of
+    'in'/'not in' conditions are sorted.
+
+    Returns
+    =======
+    None or list of conjunctions (each a sorted list of [column, op, value]).
+
+    Examples
+    ========
+    >>> normalize_filters([("month", "=", 1), ("year", "=", 2017), ("month", "=", 1)])
+    [[['month', '=', 1], ['year', '=', 2017]]]
+    """
+    if filters is None: return None
+    filters = list(filters)
+    if len(filters) == 0: return []
+    # One conjunction if the first element is a condition (as pyarrow does)
+    dnf = [filters] if isinstance(filters[0][0], str) else filters
+    res = set()
+    for conj in dnf:
+        x = set()
+        for col, op, val in conj:
+            op = "=" if op == "==" else op.lower()
+            if isinstance(val, (list, tuple, set)): val = sorted(set(val), key = str)
+            x.add(json.dumps([str(col), op, val], default = str))
+        res.add(tuple(sorted(x)))
+    return [[json.loads(y) for y in x] for x in sorted(res)]
+
+
+class ResultCache:
+    """ResultCache(dir = None, max_size = 1073741824, memory_size = 268435456)
+
+    Cache for query results (pyarrow.Table) of one or several datasets;
+    see Dataset (argument 'cache'). Results are kept in memory (least
+    recently used results dropped beyond 'memory_size') and, if 'dir'
+    is set, as uncompressed Arrow (Feather) files which are memory-mapped
+    when read (least recently used files removed beyond 'max_size').
+
+    Entries are keyed by the dataset token (see Dataset.token), which
+    changes with the set of fragments or the snapshot of the dataset.
+    When a dataset is seen with a new token, all entries of the previous
+    token are removed.
+
+    Parameters
+    ==========
+    dir : None or str
+        Directory of the cache (created if needed); memory only if None.
+    max_size : positive int
+        Maximum size of the files in 'dir' (bytes), defaults to 1 GiB.
+    memory_size : positive int
+        Maximum size of the results kept in memory (bytes), defaults
+        to 256 MiB.
+
+    Examples
+    ========
+    >>> from euppparquet.client import Dataset, ResultCache
+    >>> cache = ResultCache("_result_cache")
+    >>> ds    = Dataset("analysis.parquet", cache = cache)
+    >>> ds.query("2017-01-01", "2017-01-31", param = "2t")
+    >>> ds.query("2017-01-01", "2017-01-31", param = ["2t", "2t"])    # Hit
+    >>> cache.stats, cache.hit_rate
+    """
+
+    def __init__(self, dir = None, max_size = 1073741824, memory_size = 268435456):
+        if not dir is None and not isinstance(dir, str):
+            raise TypeError("Input 'dir' must be None or string.")
+        for x in [max_size, memory_size]:
+            if not isinstance(x, int) or not x > 0:
+                raise ValueError("Inputs 'max_size' and 'memory_size' must be positive integers.")
+        if not dir is None and not os.path.isdir(dir): os.makedirs(dir)
+        self.dir         = dir
+        self.max_size    = max_size
+        self.memory_size = memory_size
+        self.stats       = dict(hits = 0, memory_hits = 0, disk_hits = 0, misses = 0, stored = 0,
+                                evicted = 0, invalidated = 0)
+        self._lock       = threading.Lock()
+        self._memory     = OrderedDict()     # key: pyarrow.Table (least recently used first)
+        self._nbytes     = 0
+        self._tokens     = dict()            # Current token per dataset
+
+    def __repr__(self):
+        return f"<ResultCache {self.dir if self.dir else ':memory:'}: {len(self._memory)} results in memory>"
+
+    @property
+    def hit_rate(self):
+        """Fraction of the lookups answered from the cache (None if no lookups yet)."""
+        n = self.stats["hits"] + self.stats["misses"]
+        return None if n == 0 else self.stats["hits"] / n
+
+    @staticmethod
+    def key(dataset, token, query):
+        """key(dataset, token, query)
+
+        Returns the key (str) of a query; 'dataset' identifies the dataset
+        (e.g., its path), 'token' its state (see Dataset.token), and
+        'query' is a dictionary of normalized query arguments.
+        """
+        ds  = hashlib.sha1(str(dataset).encode()).hexdigest()[:12]
+        qry = hashlib.sha1(json.dumps(query, sort_keys = True, default = str).encode()).hexdigest()
+        return f"{ds}-{token[:16]}-{qry[:24]}"
+
+    def _file_(self, key):
+        return os.path.join(self.dir, f"{key}.arrow")
+
+    def _invalidate_(self, key):
+        """_invalidate_(key)
+
+        Used internally (lock held); removes all entries of the dataset
+        of 'key' which belong to another token.
+        """
+        ds, token = key.split("-")[:2]
+        if self._tokens.get(ds) == token: return
+        self._tokens[ds] = token
+        old = [k for k in self._memory.keys() if k.startswith(ds + "-") and not k.split("-")[1] == token]
+        for k in old: self._nbytes -= self._memory.pop(k).nbytes
+        n = len(old)
+        if not self.dir is None:
+            for file in os.listdir(self.dir):
+                if file.startswith(ds + "-") and file.endswith(".arrow") and not file.split("-")[1] == token:
+                    try:
+                        os.remove(os.path.join(self.dir, file))
+                        n += 1
+                    except FileNotFoundError:
+                        pass
+        self.stats["invalidated"] += n
+
+    def get(self, key):
+        """get(key)
+
+        Returns the result (pyarrow.Table) or None if not in the cache.
+        """
+        import pyarrow.feather as feather
+        with self._lock:
+            self._invalidate_(key)
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["memory_hits"] += 1
+                return self._memory[key]
+
+        res = None
+        if not self.dir is None and os.path.isfile(self._file_(key)):
+            try:
+                res = feather.read_table(self._file_(key), memory_map = True)
+                os.utime(self._file_(key))               # Used last (eviction)
+            except (FileNotFoundError, OSError):
+                res = None
+
+        with self._lock:
+            if res is None:
+                self.stats["misses"] += 1
+            else:
+                self.stats["hits"] += 1
+                self.stats["disk_hits"] += 1
+                self._remember_(key, res)
+        return res
+
+    def put(self, key, table):
+        """put(key, table)
+
+        Stores a result (pyarrow.Table).
+        """
+        import pyarrow.feather as feather
+        with self._lock:
+            self._invalidate_(key)
+            self._remember_(key, table)
+            self.stats["stored"] += 1
+        if self.dir is None or table.nbytes > self.max_size: return
+
+        tmp = os.path.join(self.dir, f".{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        feather.write_feather(table, tmp, compression = "uncompressed")
+        os.replace(tmp, self._file_(key))
+        with self._lock: self._evict_()
+
+    def _remember_(self, key, table):
+        """_remember_(key, table)
+
+        Used internally (lock held); keeps a result in memory and drops
+        the least recently used results beyond 'memory_size'.
+        """
+        if key in self._memory: self._nbytes -= self._memory.pop(key).nbytes
+        if table.nbytes > self.memory_size: return
+        self._memory[key] = table
+        self._nbytes     += table.nbytes
+        while self._nbytes > self.memory_size:
+            self._nbytes -= self._memory.popitem(last = False)[1].nbytes
+
+    def _evict_(self):
+        """_evict_()
+
+        Used internally (lock held); removes the least recently used
+        files until the files in 'dir' are not larger than 'max_size'.
+        """
+        files = []
+        for file in os.listdir(self.dir):
+            if not file.endswith(".arrow"): continue
+            try:
+                st = os.stat(os.path.join(self.dir, file))
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, file))
+        size = sum([x[1] for x in files])
+        for mtime, nbytes, file in sorted(files):
+            if size <= self.max_size: break
+            try:
+                os.remove(os.path.join(self.dir, file))
+                self.stats["evicted"] += 1
+            except FileNotFoundError:
+                pass
+            size -= nbytes
+
+    def info(self):
+        """info()
+
+        Returns a dictionary with the number of results and bytes in
+        memory and on disk, and the statistics (see stats, hit_rate).
+        """
+        with self._lock:
+            res = dict(memory = len(self._memory), memory_bytes = self._nbytes, files = 0, size = 0)
+        if not self.dir is None:
+            files = [os.path.join(self.dir, x) for x in os.listdir(self.dir) if x.endswith(".arrow")]
+            res["files"] = len(files)
+            res["size"]  = sum([os.path.getsize(x) for x in files if os.path.isfile(x)])
+        res.update(self.stats)
+        res["hit_rate"] = self.hit_rate
+        return res
+
+    def clear(self):
+        """clear()
+
+        Removes all results from the cache.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._nbytes = 0
+            self._tokens = dict()
+            if not self.dir is None:
+                for file in os.listdir(self.dir):
+                    if file.endswith(".arrow"): os.remove(os.path.join(self.dir, file))
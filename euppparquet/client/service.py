@@ -0,0 +1,529 @@
+
+
+# --------------------------------------------------------------
+# Long-running query service. Keeps the datasets (fragments,
+# footers, bloom filters; see Dataset) open in one process and
+# answers queries over a local Unix socket or HTTP (JSON, or Arrow
+# IPC, Parquet, JSON lines, CSV streamed); concurrent clients are
+# handled by a thread pool.
+# The client (ServiceClient) only needs the standard library and
+# is used by eupp_get_parquet if a service is running.
+# --------------------------------------------------------------
+
+import os
+import json
+import time
+import socket
+import threading
+import http.client
+import http.server
+import socketserver
+from .output import OUTPUT_FORMATS
+
+# Default address of the service; Unix socket in the working directory
+# (where the datasets '<product>.parquet' are). Can be overruled by the
+# environment variable (socket path or 'http://host:port').
+SOCKET      = ".euppparquet.sock"
+SERVICE_ENV = "EUPP_PARQUET_SERVICE"
+
+PRODUCTS = ["analysis", "forecast", "reforecast"]
+FORMATS  = ["json"] + OUTPUT_FORMATS
+
+# Content types of the responses; all but 'json' are streamed
+CONTENT_TYPES = dict(json = "application/json", arrow = "application/vnd.apache.arrow.stream",
+                     parquet = "application/vnd.apache.parquet", jsonl = "application/x-ndjson",
+                     csv = "text/csv")
+
+
+def service_address(address = None):
+    """service_address(address = None)
+
+    Returns the address of the query service; 'address' if set, else
+    the value of the environment variable EUPP_PARQUET_SERVICE, else the
+    default socket ('.euppparquet.sock' in the working directory).
+    """
+    if address is None: address = os.environ.get(SERVICE_ENV, SOCKET)
+    if not isinstance(address, str):
+        raise TypeError("Input 'address' must be None or string.")
+    return address
+
+
+def _encode_query_(query):
+    """_encode_query_(query)
+
+    Used internally; converts the values of a query (see Dataset.query)
+    such that they can be sent as JSON (dates as 'YYYY-MM-DD').
+    """
+    import datetime as dt
+    def conv(x):
+        if isinstance(x, (dt.date, dt.datetime)): return x.strftime("%Y-%m-%d")
+        if isinstance(x, (list, tuple)): return [conv(y) for y in x]
+        return x
+    return dict([(k, conv(v)) for k, v in query.items() if not v is None])
+
+
+# --------------------------------------------------------------
+# Client
+# --------------------------------------------------------------
+class _UnixConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket."""
+
+    def __init__(self, path, timeout = None):
+        super().__init__("localhost", timeout = timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None: self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+class ServiceClient:
+    """ServiceClient(address = None, timeout = 60.)
+
+    Light client for the query service (see QueryService); only uses
+    the standard library unless Arrow responses are requested.
+
+    Parameters
+    ==========
+    address : None or str
+        Path to the Unix socket or 'http://host:port' of the service;
+        see service_address for the default.
+    timeout : None or float
+        Timeout in seconds for each request, defaults to 60.
+
+    Examples
+    ========
+    >>> from euppparquet.client.service import ServiceClient
+    >>> client = ServiceClient()
+    >>> if client.available():
+    >>>     res = client.query("forecast", begin = "2017-01-03", param = "2t", step = 24)
+    """
+
+    def __init__(self, address = None, timeout = 60.):
+        self.address = service_address(address)
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"<ServiceClient {self.address}>"
+
+    def _connection_(self):
+        """_connection_()
+
+        Used internally; returns a new connection to the service.
+        """
+        if self.address.startswith("http://"):
+            return http.client.HTTPConnection(self.address[len("http://"):].rstrip("/"), timeout = self.timeout)
+        return _UnixConnection(self.address, timeout = self.timeout)
+
+    def available(self):
+        """available()
+
+        Returns True if a service is running at the address (i.e., the
+        socket exists and accepts connections), else False.
+        """
+        if not self.address.startswith("http://") and not os.path.exists(self.address):
+            return False
+        try:
+            self.status()
+        except (OSError, http.client.HTTPException):
+            return False
+        return True
+
+    def _request_(self, method, path, body = None, sink = None):
+        """_request_(method, path, body = None, sink = None)
+
+        Used internally; sends a request and returns the content type and
+        the body of the response. If 'sink' (binary file-like object) is
+        set the body is copied into it chunk by chunk as it arrives and
+        the number of bytes is returned instead. Raises an Exception if
+        the service responds with an error.
+        """
+        con = self._connection_()
+        try:
+            headers = dict() if body is None else {"Content-Type": "application/json"}
+            con.request(method, path, body = None if body is None else json.dumps(body), headers = headers)
+            res  = con.getresponse()
+            if res.status == 200 and sink is not None:
+                data = 0
+                for chunk in iter(lambda: res.read(1048576), b""):
+                    sink.write(chunk)
+                    data += len(chunk)
+                sink.flush()
+            else:
+                data = res.read()
+        finally:
+            con.close()
+        if not res.status == 200:
+            try:
+                msg = json.loads(data)["error"]
+            except Exception:
+                msg = data.decode(errors = "replace")
+            raise Exception(f"Query service {self.address}: {msg}")
+        return res.getheader("Content-Type"), data
+
+    def status(self):
+        """status()
+
+        Returns the status of the service (dictionary with 'pid', 'dir',
+        'uptime', 'requests', and the 'datasets' opened).
+        """
+        return json.loads(self._request_("GET", "/status")[1])
+
+    def refresh(self, product = None):
+        """refresh(product = None)
+
+        Forces the service to re-discover the fragments of one or all
+        datasets (see Dataset.refresh).
+        """
+        return json.loads(self._request_("POST", "/refresh", dict(product = product))[1])
+
+    def query(self, product, format = "json", **query):
+        """query(product, format = "json", **query)
+
+        Sends a query to the service.
+
+        Parameters
+        ==========
+        product : str
+            One of 'analysis', 'forecast', or 'reforecast'.
+        format : str
+            'json' (default) or 'arrow'.
+        **query :
+            See Dataset.query (except 'as_pandas').
+
+        Returns
+        =======
+        Dictionary of lists (one per column) if 'format = "json"',
+        pyarrow.Table if 'format = "arrow"'.
+        """
+        if not format in ["json", "arrow"]:
+            raise ValueError("Input 'format' must be 'json' or 'arrow'.")
+        _, data = self._request_("POST", "/query", dict(product = product, format = format,
+                                                        query = _encode_query_(query)))
+        if format == "json": return json.loads(data)["data"]
+        import pyarrow as pa
+        return pa.ipc.open_stream(data).read_all()
+
+    def write(self, file, product, format = None, **query):
+        """write(file, product, format = None, **query)
+
+        Streams the result of a query into a file or stream (see
+        Dataset.write); the service writes the output, the client only
+        copies the bytes (no pyarrow needed).
+
+        Parameters
+        ==========
+        file : str or file-like object
+            Name of the output file or binary file-like object.
+        product : str
+            One of 'analysis', 'forecast', or 'reforecast'.
+        format : None or str
+            See Dataset.write.
+        **query :
+            See Dataset.query (except 'as_pandas').
+
+        Returns
+        =======
+        Number of bytes written.
+        """
+        from .output import output_format
+        format = output_format(file, format)
+        fid    = open(file, "wb") if isinstance(file, str) else file
+        try:
+            return self._request_("POST", "/query", dict(product = product, format = format,
+                                                         query = _encode_query_(query)), sink = fid)[1]
+        finally:
+            if isinstance(file, str): fid.close()
+
+
+# --------------------------------------------------------------
+# Service
+# --------------------------------------------------------------
+class _PoolMixIn:
+    """Handles each request in a thread of a (bounded) thread pool."""
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_, request, client_address)
+
+    def _process_(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class _UnixServer(_PoolMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+class _TCPServer(_PoolMixIn, http.server.HTTPServer):
+    pass
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Request handler; the service is 'self.server.service'."""
+
+    def log_message(self, format, *args):
+        if self.server.service.verbose: print(f"    [{time.strftime('%H:%M:%S')}] {format % args}")
+
+    def _send_(self, status, content_type, data):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json_(self, status, x):
+        self._send_(status, CONTENT_TYPES["json"], json.dumps(x).encode())
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._send_json_(200, self.server.service.status())
+        else:
+            self._send_json_(404, dict(error = f"Unknown path '{self.path}'."))
+
+    def do_POST(self):
+        service = self.server.service
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/query" and body.get("format", "json") == "json":
+                content_type, data = service.query(body.get("product"), "json", **body.get("query", dict()))
+                self._send_(200, content_type, data)
+            elif self.path == "/query":
+                content_type, write = service.stream(body.get("product"), body.get("format"),
+                                                     **body.get("query", dict()))
+                # Streamed; no Content-Length, the connection is closed at the end
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.end_headers()
+                try:
+                    write(self.wfile)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                return
+            elif self.path == "/refresh":
+                self._send_json_(200, dict(refreshed = service.refresh(body.get("product"))))
+            else:
+                self._send_json_(404, dict(error = f"Unknown path '{self.path}'."))
+        except (ValueError, TypeError, KeyError) as e:
+            self._send_json_(400, dict(error = f"{type(e).__name__}: {e}"))
+        except Exception as e:
+            self._send_json_(500, dict(error = f"{type(e).__name__}: {e}"))
+
+
+class QueryService:
+    """QueryService(dir = ".", workers = 8, check_interval = 2., cache = None, verbose = False)
+
+    Keeps the datasets ('<product>.parquet' in 'dir') open and answers
+    queries (see Dataset.query) of concurrent clients; avoids the
+    startup (imports) and discovery (listing, footers) costs of each
+    call. Datasets are opened when first queried and re-discovered
+    if they have been modified (manifest, summary, or snapshot changed;
+    checked at most every 'check_interval' seconds).
+
+    Endpoints: 'GET /status', 'POST /query' (JSON body with 'product',
+    'format', and 'query'), 'POST /refresh'. Responses other than JSON
+    are streamed batch by batch (see output.write_batches).
+
+    Parameters
+    ==========
+    dir : str
+        Directory containing the datasets.
+    workers : positive int
+        Number of threads handling requests, defaults to 8.
+    check_interval : float
+        Minimum time in seconds between two checks whether a dataset
+        has been modified, defaults to 2.
+    cache : None or ResultCache
+        Cache for the results of (JSON) queries; see Dataset. Statistics
+        are included in the status.
+    verbose : bool
+        If True, requests are logged.
+
+    Examples
+    ========
+    >>> from euppparquet.client.service import QueryService
+    >>> QueryService().serve()                    # Unix socket '.euppparquet.sock'
+    >>> QueryService().serve("http://localhost:8765")
+    """
+
+    def __init__(self, dir = ".", workers = 8, check_interval = 2., cache = None, verbose = False):
+        if not isinstance(dir, str) or not os.path.isdir(dir):
+            raise ValueError("Input 'dir' must be an existing directory.")
+        if not isinstance(workers, int) or not workers > 0:
+            raise ValueError("Input 'workers' must be a positive integer.")
+        self.dir            = dir
+        self.workers        = workers
+        self.check_interval = check_interval
+        self.cache          = cache
+        self.verbose        = verbose
+        self.started        = time.time()
+        self.requests       = 0
+        self._datasets      = dict()   # product: [Dataset, stamp, last check]
+        self._lock          = threading.Lock()
+        self._server        = None
+
+    def __repr__(self):
+        return f"<QueryService {self.dir}: {len(self._datasets)} datasets open>"
+
+    def _stamp_(self, path):
+        """_stamp_(path)
+
+        Used internally; modification times of the files which change
+        whenever the dataset is modified (manifest, summary, snapshot).
+        """
+        res = []
+        for name in ["", "_manifest.sqlite", "_metadata", "_snapshot.json"]:
+            try:
+                res.append(os.stat(os.path.join(path, name)).st_mtime_ns)
+            except FileNotFoundError:
+                res.append(None)
+        return tuple(res)
+
+    def dataset(self, product):
+        """dataset(product)
+
+        Returns the Dataset of a product; opened on first use and
+        re-discovered if modified since.
+        """
+        from .Dataset import Dataset
+        if not product in PRODUCTS:
+            raise ValueError(f"Input 'product' must be one of {PRODUCTS}.")
+        path = os.path.join(self.dir, f"{product}.parquet")
+        with self._lock:
+            now = time.monotonic()
+            rec = self._datasets.get(product)
+            if rec is not None and now - rec[2] < self.check_interval: return rec[0]
+            if not os.path.isdir(path):
+                raise ValueError(f"Dataset '{path}' does not exist.")
+            stamp = self._stamp_(path)
+            if rec is None or not rec[1] == stamp:
+                if self.verbose and rec is not None: print(f"    Dataset {path} modified; re-discovering")
+                # New object; queries running keep using the previous one
+                rec = [Dataset(path, cache = self.cache), stamp, now]
+                self._datasets[product] = rec
+            rec[2] = now
+            return rec[0]
+
+    def refresh(self, product = None):
+        """refresh(product = None)
+
+        Drops one or all datasets; re-discovered on the next query.
+        Returns the list of products dropped.
+        """
+        with self._lock:
+            keys = list(self._datasets.keys()) if product is None else [product]
+            return [x for x in keys if self._datasets.pop(x, None) is not None]
+
+    def status(self):
+        """status()
+
+        Returns the status of the service (dictionary).
+        """
+        with self._lock:
+            datasets = dict([(k, len(v[0].fragments)) for k, v in self._datasets.items()])
+        return dict(pid = os.getpid(), dir = os.path.abspath(self.dir), uptime = time.time() - self.started,
+                    requests = self.requests, workers = self.workers, datasets = datasets,
+                    cache = None if self.cache is None else self.cache.info())
+
+    def query(self, product, format = "json", **query):
+        """query(product, format = "json", **query)
+
+        Answers one query; returns a tuple with the content type and the
+        response (bytes).
+
+        Parameters
+        ==========
+        product : str
+            One of 'analysis', 'forecast', or 'reforecast'.
+        format : str
+            One of 'json', 'arrow', 'parquet', 'jsonl', or 'csv'.
+        **query :
+            See Dataset.query.
+        """
+        import io
+        if format == "json":
+            if "as_pandas" in query:
+                raise ValueError("Argument 'as_pandas' not supported by the query service.")
+            with self._lock: self.requests += 1
+            table = self.dataset(product).query(**query)
+            data  = dict(num_rows = table.num_rows, columns = table.column_names, data = table.to_pydict())
+            return CONTENT_TYPES["json"], json.dumps(data).encode()
+        content_type, write = self.stream(product, format, **query)
+        sink = io.BytesIO()
+        write(sink)
+        return content_type, sink.getvalue()
+
+    def stream(self, product, format, **query):
+        """stream(product, format, **query)
+
+        Prepares a streamed response; returns a tuple with the content
+        type and a function writing the result into a binary file-like
+        object (see output.write_batches). Invalid queries raise before
+        anything is written.
+
+        Parameters
+        ==========
+        product : str
+            One of 'analysis', 'forecast', or 'reforecast'.
+        format : str
+            One of 'arrow', 'parquet', 'jsonl', or 'csv'.
+        **query :
+            See Dataset.query.
+        """
+        from .output import write_batches
+        if not format in OUTPUT_FORMATS:
+            raise ValueError(f"Input 'format' must be one of {OUTPUT_FORMATS}.")
+        if "as_pandas" in query:
+            raise ValueError("Argument 'as_pandas' not supported by the query service.")
+        with self._lock: self.requests += 1
+        scanner = self.dataset(product).scanner(**query)
+        def write(sink):
+            return write_batches(scanner.to_batches(), scanner.projected_schema, sink, format)
+        return CONTENT_TYPES[format], write
+
+    def serve(self, address = None):
+        """serve(address = None)
+
+        Starts the service (blocks until interrupted or shutdown is called).
+
+        Parameters
+        ==========
+        address : None or str
+            Path to the Unix socket or 'http://host:port'; see
+            service_address for the default.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        address = service_address(address)
+        if address.startswith("http://"):
+            host, port = address[len("http://"):].rstrip("/").rsplit(":", 1)
+            server = _TCPServer((host, int(port)), _Handler, bind_and_activate = True)
+        else:
+            if os.path.exists(address):
+                if ServiceClient(address, timeout = 1.).available():
+                    raise Exception(f"Query service already running at {address}.")
+                os.remove(address)     # Left behind by a service which died
+            server = _UnixServer(address, _Handler)
+
+        server.service = self
+        server.pool    = ThreadPoolExecutor(max_workers = self.workers)
+        self._server   = server
+        if self.verbose: print(f"Query service for {os.path.abspath(self.dir)} listening on {address} (pid {os.getpid()})")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            server.pool.shutdown(wait = True)
+            self._server = None
+            if not address.startswith("http://") and os.path.exists(address): os.remove(address)
+
+    def shutdown(self):
+        """shutdown()
+
+        Stops the service (called from another thread).
+        """
+        if self._server is not None: self._server.shutdown()
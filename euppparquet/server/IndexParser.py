@@ -4,19 +4,57 @@
 import os
 import re
 import sys
-import json
+import hashlib
 
 import pandas as pd
 import datetime as dt
 
 class IndexParser:
 
-    PARQUET_PARTITIONING_ANALYSIS = ["year", "month", "day"]
-    PARQUET_PARTITIONING_FORECAST = ["version", "product", "year", "month", "day"]
-    # Used for testing ...
-    #PARQUET_PARTITIONING_FORECAST = ["version", "year", "month", "day"]
-    #PARQUET_PARTITIONING_FORECAST = ["year", "month", "day", "step"]
-    #PARQUET_PARTITIONING_FORECAST = ["year", "month", "day", "param"]
+    """IndexParser(layouts = None, buffer_rows = None, buffer_bytes = 512 * 2**20)
+
+    Parses GRIB index files and writes them into the parquet datasets.
+
+    By default each batch (see process_file) is written immediately which
+    results in (at least) one fragment per GRIB index file and partition.
+    If 'buffer_rows' is set, batches of consecutive files are collected
+    per partition and written once a partition holds 'buffer_rows' records,
+    the buffer exceeds 'buffer_bytes', or on flush. Files with only few
+    records per partition (e.g., daily ensemble files) then end up in few
+    large fragments. Sources are recorded in the manifest once all their
+    records have been written; flush must be called when done.
+
+    Parameters
+    ==========
+    layouts : None or dict
+        Partitioning layout per dataset type ('analysis', 'forecast',
+        'reforecast'); name of a layout or list of partition columns
+        (see layout.LAYOUTS). Only used when a dataset is created, existing
+        datasets keep the layout they have been created with. Types not
+        specified use layout.DEFAULT_LAYOUTS.
+    buffer_rows : None or positive int
+        If set, records are buffered and written per partition in
+        fragments of (about) this many records. None (default) writes
+        each batch immediately.
+    buffer_bytes : positive int
+        Maximum size of the buffer in bytes (all partitions), defaults
+        to 512 MiB. If exceeded, all partitions are written. Only used
+        if 'buffer_rows' is set.
+    """
+
+    def __init__(self, layouts = None, buffer_rows = None, buffer_bytes = 512 * 2**20):
+        from .layout import resolve_layout
+        if layouts is None: layouts = dict()
+        if not isinstance(layouts, dict):
+            raise TypeError("Input 'layouts' must be None or dict.")
+        for x in [buffer_rows, buffer_bytes]:
+            if not x is None and (not isinstance(x, int) or not x > 0):
+                raise ValueError("Inputs 'buffer_rows' and 'buffer_bytes' must be None or positive integers.")
+        self.layouts      = dict([(k, resolve_layout(v)) for k, v in layouts.items()])
+        self.buffer_rows  = buffer_rows
+        self.buffer_bytes = buffer_bytes
+        self._buffer      = dict()      # (dataset, partition): buffered records
+        self._pending     = dict()      # (dataset, source): [rows buffered, digest]
 
     def _parse_filename_(self, file):
         """_parse_filename_(file)
@@ -37,7 +75,7 @@ class IndexParser:
         from os import path
 
         # Getting datatype/kind
-        mtch = re.match(r"^(EU_)(.*?)(?=(_params)).*\.grb\.index\.zip$", path.basename(file))
+        mtch = re.match(r"^(EU_)(.*?)(?=(_params)).*\.grb\.index(\.zip|\.gz|\.zst)?$", path.basename(file))
         if not mtch:
             raise Exception("Filename '{path.basename(file)}' not in expected format")
         mtch = mtch.groups()[1].split("_")
@@ -58,31 +96,215 @@ class IndexParser:
         return res
 
 
-    def process_file(self, file, verbose = False, nrows = None):
-        """process_file(file, dataset)
+    def process_file(self, file, verbose = False, nrows = None, chunksize = None, name = None):
+        """process_file(file, verbose = False, nrows = None, chunksize = None, name = None)
 
         Reads the GRIB index file from the zip file provided on argument 'file'
         and creates a pandas.DataFrame out of it. After few modifications this
         information will be stored in a parquet dataset defined by 'dataset'.
+        Instead of a zip file, 'file' can also be a gzip (.gz) or zstandard
+        (.zst) compressed file, or an open binary stream (e.g., the body
+        of the HTTP response; see prepare_index) in which case 'name' is required.
+
+        The JSON lines are decoded by pyarrow (vectorized). If 'chunksize'
+        is set, the file is read in batches of 'chunksize' records; each
+        batch is transformed and written on its own such that the memory
+        needed is bounded by the size of one batch, not the size of the file.
 
         Parameters
         ==========
-        file : str
+        file : str or binary file object
             Name of the zip file to be parsed. Expecting a zip archive
             of a GRIB index file for now.
         verbose : bool
             Set verbosity level, defaults to False.
         nrows : positive integer
             If set, only nrows rows from each file will be processed (for development only).
-        """ 
+        chunksize : None or positive integer
+            If None (default) the entire file is read at once. Else the
+            file is processed in batches of (at most) 'chunksize' records.
+        name : None or str
+            Name of the GRIB index file. Required if 'file' is a file
+            object, else the basename of 'file' is used.
 
-        # Getting sane
-        if not isinstance(file, str):
-            raise TypeError("Input 'file' must be string.")
-        if not os.path.isfile(file):
-            raise TypeError(f"File '{file}' does not exist.")
-        if not re.match(".*\.zip$", file):
-            raise TypeError(f"File '{file}' is not a zip file as expected.")
+        If the file has been processed before but not completely (e.g., a
+        batch failed; no content hash in the manifest) the records written
+        by the previous attempt are removed first (see _clean_source_).
+
+        Returns
+        =======
+        Number of records written (0 if the file has already been processed).
+        Note: earlier versions returned the parsed records (pandas.DataFrame);
+        use parse_file to get the records without writing them.
+        """
+
+        from . import metrics
+        name = self._check_args_(file, verbose, nrows, chunksize, name)
+
+        # Extracting some information from the file name first
+        file_info = self._parse_filename_(name)
+        dataset   = f"{file_info['type']}.parquet"
+        if verbose: print(f"Processing {file if isinstance(file, str) else name}")
+
+        # Keeping track of the paths seen; True if the path has already been
+        # processed in a previous run (skip), False if new (written by us).
+        seen    = dict()
+        written = 0
+        source  = self._source_(name)
+        digest  = hashlib.sha1()
+        self._clean_source_(dataset, source, verbose = verbose)
+        with metrics.file(source):
+            for data, partition_cols in self._batches_(file, file_info, chunksize, nrows, digest):
+                written += self._ingest_(data, dataset, partition_cols, source, seen, verbose = verbose)
+
+            # Store content hash of the source in the manifest (marks it complete)
+            self._done_(dataset, source, digest.hexdigest())
+
+        return written
+
+
+    def parse_file(self, file, nrows = None, chunksize = None, name = None):
+        """parse_file(file, nrows = None, chunksize = None, name = None)
+
+        Reads and transforms the GRIB index file from the zip file provided
+        on argument 'file' without writing anything. Used by worker processes
+        in parallel ingestion; the result is handed over to 'write_parsed'
+        which is called by one single writer process.
+
+        Parameters
+        ==========
+        file : str or binary file object
+            Name of the zip file to be parsed (see process_file).
+        nrows : positive integer
+            If set, only nrows rows from each file will be processed (for development only).
+        chunksize : None or positive integer
+            If set, the file is read and transformed in batches of 'chunksize' records.
+        name : None or str
+            Name of the GRIB index file (see process_file).
+
+        Returns
+        =======
+        Dictionary with 'source' (name of the GRIB index file), 'dataset',
+        'partition_cols', 'data' (list of pyarrow.Table), and 'digest'
+        (content hash).
+        """
+        from . import metrics
+        name = self._check_args_(file, False, nrows, chunksize, name)
+
+        file_info = self._parse_filename_(name)
+        digest    = hashlib.sha1()
+        res       = dict(source = self._source_(name),
+                         dataset = f"{file_info['type']}.parquet",
+                         partition_cols = None, data = [])
+        with metrics.file(res["source"]):
+            for data, partition_cols in self._batches_(file, file_info, chunksize, nrows, digest):
+                res["data"].append(data)
+                res["partition_cols"] = partition_cols
+        res["digest"] = digest.hexdigest()
+
+        return res
+
+
+    def write_parsed(self, parsed, verbose = False):
+        """write_parsed(parsed, verbose = False)
+
+        Writes the return of 'parse_file' into the parquet dataset,
+        including the duplicate check.
+
+        Parameters
+        ==========
+        parsed : dict
+            Return of parse_file.
+        verbose : bool
+            Set verbosity level, defaults to False.
+
+        Returns
+        =======
+        Number of records written.
+        """
+        from . import metrics
+        if verbose: print(f"Writing {parsed['source']}")
+        seen    = dict()
+        written = 0
+        self._clean_source_(parsed["dataset"], parsed["source"], verbose = verbose)
+        with metrics.file(parsed["source"]):
+            for data in parsed["data"]:
+                written += self._ingest_(data, parsed["dataset"], parsed["partition_cols"],
+                                         parsed["source"], seen, verbose = verbose)
+            self._done_(parsed["dataset"], parsed["source"], parsed["digest"])
+        return written
+
+
+    def replace_file(self, file, verbose = False, nrows = None, chunksize = None, name = None):
+        """replace_file(file, verbose = False, nrows = None, chunksize = None, name = None)
+
+        Like process_file, but replaces the records of a GRIB index file
+        already ingested (e.g., republished upstream with corrected records)
+        instead of skipping it; see replace_parsed. Arguments as for
+        process_file.
+
+        Returns
+        =======
+        Number of records written.
+        """
+        return self.replace_parsed(self.parse_file(file, nrows = nrows, chunksize = chunksize, name = name),
+                                   verbose = verbose)
+
+
+    def replace_parsed(self, parsed, verbose = False):
+        """replace_parsed(parsed, verbose = False)
+
+        Writes the return of 'parse_file' into the parquet dataset,
+        replacing all records previously ingested from the same source
+        (see replace.replace_source). Idempotent; nothing is done if the
+        content hash equals the one recorded in the manifest. Sources not
+        yet ingested are written as by write_parsed.
+
+        Parameters
+        ==========
+        parsed : dict
+            Return of parse_file.
+        verbose : bool
+            Set verbosity level, defaults to False.
+
+        Returns
+        =======
+        Number of records written.
+        """
+        from .replace import replace_source
+        dataset, source = parsed["dataset"], parsed["source"]
+
+        # Buffered records must be in the dataset (and manifest) first
+        self.flush(verbose = verbose)
+        entry = self._manifest_(dataset).has_source(source)
+        if entry is None:
+            return self.write_parsed(parsed, verbose = verbose)
+        elif entry["digest"] == parsed["digest"]:
+            if verbose: print(f"    {source} unchanged, skip")
+            return 0
+
+        if verbose: print(f"Replacing {source}")
+        res = replace_source(dataset, source, parsed["data"], parsed["partition_cols"],
+                             digest = parsed["digest"], manifest = self._manifest_(dataset), verbose = verbose)
+        return res["added"]
+
+
+    def _check_args_(self, file, verbose, nrows, chunksize, name = None):
+        """_check_args_(file, verbose, nrows, chunksize, name = None)
+
+        Used internally; sanity checks for process_file and parse_file.
+        Returns the name of the GRIB index file.
+        """
+        if isinstance(file, str):
+            if not os.path.isfile(file):
+                raise TypeError(f"File '{file}' does not exist.")
+            if not re.match(".*\.(zip|gz|zst)$", file):
+                raise TypeError(f"File '{file}' is not a zip/gz/zst file as expected.")
+            if name is None: name = os.path.basename(file)
+        elif not hasattr(file, "read"):
+            raise TypeError("Input 'file' must be string or a binary file object.")
+        if not isinstance(name, str):
+            raise TypeError("Input 'name' must be string (required if 'file' is a file object).")
 
         if not isinstance(verbose, bool):
             raise TypeError("Input 'verbose' must be True or False.")
@@ -91,116 +313,481 @@ class IndexParser:
         if isinstance(nrows, int):
             if not nrows > 0:
                 raise ValueError("If 'nrows' is set it musbe positive (not {nrows}).")
+        if not chunksize is None and not isinstance(chunksize, int):
+            raise TypeError("Wrong input on 'chunksize'.")
+        if isinstance(chunksize, int):
+            if not chunksize > 0:
+                raise ValueError(f"If 'chunksize' is set it must be positive (not {chunksize}).")
 
-        # Extracting some information from the file name first
-        file_info = self._parse_filename_(file)
-
-        # Open zip file; get file names, and process them one by one (typically
-        # there is only one in there!!)
-        import zipfile
-        if verbose: print(f"Processing {file}")
-        try:
-            zip = zipfile.ZipFile(file)
-        except:
-            raise Exception(f"Problems unzipping {file}")
-
-        # Store result
-        res = []
-        counter = 0
+        return name
 
-        # Processing files ...
-        for filename in zip.namelist():
-            if not os.path.isdir(filename):
 
-                for rec in zip.open(filename):
+    def _source_(self, name):
+        """_source_(name)
 
-                    res.append(json.loads(rec))
-                    counter += 1
+        Used internally; name of the GRIB index file without the
+        extension of the local (compressed) copy.
+        """
+        return re.sub("\\.(zip|gz|zst)$", "", os.path.basename(name))
+
+
+    def _batches_(self, file, file_info, chunksize, nrows, digest):
+        """_batches_(file, file_info, chunksize, nrows, digest)
+
+        Generator used internally; opens the file and yields
+        the transformed batches (see _open_, _read_batches_, _transform_).
+        """
+        from . import metrics
+        for batch in self._read_batches_(self._open_(file), chunksize, nrows, digest = digest):
+            with metrics.stage("transform") as m:
+                res = self._transform_(batch, file_info)
+                m.add(rows = res[0].num_rows)
+            yield res
 
-                    if not nrows is None and counter >= nrows: break
 
-        # Convert list of dicts to DataFrame
-        try:
-            data = pd.DataFrame(res)
-        except Exception as e:
-            raise Exception("Problems creating the pandas.DataFrame")
+    def _open_(self, file):
+        """_open_(file)
+
+        Generator used internally; yields binary streams of the
+        GRIB index content(s) in 'file' which is either a zip, gzip,
+        or zstandard compressed file or an open binary stream.
+        """
+        if not isinstance(file, str):
+            yield file
+            if hasattr(file, "close"): file.close()
+
+        elif re.match(".*\.zip$", file):
+            # Open zip file; get file names, and process them one by one (typically
+            # there is only one in there!!)
+            import zipfile
+            try:
+                zip = zipfile.ZipFile(file)
+            except:
+                raise Exception(f"Problems unzipping {file}")
+            for filename in zip.namelist():
+                if os.path.isdir(filename): continue
+                with zip.open(filename) as fid: yield fid
+            zip.close()                # Close the file after opening it
+            del zip
 
-        # Extracting step end (end of step range)
-        def extract_step(x):
-            mtch = re.match("^([0-9]+-)?([0-9]+)$", x)
-            if not mtch:
-                raise Exception(f"Cannot decode step = '{x}'.")
-            return int(mtch.group(2))
-        data.step = data.step.apply(extract_step)
+        else:
+            from io import BufferedReader
+            from .prepare_index import _open_compressed_
+            with _open_compressed_(file, "gzip" if file.endswith(".gz") else "zstd") as fid:
+                yield fid if hasattr(fid, "readline") else BufferedReader(fid)
 
-        # Manipulate parameter name if we have levelist.
-        if "levelist" in data.columns:
-            data.param = data.param + data.levelist
-            del data["levelist"]
 
-        # Appending date and time information for parquet partitions
-        if file_info["type"] == "analysis":
-            data.date     = pd.to_datetime(data.date + " " + data.time, format = "%Y%m%d %H%M")
-            data.date     = data.date + pd.to_timedelta(data.step, "hour")
-            data["year"]  = data.date.dt.year
-            data["month"] = data.date.dt.month
-            data["day"]   = data.date.dt.day
+    def _ingest_(self, data, dataset, partition_cols, source, seen, verbose = False):
+        """_ingest_(data, dataset, partition_cols, source, seen, verbose = False)
 
-            data.rename(columns = {"hour": "time"})
+        Used internally; checks whether the GRIB files ('_path') in the
+        batch have already been processed and, if not, writes the batch.
 
-            del data["step"]
-            del data["date"]
-            del data["time"]
-            partition_cols = self.PARQUET_PARTITIONING_ANALYSIS
+        Parameters
+        ==========
+        data : pyarrow.Table
+            Transformed batch (see _transform_).
+        dataset : str
+            Name of the parquet dataset.
+        partition_cols : list of str
+            Columns used for partitioning the dataset.
+        source : str
+            Name of the GRIB index file.
+        seen : dict
+            Paths seen so far for this source; True if the path has already
+            been processed in a previous run (skip), False if new. Updated
+            in place.
+        verbose : bool
+            Set verbosity level, defaults to False.
 
+        Returns
+        =======
+        Number of records written.
+        """
+        from . import metrics
+
+        # Check paths we have not seen so far
+        paths = [str(x) for x in data.column("_path").unique().to_pylist()]
+        new   = [x for x in paths if not x in seen]
+        if len(new) > 0:
+            with metrics.stage("check"):
+                check = self._check_records_by_filename_(dataset, new)
+                if not check and len(self._buffer) > 0:
+                    check = any([x in buf["paths"] for (d, k), buf in self._buffer.items() if d == dataset for x in new])
+            for x in new: seen[x] = bool(check)
+            if check and verbose:
+                print(f"     ¯\\_(ツ)_/¯ File already processed; don't add it to the parquet file again.")
+        if any([seen[x] for x in paths]): return 0
+
+        if self.buffer_rows is None:
+            self._write_(data, dataset, partition_cols, verbose = verbose, source = source)
         else:
+            self._buffer_(data, dataset, partition_cols, source, verbose = verbose)
+        return data.num_rows
+
 
-            # In case we have an ensemble but no number we got
-            # forecast control run. Set number to 0.
-            if not "number" in data.columns:
-                data["number"] = 0
-
-            # Adding file/dataset version
-            data["version"] = file_info["version"]
-
-            # Adding product. Either ens (ctr gets ens in _parse_filename_)
-            # or efi.
-            data["product"] = file_info["product"]
-
-            # Manipulate date/time information (model run initialization)
-            data.date       = pd.to_datetime(data.date, format = "%Y%m%d")
-            data["year"]    = data.date.dt.year
-            data["month"]   = data.date.dt.month
-            data["day"]     = data.date.dt.day
-
-            del data["date"]
-            partition_cols = self.PARQUET_PARTITIONING_FORECAST
-
-        # Dropping a series of columns
-        if True:
-            for colname in ["domain", "levtype", "class", "type", "stream", "expver",
-                            "_leg_number", "_param_id"]:
-                if colname in data.columns: del data[colname]
-
-        zip.close()                # Close the file after opening it
-        del zip
-
-        # Find all unique paths for the parquet check
-        paths = [str(x) for x in data._path.unique()]
-        check = self._check_records_by_filename_(f"{file_info['type']}.parquet", paths)
-        if not check:
-            # Write parquet file
-            n_data = data.shape[0]
-            if verbose: print(f"    Writing {n_data} entries into parquet '{file_info['type']}'.")
+    def _clean_source_(self, dataset, source, verbose = False):
+        """_clean_source_(dataset, source, verbose = False)
+
+        Used internally; removes the records of a source which has not been
+        ingested completely (records in the manifest but no content hash;
+        e.g., a batch failed in a previous run) before it is written again
+        (see replace.replace_source).
+        """
+        from .replace import replace_source
+        manifest = self._manifest_(dataset)
+        entry    = manifest.has_source(source)
+        if entry is None or not entry["digest"] is None: return
+
+        # Records of the failed attempt may still be buffered
+        if (dataset, source) in self._pending: self._flush_buffer_(verbose = verbose)
+        if verbose: print(f"    Removing {entry['nrows']} records of incompletely ingested {source}")
+        replace_source(dataset, source, None, [], manifest = manifest, verbose = verbose)
+
+
+    def _done_(self, dataset, source, digest):
+        """_done_(dataset, source, digest)
+
+        Used internally; records the content hash of a source in the manifest
+        once all its records have been written (also if all records have been
+        skipped). If records of the source are still buffered, the hash is
+        stored when they are written (see _buffer_).
+
+        The hash of a source ingested completely before is kept; if the file
+        has changed since (e.g., republished upstream) its records have been
+        skipped and a warning is issued; replace_file replaces them.
+        """
+        import warnings
+        from . import metrics
+        from .Manifest import Manifest
+        key   = (dataset, source)
+        entry = self._manifest_(dataset).has_source(source)
+        if not entry is None and not entry["digest"] in [None, digest]:
+            if not entry["digest"] == Manifest.UNKNOWN:
+                warnings.warn(f"{source} has changed since it has been ingested; records not updated " + \
+                              "(see IndexParser.replace_file).")
+            digest = entry["digest"]
+        if key in self._pending and self._pending[key][0] > 0:
+            self._pending[key][1] = digest
+            return
+        self._pending.pop(key, None)
+        with metrics.stage("manifest"):
+            self._manifest_(dataset).add(source, {}, [], digest = digest)
+
+
+    def _buffer_(self, data, dataset, partition_cols, source, verbose = False):
+        """_buffer_(data, dataset, partition_cols, source, verbose = False)
+
+        Used internally; splits a batch by partition and adds the records
+        to the buffer (see 'buffer_rows'). Partitions holding 'buffer_rows'
+        records or more are written; all if the buffer exceeds 'buffer_bytes'.
+        """
+        import pyarrow.compute as pc
+
+        # Partition of each record ('/' separated values of the partition columns)
+        if len(partition_cols) == 0:
+            keys, parts = [""], [data]
+        else:
+            key   = pc.binary_join_element_wise(*[pc.cast(data.column(x), "string") for x in partition_cols], "/",
+                                                null_handling = "replace", null_replacement = "__null__")
+            key   = key.combine_chunks().dictionary_encode() if hasattr(key, "combine_chunks") else key.dictionary_encode()
+            keys  = key.dictionary.to_pylist()
+            parts = [data] if len(keys) == 1 else [data.filter(pc.equal(key.indices, i)) for i in range(len(keys))]
+
+        for k, part in zip(keys, parts):
+            buf = self._buffer.setdefault((dataset, k), dict(partition_cols = partition_cols, tables = [],
+                                                             rows = 0, bytes = 0, paths = dict(), sources = dict()))
+            buf["tables"].append(part)
+            buf["rows"]  += part.num_rows
+            buf["bytes"] += part.nbytes
+            buf["sources"][source] = buf["sources"].get(source, 0) + part.num_rows
+            for x in part.column("_path").unique().to_pylist(): buf["paths"][str(x)] = source
+        self._pending.setdefault((dataset, source), [0, None])[0] += data.num_rows
+
+        for key in [k for k, v in self._buffer.items() if v["rows"] >= self.buffer_rows]:
+            self._flush_partition_(key, verbose = verbose)
+        if sum([x["bytes"] for x in self._buffer.values()]) > self.buffer_bytes:
+            self._flush_buffer_(verbose = verbose)
+
+
+    def _flush_partition_(self, key, verbose = False):
+        """_flush_partition_(key, verbose = False)
+
+        Used internally; writes the buffered records of one partition
+        ('key' is a tuple with dataset and partition) and records the
+        content hash of sources without records left in the buffer.
+        """
+        import pyarrow as pa
+        from . import metrics
+
+        buf     = self._buffer.pop(key)
+        dataset = key[0]
+        data    = buf["tables"][0] if len(buf["tables"]) == 1 else pa.concat_tables(buf["tables"])
+        self._write_(data, dataset, buf["partition_cols"], verbose = verbose, source = buf["paths"])
+
+        for source, n in buf["sources"].items():
+            pending = self._pending[(dataset, source)]
+            pending[0] -= n
+            if pending[0] == 0 and not pending[1] is None:
+                del self._pending[(dataset, source)]
+                with metrics.stage("manifest"):
+                    self._manifest_(dataset).add(source, {}, [], digest = pending[1])
+
+
+    def _flush_buffer_(self, verbose = False):
+        """_flush_buffer_(verbose = False)
+
+        Used internally; writes all buffered records (partitions in order).
+        """
+        for key in sorted(self._buffer.keys()): self._flush_partition_(key, verbose = verbose)
+
+
+    def pending_sources(self):
+        """pending_sources()
+
+        Returns the set of sources (names of the GRIB index files) with
+        records not yet written (see 'buffer_rows').
+        """
+        return set([x[1] for x in self._pending.keys()])
+
+
+    def _read_batches_(self, streams, chunksize = None, nrows = None, digest = None):
+        """_read_batches_(streams, chunksize = None, nrows = None, digest = None)
+
+        Generator used internally, reading the JSON lines of all
+        streams and yielding them as pyarrow.Table batches
+        of at most 'chunksize' records (all records at once if None).
+
+        Parameters
+        ==========
+        streams : iterable
+            Binary streams (see _open_).
+        chunksize : None or positive integer
+            Maximum number of records per batch.
+        nrows : None or positive integer
+            Maximum number of records read in total.
+        digest : None or hashlib hash object
+            If set, updated with the raw content read.
+
+        Returns
+        =======
+        Yields pyarrow.Table objects.
+        """
+        from io import BytesIO
+        from itertools import islice
+        from pyarrow import json as pajson
+        from . import metrics
+
+        counter = 0
+        for fid in streams:
+            while True:
+                n = chunksize
+                if not nrows is None:
+                    n = nrows - counter if n is None else min(n, nrows - counter)
+                # Reading (and decompressing) the lines, decoding (pyarrow)
+                with metrics.stage("read") as m:
+                    lines = list(islice(fid, n))
+                    if len(lines) == 0: break
+                    n_lines  = len(lines)
+                    counter += n_lines
+                    lines    = b"".join(lines)
+                    if not digest is None: digest.update(lines)
+                    m.add(rows = n_lines, bytes = len(lines))
+                with metrics.stage("decode") as m:
+                    batch = pajson.read_json(BytesIO(lines))
+                    m.add(rows = batch.num_rows, bytes = len(lines))
+                yield batch
+                if not nrows is None and counter >= nrows: return
+
+
+    def _transform_(self, data, file_info):
+        """_transform_(data, file_info)
+
+        Used internally to prepare one batch of GRIB index records for
+        the parquet dataset (see transform.transform_table).
+
+        Parameters
+        ==========
+        data : pyarrow.Table
+            Records as read from the GRIB index file.
+        file_info : dict
+            Return of _parse_filename_.
+
+        Returns
+        =======
+        Tuple with the modified pyarrow.Table and the list of
+        columns used for partitioning the dataset.
+        """
+        from .transform import transform_table
+        from .layout import apply_layout
+        from .schema import conform
+
+        partition_cols = self._partitioning_(file_info["type"])
+        data = apply_layout(transform_table(data, file_info), partition_cols)
+        return conform(data, file_info["type"], partition_cols), partition_cols
+
+
+    def _partitioning_(self, type):
+        """_partitioning_(type)
+
+        Used internally; returns the partition columns for dataset 'type'.
+        The layout stored in the dataset is used if existing; raises an
+        Exception if it differs from the layout requested when creating
+        the parser.
+        """
+        from .layout import read_layout, resolve_layout, DEFAULT_LAYOUTS
+
+        if not hasattr(self, "_partitionings"): self._partitionings = dict()
+        if type in self._partitionings: return self._partitionings[type]
+
+        dataset = f"{type}.parquet"
+        stored  = read_layout(dataset)
+        if stored is None and self._has_fragments_(dataset):
+            # Created by an older version; always used the default layout
+            stored = resolve_layout(DEFAULT_LAYOUTS[type])
+        if stored is not None:
+            if type in self.layouts and not self.layouts[type] == stored:
+                raise Exception(f"Dataset '{dataset}' is partitioned by {stored}, " + \
+                                f"cannot use {self.layouts[type]}.")
+            self._partitionings[type] = stored
+            return stored
+
+        if type in self.layouts: return self.layouts[type]
+        return resolve_layout(DEFAULT_LAYOUTS[type])
+
+
+    @staticmethod
+    def _has_fragments_(dataset):
+        """_has_fragments_(dataset)
+
+        Used internally; returns True if the dataset contains parquet files.
+        """
+        for root, dirs, files in os.walk(dataset):
+            if any([x.endswith(".parquet") for x in files]): return True
+        return False
+
+
+    def _write_(self, data, dataset, partition_cols, verbose = False, source = None):
+        """_write_(data, dataset, partition_cols, verbose = False, source = None)
+
+        Used internally to append one batch to the parquet dataset.
+        Rows are sorted by storage.SORT_COLUMNS and written with
+        statistics, page index and bloom filters (see storage.write_options).
+        The fragments written and the number of records per '_path'
+        are recorded in the manifest of the dataset; they are added to
+        the summary of the dataset by flush.
+
+        Parameters
+        ==========
+        data : pyarrow.Table
+            Data to be written (return of _transform_).
+        dataset : str
+            Name of the parquet dataset.
+        partition_cols : list of str
+            Columns used for partitioning the dataset.
+        verbose : bool
+            Set verbosity level, defaults to False.
+        source : None, str, or dict
+            Name of the GRIB index file the data came from. Defaults
+            to the basename of the GRIB file ('_path') plus '.index'.
+            A dictionary ('_path': source) if the data come from multiple
+            GRIB index files (see _buffer_).
+        """
+        import pyarrow.parquet as parquet
+        from .layout import read_info, write_layout
+        from .schema import SCHEMA_VERSION, schema_outdated
+        from .storage import sort_table, write_options
+        from . import metrics
+
+        # Store layout and schema version when creating the dataset
+        info = read_info(dataset)
+        if info is None and not self._has_fragments_(dataset):
+            write_layout(dataset, partition_cols, schema = SCHEMA_VERSION)
+        elif info is None or schema_outdated(os.path.basename(os.path.normpath(dataset)).replace(".parquet", ""),
+                                             info["schema"]):
+            raise Exception(f"Dataset '{dataset}' uses an older schema; migrate it first " + \
+                            "(see schema.migrate_dataset or eupp_make_parquet --migrate).")
+        elif not list(info["partitioning"]) == list(partition_cols):
+            raise Exception(f"Dataset '{dataset}' is partitioned by {info['partitioning']}, got {partition_cols}.")
+
+        n_data = data.num_rows
+        if verbose: print(f"    Writing {n_data} entries into parquet '{dataset}'.")
+        # Clustered rows, statistics and bloom filters (see storage.py)
+        with metrics.stage("sort") as m:
+            data = sort_table(data)
+            m.add(rows = n_data)
+        fragments = []
+        with metrics.stage("write") as m:
+            def visitor(x):
+                fragments.append(os.path.relpath(x.path, dataset))
+                m.add(bytes = x.size)
             try:
-                data.to_parquet(f"{file_info['type']}.parquet", partition_cols = partition_cols)
+                parquet.write_to_dataset(data, dataset, partition_cols = partition_cols,
+                        file_visitor = visitor, **write_options(data, partition_cols))
             except Exception as e:
                 raise Exception(f"Whoops, problem writing parquet data; {e}")
+            m.add(rows = n_data)
+
+        counts = data.group_by("_path").aggregate([("_path", "count")])
+        counts = dict(zip(counts.column("_path").to_pylist(), counts.column("_path_count").to_pylist()))
+        if source is None:
+            source = os.path.basename(data.column("_path")[0].as_py()) + ".index"
+        if isinstance(source, dict):
+            sources = dict()
+            for path, n in counts.items(): sources.setdefault(source[path], dict())[path] = n
         else:
-            if verbose: print(f"     ¯\_(ツ)_/¯ File already processed; don't add it to the parquet file again.")
+            sources = {source: counts}
+        with metrics.stage("manifest"):
+            for source, counts in sources.items(): self._manifest_(dataset).add(source, counts, fragments)
+
+        # Added to the summary of the dataset on flush
+        if not hasattr(self, "_written"): self._written = dict()
+        self._written.setdefault(dataset, []).extend(fragments)
+
+
+    def flush(self, verbose = False):
+        """flush(verbose = False)
 
-        # Return the object for testing
-        return data
+        Writes the buffered records (see 'buffer_rows') and adds the
+        fragments written since the last call to the summary ('_metadata')
+        of the datasets (see summary.append_summary) and to the lookup
+        index if the dataset has one (see lookup.update_lookup). To be
+        called once all files have been processed.
+
+        Parameters
+        ==========
+        verbose : bool
+            Set verbosity level, defaults to False.
+        """
+        from .summary import append_summary
+        from .lookup import read_lookup_info, update_lookup
+        from . import metrics
+        self._flush_buffer_(verbose = verbose)
+        if not hasattr(self, "_written"): return
+        for dataset, fragments in self._written.items():
+            if len(fragments) == 0: continue
+            with metrics.stage("summary", file = dataset):
+                append_summary(dataset, fragments, verbose = verbose)
+            if read_lookup_info(dataset) is not None:
+                with metrics.stage("lookup", file = dataset):
+                    update_lookup(dataset, verbose = verbose)
+        self._written = dict()
+
+
+    def _manifest_(self, dataset):
+        """_manifest_(dataset)
+
+        Used internally; returns the Manifest of a dataset (one object
+        per dataset, kept open for the lifetime of the parser). When first
+        opened, an interrupted replacement is completed (see replace._recover_).
+        """
+        from .Manifest import Manifest
+        from .replace import _recover_
+        if not hasattr(self, "_manifests"): self._manifests = dict()
+        if not dataset in self._manifests:
+            self._manifests[dataset] = Manifest(dataset)
+            _recover_(dataset, self._manifests[dataset])
+        return self._manifests[dataset]
 
 
     def _check_records_by_filename_(self, dataset, paths):
@@ -208,7 +795,10 @@ class IndexParser:
 
         Used internally to check if we have already processed this file (by
         path) to avoid adding the same information twice which will create
-        duplicated entries in the parquet file.
+        duplicated entries in the parquet file. Answered by the manifest
+        of the dataset (see Manifest). If the dataset exists but has no
+        manifest (created by an older version), the manifest is rebuilt
+        from the data first.
 
         Parameter
         =========
@@ -224,8 +814,6 @@ class IndexParser:
         """
 
         from os.path import isdir
-        import pyarrow.parquet as parquet
-        import pandas as pd
 
         # Only if parquet data set exists
         if isdir(dataset):
@@ -236,19 +824,12 @@ class IndexParser:
                 if not isinstance(p, str):
                     raise TypeError("Wrong input on 'paths', all list entries must be string.")
 
-            # Prepare filter, fetch data, and return either None if not found
-            # or a positive integer (number of entries found).
-            filters = [("_path", "=", p) for p in paths]
-            res = pd.read_parquet(dataset, engine = "pyarrow", filters = filters, columns = ["_path"])
+            manifest = self._manifest_(dataset)
+            if not manifest.exists(): manifest.rebuild(verbose = True)
 
-            return None if res.shape[0] == 0 else res.shape[0]
+            # Returns either None if not found or a positive integer
+            # (number of entries found).
+            return manifest.has_paths(paths)
 
         # Dataset does not yet exist
         return None
-
-
-
-
-
-
-
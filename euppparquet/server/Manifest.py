@@ -0,0 +1,340 @@
+
+
+
+import os
+import sqlite3
+import datetime as dt
+
+class Manifest:
+    """Manifest(dataset)
+
+    Persistent ingestion ledger of a parquet dataset. Keeps track of
+    the GRIB index files (sources) already written into the dataset,
+    the GRIB files ('_path') they describe, the number of records,
+    a content hash, and the fragments (parquet files) written. Used to
+    check whether a file has already been processed without scanning
+    the dataset.
+
+    The ledger is an SQLite database stored inside the dataset
+    directory ('_manifest.sqlite'); files starting with an underscore
+    are ignored by pyarrow when reading the dataset.
+
+    Parameters
+    ==========
+    dataset : str
+        Path to the parquet dataset (e.g., 'analysis.parquet').
+    """
+
+    FILENAME = "_manifest.sqlite"
+
+    # Content hash of sources found by rebuild (complete, hash unknown)
+    UNKNOWN = "unknown"
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS sources (
+               source   TEXT PRIMARY KEY,
+               nrows    INTEGER NOT NULL DEFAULT 0,
+               digest   TEXT,
+               created  TEXT)""",
+        """CREATE TABLE IF NOT EXISTS paths (
+               path     TEXT NOT NULL,
+               source   TEXT NOT NULL,
+               nrows    INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (path, source))""",
+        """CREATE TABLE IF NOT EXISTS fragments (
+               fragment TEXT NOT NULL,
+               source   TEXT NOT NULL,
+               PRIMARY KEY (fragment, source))""",
+        """CREATE INDEX IF NOT EXISTS fragments_source ON fragments (source)""",
+        """CREATE TABLE IF NOT EXISTS upstream (
+               source        TEXT PRIMARY KEY,
+               url           TEXT,
+               etag          TEXT,
+               last_modified TEXT,
+               checked       TEXT)""",
+        """CREATE TABLE IF NOT EXISTS runs (
+               started  TEXT NOT NULL,
+               finished TEXT,
+               mode     TEXT,
+               nfiles   INTEGER)"""
+    ]
+
+    def __init__(self, dataset):
+        if not isinstance(dataset, str):
+            raise TypeError("Input 'dataset' must be string.")
+        self.dataset = dataset
+        self.file    = os.path.join(dataset, self.FILENAME)
+        self._con    = None
+
+    def __repr__(self):
+        return f"<Manifest {self.file}>"
+
+    def exists(self):
+        """exists()
+
+        Returns True if the manifest file exists, else False.
+        """
+        return os.path.isfile(self.file)
+
+    def _connect_(self):
+        """_connect_()
+
+        Used internally; opens (and if needed creates) the database.
+        """
+        if self._con is None:
+            if not os.path.isdir(self.dataset): os.makedirs(self.dataset)
+            self._con = sqlite3.connect(self.file)
+            for sql in self.SCHEMA: self._con.execute(sql)
+            self._con.commit()
+        return self._con
+
+    def close(self):
+        """close()
+
+        Closes the database connection (if open).
+        """
+        if not self._con is None:
+            self._con.close()
+            self._con = None
+
+    def has_paths(self, paths):
+        """has_paths(paths)
+
+        Checks if records for any of the GRIB files in 'paths'
+        have already been ingested. Only sources ingested completely
+        are considered (see is_complete); records of a source which
+        failed part way are written again (see IndexParser).
+
+        Parameters
+        ==========
+        paths : str or list of str
+            Values of '_path' to be checked.
+
+        Returns
+        =======
+        Returns None if no entry is found, else a positive integer
+        (number of records found).
+        """
+        if isinstance(paths, str): paths = [paths]
+        if not self.exists() or len(paths) == 0: return None
+        con = self._connect_()
+        qs  = ", ".join(["?"] * len(paths))
+        res = con.execute(f"""SELECT SUM(p.nrows) FROM paths p JOIN sources s ON p.source = s.source
+                               WHERE p.path IN ({qs}) AND s.digest IS NOT NULL""", paths).fetchone()[0]
+        return None if not res else int(res)
+
+    def has_source(self, source):
+        """has_source(source)
+
+        Returns the source entry as a dictionary if 'source' (name of
+        the GRIB index file) has been ingested, else None.
+        """
+        if not self.exists(): return None
+        con = self._connect_()
+        res = con.execute("SELECT source, nrows, digest, created FROM sources WHERE source = ?",
+                          (source,)).fetchone()
+        return None if res is None else dict(zip(["source", "nrows", "digest", "created"], res))
+
+    def is_complete(self, source):
+        """is_complete(source)
+
+        Returns True if all records of 'source' have been written (the
+        content hash is recorded once the whole file has been read and
+        written, see IndexParser), else False.
+        """
+        entry = self.has_source(source)
+        return entry is not None and not entry["digest"] is None
+
+    def add(self, source, paths, fragments, digest = None):
+        """add(source, paths, fragments, digest = None)
+
+        Records (a batch of) records written into the dataset. Can be
+        called multiple times for the same source (e.g., when the source
+        is written in batches); row counts are accumulated.
+
+        Parameters
+        ==========
+        source : str
+            Name of the GRIB index file the records came from.
+        paths : dict
+            Number of records (value) written per '_path' (key).
+        fragments : list of str
+            Parquet files written (relative to the dataset directory).
+        digest : None or str
+            Content hash of the source file.
+        """
+        con = self._connect_()
+        now = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with con:
+            con.execute("""INSERT INTO sources (source, nrows, digest, created) VALUES (?, ?, ?, ?)
+                           ON CONFLICT(source) DO UPDATE SET nrows = nrows + excluded.nrows,
+                           digest = COALESCE(excluded.digest, digest)""",
+                        (source, sum(paths.values()), digest, now))
+            con.executemany("""INSERT INTO paths (path, source, nrows) VALUES (?, ?, ?)
+                               ON CONFLICT(path, source) DO UPDATE SET nrows = nrows + excluded.nrows""",
+                            [(p, source, int(n)) for p, n in paths.items()])
+            con.executemany("INSERT OR IGNORE INTO fragments (fragment, source) VALUES (?, ?)",
+                            [(f, source) for f in fragments])
+
+    def fragments(self, source):
+        """fragments(source)
+
+        Returns the list of fragments (relative to the dataset
+        directory) containing records from 'source'.
+        """
+        if not self.exists(): return []
+        con = self._connect_()
+        res = con.execute("SELECT fragment FROM fragments WHERE source = ? ORDER BY fragment", (source,))
+        return [x[0] for x in res.fetchall()]
+
+    def paths(self, source):
+        """paths(source)
+
+        Returns the GRIB files ('_path') of 'source' and the number of
+        records per file (dictionary).
+        """
+        if not self.exists(): return dict()
+        con = self._connect_()
+        res = con.execute("SELECT path, nrows FROM paths WHERE source = ? ORDER BY path", (source,))
+        return dict([(x[0], int(x[1])) for x in res.fetchall()])
+
+    def replace_source(self, source, paths, fragments, digest = None):
+        """replace_source(source, paths, fragments, digest = None)
+
+        Replaces all entries of 'source' (e.g., after its records have
+        been rewritten, see replace.replace_source); removes the source
+        if 'paths' is empty. Calling it twice has no effect.
+
+        Parameters
+        ==========
+        source : str
+            Name of the GRIB index file.
+        paths : dict
+            Number of records (value) per '_path' (key).
+        fragments : list of str
+            Fragments containing records of the source.
+        digest : None or str
+            Content hash of the source file.
+        """
+        con = self._connect_()
+        with con:
+            for table in ["sources", "paths", "fragments"]:
+                con.execute(f"DELETE FROM {table} WHERE source = ?", (source,))
+        if len(paths) > 0: self.add(source, paths, fragments, digest = digest)
+
+    def replace_fragments(self, old, new):
+        """replace_fragments(old, new)
+
+        Used when fragments are rewritten (e.g., compaction). All sources
+        which had records in one of the 'old' fragments are assigned
+        to all 'new' fragments. Calling it twice has no effect.
+
+        Parameters
+        ==========
+        old : list of str
+            Fragments removed (relative to the dataset directory).
+        new : list of str
+            Fragments replacing them.
+        """
+        if not self.exists() or len(old) == 0: return
+        con = self._connect_()
+        qs  = ", ".join(["?"] * len(old))
+        with con:
+            sources = con.execute(f"SELECT DISTINCT source FROM fragments WHERE fragment IN ({qs})", old).fetchall()
+            con.execute(f"DELETE FROM fragments WHERE fragment IN ({qs})", old)
+            con.executemany("INSERT OR IGNORE INTO fragments (fragment, source) VALUES (?, ?)",
+                            [(f, s[0]) for s in sources for f in new])
+
+    def upstream(self, source):
+        """upstream(source)
+
+        Returns the validators ('url', 'etag', 'last_modified', 'checked')
+        of the upstream GRIB index file 'source' as recorded when it was
+        last ingested (see update), or None.
+        """
+        if not self.exists(): return None
+        con = self._connect_()
+        res = con.execute("SELECT url, etag, last_modified, checked FROM upstream WHERE source = ?",
+                          (source,)).fetchone()
+        return None if res is None else dict(zip(["url", "etag", "last_modified", "checked"], res))
+
+    def set_upstream(self, source, url, etag = None, last_modified = None):
+        """set_upstream(source, url, etag = None, last_modified = None)
+
+        Records the validators (HTTP 'ETag' and 'Last-Modified' headers)
+        of the upstream GRIB index file 'source'.
+        """
+        con = self._connect_()
+        now = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with con:
+            con.execute("""INSERT OR REPLACE INTO upstream (source, url, etag, last_modified, checked)
+                           VALUES (?, ?, ?, ?, ?)""", (source, url, etag, last_modified, now))
+
+    def add_run(self, started, mode, nfiles):
+        """add_run(started, mode, nfiles)
+
+        Records a (successfully finished) run.
+
+        Parameters
+        ==========
+        started : datetime.datetime
+            Start of the run (UTC).
+        mode : str
+            Type of the run (e.g., 'update').
+        nfiles : int
+            Number of files ingested.
+        """
+        con = self._connect_()
+        now = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with con:
+            con.execute("INSERT INTO runs (started, finished, mode, nfiles) VALUES (?, ?, ?, ?)",
+                        (started.strftime("%Y-%m-%dT%H:%M:%SZ"), now, mode, nfiles))
+
+    def last_run(self, mode = None):
+        """last_run(mode = None)
+
+        Returns the start (datetime.datetime, UTC) of the last finished
+        run (of type 'mode' if set) or None.
+        """
+        if not self.exists(): return None
+        con = self._connect_()
+        if mode is None:
+            res = con.execute("SELECT MAX(started) FROM runs").fetchone()[0]
+        else:
+            res = con.execute("SELECT MAX(started) FROM runs WHERE mode = ?", (mode,)).fetchone()[0]
+        if res is None: return None
+        return dt.datetime.strptime(res, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo = dt.timezone.utc)
+
+    def rebuild(self, verbose = False):
+        """rebuild(verbose = False)
+
+        Reconstructs the manifest from the data in the dataset. Reads
+        the '_path' column of each fragment. As the GRIB index file
+        name is not stored in the data, the source is derived from
+        '_path' (basename of the GRIB file plus '.index'); the content
+        hash is unknown (stored as 'unknown', the sources are considered
+        complete). Upstream validators and runs (see update) are kept.
+
+        Parameters
+        ==========
+        verbose : bool
+            Set verbosity level, defaults to False.
+        """
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as parquet
+
+        if not os.path.isdir(self.dataset):
+            raise Exception(f"Dataset '{self.dataset}' does not exist.")
+
+        # Remove ingestion records; upstream validators and runs are kept
+        con = self._connect_()
+        with con:
+            for table in ["sources", "paths", "fragments"]: con.execute(f"DELETE FROM {table}")
+
+        files = ds.dataset(self.dataset, format = "parquet", partitioning = "hive").files
+        if verbose: print(f"Rebuilding {self.file} from {len(files)} fragments")
+        for file in files:
+            counts = parquet.read_table(file, columns = ["_path"]).group_by("_path").aggregate([("_path", "count")])
+            frag   = os.path.relpath(file, self.dataset)
+            for path, n in zip(counts.column("_path").to_pylist(), counts.column("_path_count").to_pylist()):
+                self.add(os.path.basename(path) + ".index", {path: n}, [frag], digest = self.UNKNOWN)
@@ -1,8 +1,20 @@
 
 
 from .IndexParser import IndexParser
+from .Manifest import Manifest
 from .prepare_zipfile import prepare_zipfile
+from .prepare_index import prepare_index
+from .compact import compact_dataset
+from .layout import LAYOUTS
+from .schema import migrate_dataset
 
 from .prepare_parquet import prepare_analysis
 from .prepare_parquet import prepare_forecast
 from .prepare_parquet import prepare_reforecast
+
+from .update import update_product
+from .replace import replace_source
+from .publish import publish_dataset
+from .summary import write_summary
+from .lookup import update_lookup
+from .jobs import JobQueue
@@ -0,0 +1,239 @@
+
+
+# --------------------------------------------------------------
+# Compaction of partitioned parquet datasets. Each call of
+# IndexParser.process_file appends new fragments; compaction
+# rewrites each partition into few well-sized, sorted files.
+# --------------------------------------------------------------
+
+import os
+import json
+import uuid
+
+from .schema import SCHEMA_KEY
+from .storage import SORT_COLUMNS, ROW_GROUP_SIZE, sort_table, write_options
+
+
+# Key stored in the footer of compacted files
+COMPACTED_KEY = b"euppparquet.compacted"
+
+# Journal written into a partition while it is being compacted
+JOURNAL = "_compact.json"
+
+
+def _list_fragments_(partition):
+    """_list_fragments_(partition)
+
+    Returns the (sorted) parquet files in a partition directory, ignoring
+    hidden files and files starting with an underscore (as pyarrow does).
+    """
+    res = [x for x in os.listdir(partition) if x.endswith(".parquet") and not x[0] in "._"]
+    return sorted(res)
+
+
+def _partitions_(dataset):
+    """_partitions_(dataset)
+
+    Returns all leaf directories of 'dataset' which contain parquet
+    files or a compaction journal.
+    """
+    res = []
+    for root, dirs, files in os.walk(dataset):
+        dirs[:] = sorted([x for x in dirs if not x[0] in "._"])
+        if JOURNAL in files or any([x.endswith(".parquet") and not x[0] in "._" for x in files]):
+            res.append(root)
+    return res
+
+
+def _is_compacted_(file):
+    """_is_compacted_(file)
+
+    Returns True if the footer of 'file' marks it as written by compaction.
+    """
+    import pyarrow.parquet as parquet
+    meta = parquet.read_schema(file).metadata
+    return meta is not None and COMPACTED_KEY in meta
+
+
+def _recover_(partition, dataset, manifest = None):
+    """_recover_(partition, dataset, manifest = None)
+
+    Completes or rolls back an interrupted compaction of 'partition'.
+    If the journal exists, the new files were completely written; the
+    compaction is rolled forward (old files removed, new files renamed).
+    Hidden temporary files without a journal are incomplete and removed.
+    """
+    journal = os.path.join(partition, JOURNAL)
+    if os.path.isfile(journal):
+        with open(journal, "r") as fid: jrnl = json.load(fid)
+        for file in jrnl["old"]:
+            if os.path.isfile(os.path.join(partition, file)): os.remove(os.path.join(partition, file))
+        for tmp, final in jrnl["new"]:
+            if os.path.isfile(os.path.join(partition, tmp)):
+                os.replace(os.path.join(partition, tmp), os.path.join(partition, final))
+        if manifest is not None:
+            rel = os.path.relpath(partition, dataset)
+            manifest.replace_fragments([os.path.join(rel, x) for x in jrnl["old"]],
+                                       [os.path.join(rel, x[1]) for x in jrnl["new"]])
+        os.remove(journal)
+    for file in os.listdir(partition):
+        if file.startswith(".compact-"): os.remove(os.path.join(partition, file))
+
+
+def compact_partition(partition, dataset, manifest = None, max_rows_per_file = 5000000,
+                      row_group_size = ROW_GROUP_SIZE, force = False):
+    """compact_partition(partition, dataset, manifest = None, max_rows_per_file = 5000000,
+                      row_group_size = ROW_GROUP_SIZE, force = False)
+
+    Rewrites all fragments of one partition into as few files as possible
+    (at most 'max_rows_per_file' rows each), sorted by SORT_COLUMNS.
+
+    The new files are first written under hidden temporary names. Once
+    complete, a journal listing old and new files is written, the old
+    files are removed and the new ones renamed. An interrupted compaction
+    is completed or rolled back on the next call (see _recover_); rows
+    are thus never duplicated.
+
+    Parameters
+    ==========
+    partition : str
+        Path to the partition (leaf directory).
+    dataset : str
+        Path to the dataset the partition belongs to.
+    manifest : None or Manifest
+        If set, the fragments are updated in the manifest.
+    max_rows_per_file : positive int
+        Maximum number of rows per file.
+    row_group_size : positive int
+        Number of rows per row group.
+    force : bool
+        If False (default) partitions consisting of compacted files only
+        are skipped.
+
+    Returns
+    =======
+    Dictionary with number of fragments and bytes before and after.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as parquet
+
+    _recover_(partition, dataset, manifest)
+
+    old    = _list_fragments_(partition)
+    before = sum([os.path.getsize(os.path.join(partition, x)) for x in old])
+    res    = dict(fragments_before = len(old), bytes_before = before,
+                  fragments_after  = len(old), bytes_after  = before, compacted = False)
+    if len(old) == 0: return res
+    if not force and all([_is_compacted_(os.path.join(partition, x)) for x in old]): return res
+
+    # Reading all fragments of the partition
+    tables = [parquet.read_table(os.path.join(partition, x)) for x in old]
+    keep   = dict() if tables[0].schema.metadata is None else tables[0].schema.metadata
+    keep   = dict([(k, v) for k, v in keep.items() if k == SCHEMA_KEY])
+    schema = tables[0].schema.remove_metadata()
+    try:
+        data = pa.concat_tables([x.cast(schema) for x in tables])
+    except Exception as e:
+        raise Exception(f"Fragments in {partition} have incompatible schemas; {e}")
+    del tables
+
+    data = sort_table(data)
+    meta = dict(keep)
+    meta[COMPACTED_KEY] = b"1"
+    data = data.replace_schema_metadata(meta)
+
+    # Writing new files under temporary names
+    guid = uuid.uuid4().hex
+    new  = []
+    for i, offset in enumerate(range(0, max(data.num_rows, 1), max_rows_per_file)):
+        tmp, final = f".compact-{guid}-{i}.parquet", f"{guid}-{i}.parquet"
+        chunk = data.slice(offset, max_rows_per_file)
+        parquet.write_table(chunk, os.path.join(partition, tmp),
+                            **write_options(chunk, row_group_size = row_group_size))
+        new.append([tmp, final])
+
+    # Commit; write the journal, roll forward
+    journal = os.path.join(partition, JOURNAL)
+    with open(journal + ".tmp", "w") as fid: json.dump(dict(old = old, new = new), fid)
+    os.replace(journal + ".tmp", journal)
+    _recover_(partition, dataset, manifest)
+
+    res["fragments_after"] = len(new)
+    res["bytes_after"]     = sum([os.path.getsize(os.path.join(partition, x[1])) for x in new])
+    res["compacted"]       = True
+    return res
+
+
+def compact_dataset(dataset, max_rows_per_file = 5000000, row_group_size = ROW_GROUP_SIZE,
+                    force = False, verbose = False):
+    """compact_dataset(dataset, max_rows_per_file = 5000000, row_group_size = ROW_GROUP_SIZE,
+                    force = False, verbose = False)
+
+    Compacts all partitions of a parquet dataset (see compact_partition).
+    Safe to be called multiple times; partitions already compacted are
+    skipped unless 'force = True'. The summary of the dataset ('_metadata')
+    is rewritten afterwards.
+
+    Parameters
+    ==========
+    dataset : str
+        Path to the parquet dataset (e.g., 'forecast.parquet').
+    max_rows_per_file : positive int
+        Maximum number of rows per file, defaults to 5000000.
+    row_group_size : positive int
+        Number of rows per row group, defaults to storage.ROW_GROUP_SIZE.
+    force : bool
+        Also rewrite partitions which have already been compacted.
+    verbose : bool
+        Set verbosity level, defaults to False.
+
+    Returns
+    =======
+    Dictionary with the number of partitions (total and compacted),
+    fragments and bytes before and after.
+    """
+    from .Manifest import Manifest
+    from .summary import write_summary, summary_is_current
+    from .lookup import read_lookup_info, update_lookup
+    from .replace import _recover_ as _recover_replace_
+
+    if not isinstance(dataset, str):
+        raise TypeError("Input 'dataset' must be string.")
+    if not os.path.isdir(dataset):
+        raise Exception(f"Dataset '{dataset}' does not exist.")
+    for x in [max_rows_per_file, row_group_size]:
+        if not isinstance(x, int) or not x > 0:
+            raise ValueError("Inputs 'max_rows_per_file' and 'row_group_size' must be positive integers.")
+
+    # Complete an interrupted replacement first (see replace.replace_source)
+    _recover_replace_(dataset, verbose = verbose)
+
+    manifest = Manifest(dataset)
+    manifest = manifest if manifest.exists() else None
+
+    res = dict(partitions = 0, compacted = 0, fragments_before = 0, bytes_before = 0,
+               fragments_after = 0, bytes_after = 0)
+    for partition in _partitions_(dataset):
+        tmp = compact_partition(partition, dataset, manifest, max_rows_per_file = max_rows_per_file,
+                                row_group_size = row_group_size, force = force)
+        res["partitions"] += 1
+        res["compacted"]  += int(tmp["compacted"])
+        for key in ["fragments_before", "bytes_before", "fragments_after", "bytes_after"]:
+            res[key] += tmp[key]
+        if verbose and tmp["compacted"]:
+            print(f"    Compacted {partition}: {tmp['fragments_before']} -> {tmp['fragments_after']} fragments")
+
+    if manifest is not None: manifest.close()
+
+    # Summary of the dataset (file names have changed); lookup index if existing
+    if res["compacted"] > 0 or not summary_is_current(dataset):
+        write_summary(dataset, verbose = verbose)
+    if res["compacted"] > 0 and read_lookup_info(dataset) is not None:
+        update_lookup(dataset, verbose = verbose)
+
+    if verbose:
+        print(f"Compacted {res['compacted']} of {res['partitions']} partitions in {dataset}")
+        print(f"    Fragments: {res['fragments_before']} -> {res['fragments_after']}")
+        print(f"    Bytes:     {res['bytes_before']} -> {res['bytes_after']}")
+
+    return res
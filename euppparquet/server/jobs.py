@@ -0,0 +1,199 @@
+
+
+# --------------------------------------------------------------
+# Persistent job queue for ingestion runs. Each GRIB index file
+# (URL) is one job with a state; an interrupted run is resumed
+# where it stopped (files ingested are neither downloaded nor
+# checked again). Downloads are retried with exponential backoff,
+# files missing upstream (403/404) are skipped.
+# --------------------------------------------------------------
+
+import os
+import time
+import random
+import sqlite3
+import datetime as dt
+
+# States of a job; 'missing' if the file does not exist upstream
+STATES = ["pending", "downloaded", "ingested", "failed", "missing"]
+
+# HTTP status codes not retried (file does not exist upstream)
+MISSING_STATUS = [403, 404]
+
+
+class JobQueue:
+    """JobQueue(file = None)
+
+    Queue of ingestion jobs (one per GRIB index file) stored in an
+    SQLite database. Jobs are added in the order of the URLs; their
+    state changes from 'pending' to 'downloaded' (local copy available)
+    and 'ingested', or to 'failed' (error after all retries) or 'missing'
+    (file not available upstream). Jobs which are not 'ingested' are
+    processed again when the queue is used by a new run.
+
+    Parameters
+    ==========
+    file : None or str
+        Name of the database file (created if needed). If None, the
+        queue is kept in memory (nothing is resumed).
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS jobs (
+               url      TEXT PRIMARY KEY,
+               source   TEXT NOT NULL,
+               state    TEXT NOT NULL DEFAULT 'pending',
+               attempts INTEGER NOT NULL DEFAULT 0,
+               error    TEXT,
+               updated  TEXT)""",
+        """CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)"""
+    ]
+
+    def __init__(self, file = None):
+        if not file is None and not isinstance(file, str):
+            raise TypeError("Input 'file' must be None or string.")
+        self.file = file
+        self._con = sqlite3.connect(":memory:" if file is None else file)
+        for sql in self.SCHEMA: self._con.execute(sql)
+        self._con.commit()
+
+    def __repr__(self):
+        return f"<JobQueue {':memory:' if self.file is None else self.file}>"
+
+    def close(self):
+        """close()
+
+        Closes the database connection (if open).
+        """
+        if not self._con is None:
+            self._con.close()
+            self._con = None
+
+    def add(self, urls):
+        """add(urls)
+
+        Adds new jobs ('pending'); URLs already in the queue keep their state.
+
+        Parameters
+        ==========
+        urls : list of str
+            URLs of the GRIB index files.
+        """
+        now = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with self._con:
+            self._con.executemany("INSERT OR IGNORE INTO jobs (url, source, updated) VALUES (?, ?, ?)",
+                                  [(x, os.path.basename(x), now) for x in urls])
+
+    def todo(self, urls):
+        """todo(urls)
+
+        Returns the URLs (in the order given) which have not been ingested.
+        """
+        done = self.urls("ingested")
+        return [x for x in urls if not x in done]
+
+    def urls(self, state):
+        """urls(state)
+
+        Returns the set of URLs with state 'state'.
+        """
+        if not state in STATES:
+            raise ValueError(f"Input 'state' must be one of {STATES}.")
+        res = self._con.execute("SELECT url FROM jobs WHERE state = ?", (state,))
+        return set([x[0] for x in res.fetchall()])
+
+    def get(self, url):
+        """get(url)
+
+        Returns the job as a dictionary ('url', 'source', 'state',
+        'attempts', 'error', 'updated') or None.
+        """
+        keys = ["url", "source", "state", "attempts", "error", "updated"]
+        res  = self._con.execute(f"SELECT {', '.join(keys)} FROM jobs WHERE url = ?", (url,)).fetchone()
+        return None if res is None else dict(zip(keys, res))
+
+    def set_state(self, url, state, error = None, attempts = 0):
+        """set_state(url, state, error = None, attempts = 0)
+
+        Sets the state of a job (added if needed).
+
+        Parameters
+        ==========
+        url : str
+            URL of the GRIB index file.
+        state : str
+            New state (see STATES).
+        error : None or str
+            Error message ('failed', 'missing').
+        attempts : int
+            Number of (download) attempts added to the job.
+        """
+        if not state in STATES:
+            raise ValueError(f"Input 'state' must be one of {STATES}.")
+        now = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with self._con:
+            self._con.execute("""INSERT INTO jobs (url, source, state, attempts, error, updated)
+                                 VALUES (?, ?, ?, ?, ?, ?)
+                                 ON CONFLICT(url) DO UPDATE SET state = excluded.state,
+                                 attempts = attempts + excluded.attempts, error = excluded.error,
+                                 updated = excluded.updated""",
+                              (url, os.path.basename(url), state, attempts, error, now))
+
+    def counts(self):
+        """counts()
+
+        Returns the number of jobs per state (dictionary).
+        """
+        res = dict([(x, 0) for x in STATES])
+        for state, n in self._con.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall():
+            res[state] = n
+        return res
+
+
+def fetch_index(url, dir, cache = "zip", session = None, retries = 3, backoff = 1.,
+                preload = False, verbose = False):
+    """fetch_index(url, dir, cache = "zip", session = None, retries = 3, backoff = 1.,
+                preload = False, verbose = False)
+
+    Calls prepare_index and retries if the download fails (connection
+    errors, timeouts, HTTP status other than 403/404). Waits
+    'backoff * 2^attempt' seconds (plus random jitter) between attempts.
+
+    Parameters
+    ==========
+    url, dir, cache, session, preload, verbose :
+        See prepare_index.
+    retries : int
+        Maximum number of retries (0 for no retries), defaults to 3.
+    backoff : float
+        Initial waiting time in seconds, defaults to 1.
+
+    Returns
+    =======
+    Tuple with the return of prepare_index (or None if the download
+    failed), the state ('downloaded', 'missing', or 'failed'), the
+    number of attempts, and the error message (None if downloaded).
+    """
+    from .prepare_index import prepare_index
+    from .prepare_zipfile import DownloadError
+
+    if not isinstance(retries, int) or retries < 0:
+        raise ValueError("Input 'retries' must be a non-negative integer.")
+
+    for attempt in range(retries + 1):
+        try:
+            res = prepare_index(url, dir, cache = cache, verbose = verbose, session = session,
+                                preload = preload)
+            return res, "downloaded", attempt + 1, None
+        except DownloadError as e:
+            if e.status in MISSING_STATUS: return None, "missing", attempt + 1, str(e)
+            error = str(e)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        if attempt < retries:
+            wait = min(backoff * 2**attempt, 60.) * (1. + random.random())
+            if verbose: print(f"    {error}; retrying in {wait:.1f}s")
+            time.sleep(wait)
+    return None, "failed", retries + 1, error
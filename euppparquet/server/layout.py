@@ -0,0 +1,123 @@
+
+
+# --------------------------------------------------------------
+# Partitioning layouts of the parquet datasets. The layout is
+# chosen when a dataset is created and stored inside the dataset
+# directory ('_layout.json') together with the version of the
+# schema (see schema.py); later writes use the stored layout.
+# --------------------------------------------------------------
+
+import os
+import json
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Available layouts (name: partition columns). 'date' is a single
+# integer key (YYYYMMDD) instead of three nested directories.
+LAYOUTS = {
+    "ymd":                  ["year", "month", "day"],
+    "date":                 ["date"],
+    "version-ymd":          ["version", "year", "month", "day"],
+    "version-product-ymd":  ["version", "product", "year", "month", "day"],
+    "version-product-date": ["version", "product", "date"],
+    "ymd-step":             ["year", "month", "day", "step"],
+    "ymd-param":            ["year", "month", "day", "param"],
+    "date-step":            ["date", "step"],
+    "date-param":           ["date", "param"]
+}
+
+# Layout used for new datasets unless specified otherwise
+DEFAULT_LAYOUTS = {"analysis":   "ymd",
+                   "forecast":   "version-product-ymd",
+                   "reforecast": "version-product-ymd"}
+
+# File in the dataset directory storing the layout
+LAYOUT_FILE = "_layout.json"
+
+
+def resolve_layout(layout):
+    """resolve_layout(layout)
+
+    Returns the partition columns of a layout.
+
+    Parameters
+    ==========
+    layout : str or list of str
+        Name of one of the LAYOUTS or a list of partition columns.
+
+    Returns
+    =======
+    List of str.
+    """
+    if isinstance(layout, str):
+        if not layout in LAYOUTS:
+            raise ValueError(f"Unknown layout '{layout}', allowed are {list(LAYOUTS.keys())}.")
+        return list(LAYOUTS[layout])
+    if not isinstance(layout, (list, tuple)) or not all([isinstance(x, str) for x in layout]):
+        raise TypeError("Layout must be str (name) or list of str (partition columns).")
+    if "date" in layout and any([x in layout for x in ["year", "month", "day"]]):
+        raise ValueError("Layout cannot combine 'date' with 'year', 'month', or 'day'.")
+    return list(layout)
+
+
+def read_info(dataset):
+    """read_info(dataset)
+
+    Returns the content of the layout file in the dataset directory
+    (dictionary with 'partitioning' and 'schema'), or None if not
+    existing (new dataset or created by an older version).
+    """
+    file = os.path.join(dataset, LAYOUT_FILE)
+    if not os.path.isfile(file): return None
+    with open(file, "r") as fid: res = json.load(fid)
+    res.setdefault("schema", 0)
+    return res
+
+
+def read_layout(dataset):
+    """read_layout(dataset)
+
+    Returns the partition columns stored in the dataset directory,
+    or None if not existing (new dataset or created by an older
+    version; see DEFAULT_LAYOUTS).
+    """
+    info = read_info(dataset)
+    return None if info is None else info["partitioning"]
+
+
+def write_layout(dataset, partition_cols, schema = 0):
+    """write_layout(dataset, partition_cols, schema = 0)
+
+    Stores the partition columns and the version of the schema
+    the files are written with in the dataset directory.
+    """
+    if not os.path.isdir(dataset): os.makedirs(dataset)
+    file = os.path.join(dataset, LAYOUT_FILE)
+    with open(file + ".tmp", "w") as fid:
+        json.dump(dict(partitioning = list(partition_cols), schema = int(schema)), fid)
+    os.replace(file + ".tmp", file)
+
+
+def apply_layout(table, partition_cols):
+    """apply_layout(table, partition_cols)
+
+    Adapts a transformed table (see transform.transform_table) to a
+    layout. Adds the compact date key ('date', int32 YYYYMMDD) if
+    required; the date keys 'year', 'month', and 'day' are dropped
+    if the layout uses 'date' instead.
+
+    Parameters
+    ==========
+    table : pyarrow.Table
+    partition_cols : list of str
+
+    Returns
+    =======
+    pyarrow.Table
+    """
+    if not "date" in partition_cols: return table
+    date = pc.add(pc.add(pc.multiply(table.column("year"), 10000),
+                         pc.multiply(table.column("month"), 100)), table.column("day"))
+    table = table.drop_columns(["year", "month", "day"])
+    return table.append_column("date", pc.cast(date, pa.int32()))
@@ -0,0 +1,204 @@
+
+
+# --------------------------------------------------------------
+# Builds and updates the point-lookup index of a dataset (see
+# client.lookup.LookupIndex). The index consists of segments;
+# each one covers a set of fragments. Updates add one segment
+# for the fragments written since the last update; segments
+# covering fragments which no longer exist (compaction, migration)
+# are rebuilt. With more than 'max_segments' segments the index
+# is rebuilt as one segment.
+# --------------------------------------------------------------
+
+import os
+import json
+import shutil
+import uuid
+
+
+def _read_fragments_(dataset, files):
+    """_read_fragments_(dataset, files)
+
+    Used internally; reads the key fields and message locations of
+    the fragments (relative to 'dataset') including the partition keys.
+    """
+    import pyarrow.dataset as ds
+    from ..client.lookup import LOOKUP_FIELDS
+
+    data = ds.dataset([os.path.join(dataset, *x.split("/")) for x in files], format = "parquet",
+                      partitioning = "hive", partition_base_dir = dataset)
+    cols = [x for x in LOOKUP_FIELDS + ["year", "month", "day", "_path", "_offset", "_length"] \
+            if x in data.schema.names]
+    return data.to_table(columns = cols)
+
+
+def _column_(table, name):
+    """_column_(table, name)
+
+    Used internally; returns a column as numpy array; strings (missing: '')
+    or integers (missing: -1). 'date' is derived from 'year', 'month', and
+    'day' if not stored.
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from ..client.lookup import LOOKUP_STRINGS
+
+    if name == "date" and not "date" in table.column_names:
+        y, m, d = [_column_(table, x) for x in ["year", "month", "day"]]
+        return y * 10000 + m * 100 + d
+    col = table.column(name)
+    if pa.types.is_dictionary(col.type): col = col.cast(col.type.value_type)
+    if name in LOOKUP_STRINGS:
+        col = pc.fill_null(col.cast(pa.string()), "")
+        return np.asarray(col.to_numpy(zero_copy_only = False), dtype = str)
+    return pc.fill_null(col.cast(pa.int64()), -1).to_numpy()
+
+
+def _build_segment_(dataset, files, dir):
+    """_build_segment_(dataset, files, dir)
+
+    Used internally; builds one segment from the fragments 'files' and
+    writes it into the directory 'dir'. Each key field is coded by the
+    position of its value in the (sorted) distinct values of the segment;
+    the codes are packed into one unsigned 64 bit integer (first field in
+    the highest bits) such that sorting the keys sorts the records by
+    LOOKUP_FIELDS. Returns the number of records.
+    """
+    import numpy as np
+    import pyarrow as pa
+    from ..client.lookup import LOOKUP_FIELDS
+
+    table  = _read_fragments_(dataset, files)
+    names  = [x for x in LOOKUP_FIELDS if x in table.column_names or \
+              (x == "date" and all([y in table.column_names for y in ["year", "month", "day"]]))]
+
+    fields, codes = [], []
+    for name in names:
+        values, code = np.unique(_column_(table, name), return_inverse = True)
+        fields.append(dict(name = name, values = values.tolist(), bits = max(1, int(len(values) - 1).bit_length())))
+        codes.append(code.reshape(-1))
+    if sum([x["bits"] for x in fields]) > 64:
+        raise Exception(f"Too many distinct keys for the lookup index of {dataset} " + \
+                        f"({', '.join([x['name'] + ': ' + str(len(x['values'])) for x in fields])}).")
+
+    keys  = np.zeros(table.num_rows, dtype = np.uint64)
+    shift = sum([x["bits"] for x in fields])
+    for field, code in zip(fields, codes):
+        shift -= field["bits"]
+        field["shift"] = shift
+        keys |= code.astype(np.uint64) << np.uint64(shift)
+
+    path   = table.column("_path")
+    path   = path.cast(path.type.value_type) if pa.types.is_dictionary(path.type) else path
+    path   = path.combine_chunks().dictionary_encode()
+    pathid = path.indices.to_numpy(zero_copy_only = False).astype(np.int32)
+    offset = table.column("_offset").to_numpy().astype(np.int64)
+    length = table.column("_length").to_numpy().astype(np.int64)
+
+    order = np.lexsort((offset, pathid, keys))
+    os.makedirs(dir)
+    for name, x in [("keys", keys), ("path", pathid), ("offset", offset), ("length", length)]:
+        np.save(os.path.join(dir, f"{name}.npy"), x[order])
+    with open(os.path.join(dir, "meta.json"), "w") as fid:
+        json.dump(dict(fields = fields, paths = path.dictionary.to_pylist(), fragments = sorted(files),
+                       rows = table.num_rows), fid)
+    return table.num_rows
+
+
+def read_lookup_info(dataset):
+    """read_lookup_info(dataset)
+
+    Returns the content of the index file of the lookup index of a
+    dataset (dictionary with 'segments' and 'fields') or None if the
+    dataset has no lookup index.
+    """
+    from ..client.lookup import LOOKUP_DIR, LOOKUP_FILE
+    file = os.path.join(dataset, LOOKUP_DIR, LOOKUP_FILE)
+    if not os.path.isfile(file): return None
+    with open(file, "r") as fid: return json.load(fid)
+
+
+def update_lookup(dataset, max_segments = 8, rebuild = False, verbose = False):
+    """update_lookup(dataset, max_segments = 8, rebuild = False, verbose = False)
+
+    Creates or updates the point-lookup index of a dataset (see
+    client.lookup.LookupIndex). Only fragments written since the last
+    update are read (one new segment). Segments with fragments which no
+    longer exist are rebuilt from their remaining fragments. If the index
+    would consist of more than 'max_segments' segments it is rebuilt
+    from all fragments (one segment).
+
+    The list of segments is replaced atomically; readers holding the old
+    segments (memory-mapped) keep working until they refresh.
+
+    Parameters
+    ==========
+    dataset : str
+        Path to the parquet dataset.
+    max_segments : positive int
+        Maximum number of segments, defaults to 8.
+    rebuild : bool
+        If True, the index is rebuilt from all fragments.
+    verbose : bool
+        Set verbosity level, defaults to False.
+
+    Returns
+    =======
+    Dictionary with the number of 'segments' and the number of
+    fragments ('added') and 'removed' since the last update.
+    """
+    from ..client.lookup import LOOKUP_DIR, LOOKUP_FILE, LOOKUP_FIELDS
+    from .summary import _fragments_
+
+    if not os.path.isdir(dataset):
+        raise Exception(f"Dataset '{dataset}' does not exist.")
+    if not isinstance(max_segments, int) or not max_segments > 0:
+        raise ValueError("Input 'max_segments' must be a positive integer.")
+
+    dir  = os.path.join(dataset, LOOKUP_DIR)
+    info = read_lookup_info(dataset)
+    info = dict(segments = []) if info is None or rebuild else info
+
+    # Fragments covered by the segments of the current index
+    covered = dict()
+    for name in info["segments"]:
+        with open(os.path.join(dir, name, "meta.json"), "r") as fid:
+            covered[name] = set(json.load(fid)["fragments"])
+
+    files   = set(_fragments_(dataset))
+    known   = set().union(*covered.values()) if len(covered) > 0 else set()
+    added   = files - known
+    removed = known - files
+
+    # Segments to be kept (all fragments still exist), fragments to be indexed
+    keep = [x for x in info["segments"] if len(covered[x] & removed) == 0]
+    todo = (files - set().union(*[covered[x] for x in keep])) if len(keep) > 0 else set(files)
+    if len(todo) > 0 and len(keep) + 1 > max_segments:
+        keep, todo = [], set(files)
+    res = dict(segments = len(keep) + (len(todo) > 0), added = len(added), removed = len(removed))
+    if len(todo) == 0 and keep == info["segments"]: return res
+
+    if not os.path.isdir(dir): os.makedirs(dir)
+    segments = list(keep)
+    if len(todo) > 0:
+        name = f"seg-{uuid.uuid4().hex[:12]}"
+        rows = _build_segment_(dataset, sorted(todo), os.path.join(dir, name))
+        segments.append(name)
+        if verbose: print(f"    Lookup index {dataset}: new segment with {len(todo)} fragments, {rows} records")
+
+    # Replace the list of segments, remove segments no longer used
+    fields = []
+    for name in segments:
+        with open(os.path.join(dir, name, "meta.json"), "r") as fid:
+            fields += [x["name"] for x in json.load(fid)["fields"]]
+    tmp = os.path.join(dir, f".{LOOKUP_FILE}.tmp")
+    with open(tmp, "w") as fid:
+        json.dump(dict(segments = segments, fields = [x for x in LOOKUP_FIELDS if x in fields]), fid)
+    os.replace(tmp, os.path.join(dir, LOOKUP_FILE))
+    for name in os.listdir(dir):
+        if name.startswith("seg-") and not name in segments:
+            shutil.rmtree(os.path.join(dir, name), ignore_errors = True)
+
+    if verbose: print(f"    Lookup index {dataset}: {len(segments)} segments")
+    return res
@@ -0,0 +1,297 @@
+
+
+# --------------------------------------------------------------
+# Instrumentation of the ingestion (download, zip, read, decode,
+# transform, duplicate check, write). Records wall time, rows
+# and bytes per stage and GRIB index file. Disabled by default;
+# stage() then returns a shared no-op context manager.
+# --------------------------------------------------------------
+
+import os
+import json
+import time
+import threading
+
+# Active Metrics object (None if disabled)
+_active = None
+
+
+class _Null:
+    """No-op stage/file context used while metrics are disabled."""
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *args): return False
+    def add(self, rows = 0, bytes = 0): pass
+
+_NULL = _Null()
+
+
+class _Stage:
+    """_Stage(metrics, name, file)
+
+    Context measuring the wall time of one stage; rows and bytes
+    are added by the caller (see add).
+    """
+    __slots__ = ("metrics", "name", "file", "rows", "bytes", "t0")
+
+    def __init__(self, metrics, name, file):
+        self.metrics, self.name, self.file = metrics, name, file
+        self.rows, self.bytes = 0, 0
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.add(self.file, self.name, time.perf_counter() - self.t0, self.rows, self.bytes)
+        return False
+
+    def add(self, rows = 0, bytes = 0):
+        self.rows  += rows
+        self.bytes += bytes
+
+
+class _File:
+    """_File(metrics, name)
+
+    Context marking the GRIB index file processed by the current
+    thread; stages without explicit file are assigned to it.
+    """
+    __slots__ = ("metrics", "name", "prev")
+
+    def __init__(self, metrics, name):
+        self.metrics, self.name = metrics, name
+
+    def __enter__(self):
+        self.prev = getattr(self.metrics._local, "file", None)
+        self.metrics._local.file = self.name
+        if self.metrics.trace_memory:
+            import tracemalloc
+            tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics._local.file = self.prev
+        if self.metrics.trace_memory:
+            import tracemalloc
+            self.metrics.set_peak(self.name, tracemalloc.get_traced_memory()[1])
+        with self.metrics._lock: self.metrics._nfiles += 1
+        self.metrics.emit(self.name)
+        return False
+
+    def add(self, rows = 0, bytes = 0): pass
+
+
+class Metrics:
+    """Metrics(file = None, trace_memory = False, keep = False)
+
+    Collects wall time, rows, and bytes per stage and GRIB index file.
+    Usually not used directly; see enable, stage, and file.
+
+    Parameters
+    ==========
+    file : None or str
+        If set, one JSON record per GRIB index file is appended to this
+        file once the file has been processed, and a summary record
+        when closed (JSON lines).
+    trace_memory : bool
+        If True, the peak memory allocated (tracemalloc) while processing
+        each file is recorded. Slows down the processing considerably.
+    keep : bool
+        If True, the records of the files are kept when a file is done
+        instead of being written. Used in worker processes which hand
+        their records over to the main process (see records, merge).
+    """
+
+    def __init__(self, file = None, trace_memory = False, keep = False):
+        self.path         = file
+        self.trace_memory = trace_memory
+        self.keep         = keep
+        self.started      = time.perf_counter()
+        self._lock        = threading.Lock()
+        self._local       = threading.local()
+        self._files       = dict()         # Pending records per file
+        self._totals      = dict()         # Totals per stage
+        self._nfiles      = 0
+        self._pid         = os.getpid()     # Inherited by forked workers
+        self._fid         = None if file is None else open(file, "a")
+        if trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing(): tracemalloc.start()
+
+    def __repr__(self):
+        return f"<Metrics {len(self._totals)} stages, {self._nfiles} files>"
+
+    def stage(self, name, file = None):
+        """stage(name, file = None)
+
+        Returns a context manager measuring one stage of 'file' (defaults
+        to the file of the current thread, see file).
+        """
+        return _Stage(self, name, getattr(self._local, "file", None) if file is None else file)
+
+    def file(self, name):
+        """file(name)
+
+        Returns a context manager; stages executed by this thread are
+        assigned to the GRIB index file 'name'. The record of the file
+        is written when leaving the context.
+        """
+        return _File(self, name)
+
+    def add(self, file, stage, seconds = 0., rows = 0, bytes = 0, calls = 1):
+        """add(file, stage, seconds = 0., rows = 0, bytes = 0, calls = 1)
+
+        Adds a measurement.
+        """
+        with self._lock:
+            for rec in [self._totals, self._files.setdefault(file, dict())]:
+                x = rec.setdefault(stage, dict(seconds = 0., rows = 0, bytes = 0, calls = 0))
+                x["seconds"] += seconds
+                x["rows"]    += rows
+                x["bytes"]   += bytes
+                x["calls"]   += calls
+
+    def set_peak(self, file, peak):
+        """set_peak(file, peak)
+
+        Records the peak memory (bytes) allocated while processing a file.
+        """
+        with self._lock:
+            rec = self._files.setdefault(file, dict())
+            rec["_peak_memory"] = max(peak, rec.get("_peak_memory", 0))
+
+    def records(self):
+        """records()
+
+        Returns the pending records as a dictionary (file: stages); used
+        to hand over the measurements of worker processes (see merge).
+        """
+        with self._lock: return dict([(k, dict(v)) for k, v in self._files.items()])
+
+    def merge(self, records):
+        """merge(records)
+
+        Adds the records of another Metrics object (see records).
+        """
+        for file, stages in records.items():
+            for stage, x in stages.items():
+                if stage == "_peak_memory":
+                    self.set_peak(file, x)
+                else:
+                    self.add(file, stage, x["seconds"], x["rows"], x["bytes"], x["calls"])
+
+    def emit(self, file):
+        """emit(file)
+
+        Writes the record of a file (JSON line, if 'file' is set) and
+        removes it from the pending records.
+        """
+        if self.keep: return
+        with self._lock:
+            stages = self._files.pop(file, None)
+            if stages is None: return
+            if self._fid is None: return
+            peak = stages.pop("_peak_memory", None)
+            rec  = dict(type = "file", file = file, seconds = sum([x["seconds"] for x in stages.values()]),
+                        stages = stages)
+            if peak is not None: rec["peak_memory"] = peak
+            self._fid.write(json.dumps(rec) + "\n")
+            self._fid.flush()
+
+    def summary(self):
+        """summary()
+
+        Returns a dictionary with the totals per stage, the number of
+        files and the wall time of the run.
+        """
+        with self._lock:
+            return dict(files = self._nfiles, seconds = time.perf_counter() - self.started,
+                        stages = dict([(k, dict(v)) for k, v in self._totals.items()]))
+
+    def print_summary(self):
+        """print_summary()
+
+        Prints the totals per stage.
+        """
+        res   = self.summary()
+        total = sum([x["seconds"] for x in res["stages"].values()])
+        print(f"Metrics: {res['files']} files, {res['seconds']:.2f}s wall time")
+        fmt = "    {:<12s} {:>7s} {:>10s} {:>7s} {:>12s} {:>10s} {:>12s}"
+        print(fmt.format("stage", "calls", "seconds", "%", "rows", "MiB", "rows/s"))
+        for name, x in sorted(res["stages"].items(), key = lambda x: -x[1]["seconds"]):
+            print(fmt.format(name, str(x["calls"]), f"{x['seconds']:.3f}",
+                             f"{x['seconds'] / max(total, 1e-9) * 100:.1f}", str(x["rows"]),
+                             f"{x['bytes'] / 2**20:.2f}",
+                             f"{x['rows'] / x['seconds']:.0f}" if x["rows"] > 0 and x["seconds"] > 0 else "-"))
+
+    def close(self):
+        """close()
+
+        Writes the pending records and the summary (if 'file' was set).
+        Copies inherited by forked processes write nothing.
+        """
+        if not self._pid == os.getpid(): self._fid = None
+        self.keep = False
+        for file in list(self._files.keys()): self.emit(file)
+        if self._fid is not None:
+            self._fid.write(json.dumps(dict(type = "summary", **self.summary())) + "\n")
+            self._fid.close()
+            self._fid = None
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.stop()
+
+
+def enable(file = None, trace_memory = False, keep = False):
+    """enable(file = None, trace_memory = False, keep = False)
+
+    Enables the instrumentation (see Metrics); returns the Metrics object.
+    """
+    global _active
+    if _active is not None: _active.close()
+    _active = Metrics(file, trace_memory, keep)
+    return _active
+
+
+def disable():
+    """disable()
+
+    Disables the instrumentation; returns the (closed) Metrics object or None.
+    """
+    global _active
+    res, _active = _active, None
+    if res is not None: res.close()
+    return res
+
+
+def active():
+    """active()
+
+    Returns the active Metrics object or None if disabled.
+    """
+    return _active
+
+
+def stage(name, file = None):
+    """stage(name, file = None)
+
+    Context manager measuring one stage (see Metrics.stage); a no-op
+    if the instrumentation is disabled.
+
+    Examples
+    ========
+    >>> with metrics.stage("decode") as m:
+    >>>     data = pajson.read_json(...)
+    >>>     m.add(rows = data.num_rows, bytes = nbytes)
+    """
+    return _NULL if _active is None else _active.stage(name, file)
+
+
+def file(name):
+    """file(name)
+
+    Context manager assigning the stages of this thread to a GRIB
+    index file (see Metrics.file); a no-op if disabled.
+    """
+    return _NULL if _active is None else _active.file(name)
@@ -0,0 +1,139 @@
+
+# --------------------------------------------------------------
+# Helper function to get the GRIB index files; either cached on
+# disc (zip, gzip, zstd) or streamed directly from the server.
+# --------------------------------------------------------------
+
+# Allowed values for 'cache' and the file extension used
+CACHE_FORMATS = {"zip": ".zip", "gzip": ".gz", "zstd": ".zst", None: None}
+
+def prepare_index(url, dir = None, cache = "zip", verbose = True, session = None, preload = False):
+    """prepare_index(url, dir = None, cache = "zip", verbose = True, session = None, preload = False)
+
+    Provides the content of a GRIB index file for the IndexParser.
+
+    If 'cache' is None nothing is written to disc; the body of the HTTP
+    response is handed over as a binary stream and parsed while being
+    downloaded. Else a local copy is kept in 'dir' and only downloaded
+    if not yet existing. 'cache = "zip"' uses prepare_zipfile (the
+    original format), 'gzip' and 'zstd' store the response as a gzip
+    or zstandard compressed file written while streaming the download
+    (no uncompressed copy on disc). Both can be decompressed while
+    parsing; 'zstd' requires the (optional) zstandard package.
+
+    Parameter
+    =========
+    url : str
+        URL to the GRIB index file to be processed.
+    dir : None or str
+        Where to store the local copy; required unless 'cache' is None.
+    cache : None or str
+        One of 'zip' (default), 'gzip', 'zstd', or None.
+    verbose : bool
+        Verbosity level, defaults to True.
+    session : None or requests.Session
+        If set, this session is used for the download (see get_session).
+    preload : bool
+        Only used if 'cache' is None. If True the response is read into
+        memory (io.BytesIO) instead of returning the open stream; used
+        when files are downloaded ahead of the parser.
+
+    Return
+    ======
+    Tuple with the name of the GRIB index file and either the name of
+    the local file or a binary file object.
+    """
+
+    import os
+    import io
+    import requests
+    import tempfile
+    from . import metrics
+
+    if not cache in CACHE_FORMATS.keys():
+        raise ValueError(f"Wrong input on 'cache', allowed are {list(CACHE_FORMATS.keys())}.")
+    if not cache is None and not isinstance(dir, str):
+        raise ValueError("Input 'dir' required if 'cache' is set.")
+
+    name = os.path.basename(url)
+
+    # Original zip file cache
+    if cache == "zip":
+        from .prepare_zipfile import prepare_zipfile
+        return name, prepare_zipfile(url, dir, verbose = verbose, session = session)
+
+    # Check if we have a local copy
+    if not cache is None:
+        local = os.path.join(dir, name + CACHE_FORMATS[cache])
+        if os.path.isfile(local): return name, local
+
+    if verbose: print(f"Downloading {url}")
+    get = requests.get if session is None else session.get
+    with metrics.stage("download", file = name):
+        req = get(url, stream = True)
+    if not req.status_code == 200:
+        from .prepare_zipfile import DownloadError
+        req.close()
+        raise DownloadError(req.status_code, url)
+
+    # No local copy; hand over the stream of the response (the transfer
+    # is then accounted for by IndexParser as part of the 'read' stage)
+    if cache is None:
+        if preload:
+            with metrics.stage("download", file = name) as m:
+                res = io.BytesIO(req.content)
+                m.add(bytes = len(res.getbuffer()))
+            req.close()
+            return name, res
+        req.raw.decode_content = True
+        req.raw.auto_close     = False
+        return name, io.BufferedReader(req.raw, 1024 * 1024)
+
+    # Writing compressed copy; temporary file first, renamed when complete
+    if verbose: print(f"Creating {local}")
+    tmp = tempfile.NamedTemporaryFile(dir = dir, suffix = CACHE_FORMATS[cache], delete = False)
+    tmp.close()
+    try:
+        with metrics.stage("download", file = name) as m:
+            with _open_compressed_(tmp.name, cache, "wb") as fid:
+                for chunk in req.iter_content(1024 * 1024):
+                    fid.write(chunk)
+                    m.add(bytes = len(chunk))
+        os.replace(tmp.name, local)
+    except:
+        if os.path.isfile(tmp.name): os.remove(tmp.name)
+        raise
+    finally:
+        req.close()
+
+    return name, local
+
+
+def _open_compressed_(file, cache, mode = "rb"):
+    """_open_compressed_(file, cache, mode = "rb")
+
+    Used internally; opens a gzip or zstandard compressed file.
+
+    Parameter
+    =========
+    file : str
+        Name of the file.
+    cache : str
+        Either 'gzip' or 'zstd'.
+    mode : str
+        Either 'rb' (default) or 'wb'.
+
+    Return
+    ======
+    Binary file object.
+    """
+    if cache == "gzip":
+        import gzip
+        return gzip.open(file, mode, compresslevel = 6) if mode == "wb" else gzip.open(file, mode)
+    elif cache == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Package 'zstandard' required for cache = 'zstd'.")
+        return zstandard.open(file, mode)
+    raise ValueError(f"Unknown compression '{cache}'.")
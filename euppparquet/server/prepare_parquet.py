@@ -1,19 +1,297 @@
+# --------------------------------------------------------------
+# Helper function; ordered map over a pool with bounded look-ahead
+# --------------------------------------------------------------
+def _bounded_map_(pool, fun, items, window, **kwargs):
+    """_bounded_map_(pool, fun, items, window, **kwargs)
+
+    Submits 'fun(item, **kwargs)' to an executor ('pool') for each item
+    and yields the results in the order of 'items'. At most 'window'
+    tasks are in flight (queued or running) such that the pool does
+    not run away from the consumer too far.
+    """
+    from collections import deque
+
+    items   = iter(items)
+    pending = deque()
+    def submit():
+        for item in items:
+            pending.append(pool.submit(fun, item, **kwargs))
+            if len(pending) >= window: break
+    submit()
+    while len(pending) > 0:
+        res = pending.popleft().result()
+        submit()
+        yield res
 
 
+# --------------------------------------------------------------
+# Worker function used by process pool (parallel ingestion)
+# --------------------------------------------------------------
+_worker_session_ = None
+def _parse_worker_(url, dir, nrows = None, chunksize = None, cache = "zip", layouts = None,
+                   measure = None, retries = 3):
+    """_parse_worker_(url, dir, nrows = None, chunksize = None, cache = "zip", layouts = None,
+                   measure = None, retries = 3)
+
+    Executed in worker processes; downloads (see jobs.fetch_index)
+    and parses (see IndexParser.parse_file) one GRIB index file.
+    Nothing is written to the parquet datasets. If 'measure' is set
+    ('trace_memory' of the main process) the stages are measured
+    (see metrics) and returned on 'metrics'.
+
+    Errors are not raised but returned; the result contains the 'url',
+    the 'state' of the job ('downloaded', 'missing', 'failed'; see
+    jobs.JobQueue), the number of download 'attempts' and the 'error'.
+    """
+    from .IndexParser import IndexParser
+    from .prepare_zipfile import get_session
+    from .jobs import fetch_index
+    from . import metrics
+
+    global _worker_session_
+    if _worker_session_ is None: _worker_session_ = get_session()
+
+    if measure is not None: metrics.enable(trace_memory = measure, keep = True)
+    try:
+        fetched, state, attempts, error = fetch_index(url, dir, cache = cache, session = _worker_session_,
+                                                      retries = retries)
+        if fetched is None:
+            return dict(url = url, state = state, attempts = attempts, error = error)
+        name, file = fetched
+        try:
+            res = IndexParser(layouts).parse_file(file, nrows = nrows, chunksize = chunksize, name = name)
+        except Exception as e:
+            return dict(url = url, state = "failed", attempts = attempts, error = f"Parsing failed; {e}")
+        res.update(url = url, state = state, attempts = attempts, error = None)
+        if measure is not None: res["metrics"] = metrics.active().records()
+    finally:
+        if measure is not None: metrics.disable()
+    return res
 
 
 # --------------------------------------------------------------
 # Helper function processing files
 # --------------------------------------------------------------
-def process_files(urls, dir, verbose = True, nrows = None):
+def process_files(urls, dir, verbose = True, nrows = None, jobs = 1, chunksize = None, workers = 1,
+                  cache = "zip", layouts = None, queue = None, retries = 3, buffer_rows = None,
+                  replace = False):
+    """process_files(urls, dir, verbose = True, nrows = None, jobs = 1, chunksize = None, workers = 1,
+                  cache = "zip", layouts = None, queue = None, retries = 3, buffer_rows = None,
+                  replace = False)
+
+    Downloads the GRIB index files (see prepare_index) and hands
+    them over to the IndexParser. All downloads share one pooled
+    HTTP session. If 'jobs' is larger than one, up to 'jobs' files
+    are downloaded concurrently by a thread pool which runs ahead
+    of the parser; the files are still parsed one by one in the
+    order given by 'urls'.
+
+    If 'workers' is larger than one, files are downloaded, parsed and
+    transformed by a pool of 'workers' processes. The resulting
+    Arrow tables are handed back to this (single) process which is
+    the only one performing the duplicate check and writing into
+    the datasets, in the order given by 'urls'.
+
+    Each file is a job in a queue (see jobs.JobQueue). Failed downloads
+    are retried with exponential backoff (see jobs.fetch_index); files
+    missing upstream (403/404) or failing after all retries are skipped
+    and reported, they do not abort the run. If the queue is persisted
+    ('queue' is a file name), files ingested by a previous run are
+    skipped without downloading them again (resume); unless they are not
+    (or not completely) in the manifest of the dataset (e.g., dataset
+    removed, or a batch failed). Files are only marked as ingested once
+    the manifest records them as complete (see Manifest.is_complete).
+
+    If 'replace' is True, files already ingested are not skipped; their
+    records are replaced by the ones of the (republished) file instead
+    (see IndexParser.replace_parsed and replace.replace_source).
+
+    Once done, the new fragments are added to the summary ('_metadata')
+    of the datasets (see IndexParser.flush).
+
+    Parameters
+    ==========
+    urls : list of str
+        URLs of the GRIB index files to be processed.
+    dir : str
+        Directory where the local copies are stored (see prepare_index).
+    verbose : bool
+        Verbosity level, defaults to True.
+    nrows : None or positive int
+        For development purposes only, see prepare_analysis.
+    jobs : positive int
+        Number of concurrent downloads, defaults to 1. Not used
+        if 'workers' is larger than one.
+    chunksize : None or positive int
+        If set, index files are parsed and written in batches of
+        'chunksize' records (see IndexParser.process_file).
+    workers : positive int
+        Number of worker processes parsing index files, defaults to 1
+        (parse in this process).
+    cache : None or str
+        Format of the local copies of the GRIB index files, one of
+        'zip' (default), 'gzip', 'zstd', or None (no local copy; the
+        response is parsed directly). See prepare_index.
+    layouts : None or dict
+        Partitioning layouts for datasets to be created (see IndexParser).
+    queue : None, str, or jobs.JobQueue
+        Job queue; name of the database file (created if needed) to
+        persist the state of the files across runs. None (default) uses
+        a queue in memory (retries and skipping missing files only).
+    retries : int
+        Maximum number of retries per download, defaults to 3.
+    buffer_rows : None or positive int
+        If set, records of consecutive files are buffered and written
+        per partition in fragments of about this many records (see
+        IndexParser). Files are marked as ingested in the queue once
+        all their records have been written.
+    replace : bool
+        If True, the records of files already ingested are replaced
+        (e.g., files republished upstream), defaults to False.
+
+    Returns
+    =======
+    Dictionary with the lists of URLs 'ingested' (incl. files ingested
+    by a previous run), 'missing' (not available upstream), and
+    'failed' (see error messages in the queue).
+    """
 
+    import os
     from .IndexParser import IndexParser
-    from .prepare_zipfile import prepare_zipfile
+    from .jobs import JobQueue
+
+    for x in [jobs, workers]:
+        if not isinstance(x, int) or not x > 0:
+            raise ValueError("Inputs 'jobs' and 'workers' must be positive integers.")
+
+    parser = IndexParser(layouts, buffer_rows = buffer_rows)
+    own    = not isinstance(queue, JobQueue)
+    queue  = JobQueue(queue) if own else queue
+
+    # Files ingested by a previous run (and still completely in the dataset) are skipped
+    queue.add(urls)
+    done = queue.urls("ingested")
+    todo = urls if replace else [x for x in urls if not (x in done and _complete_(parser, x))]
+    if verbose and len(todo) < len(urls):
+        print(f"Skipping {len(urls) - len(todo)} files ingested by a previous run (see {queue.file})")
+
+    # Files parsed with records still buffered (see IndexParser.buffer_rows)
+    waiting = []
+    try:
+        _process_(parser, queue, waiting, todo, dir, verbose, nrows, jobs, chunksize, workers, cache,
+                  layouts, retries, replace)
+    finally:
+        # Buffered records and summary of the datasets; also if interrupted
+        # (fragments written are kept)
+        try:
+            parser.flush(verbose = verbose)
+            for url in waiting:
+                if _complete_(parser, url):
+                    queue.set_state(url, "ingested")
+                else:
+                    queue.set_state(url, "failed", error = "Ingestion incomplete; no completion record in the manifest")
+        finally:
+            states = dict([(x, queue.get(x)["state"]) for x in urls])
+            if own: queue.close()
+
+    res = dict([(s, [x for x in urls if states[x] == s]) for s in ["ingested", "missing", "failed"]])
+    if verbose and len(res["ingested"]) < len(urls):
+        print(f"Processed {len(urls)} files: {len(res['ingested'])} ingested, " + \
+              f"{len(res['missing'])} missing upstream, {len(res['failed'])} failed")
+    return res
+
+
+def _complete_(parser, url):
+    """_complete_(parser, url)
+
+    Used internally; returns True if the GRIB index file 'url' has been
+    ingested completely according to the manifest of its dataset.
+    """
+    import os
+    source = os.path.basename(url)
+    return parser._manifest_(f"{parser._parse_filename_(source)['type']}.parquet").is_complete(source)
+
+
+def _process_(parser, queue, waiting, urls, dir, verbose, nrows, jobs, chunksize, workers, cache,
+              layouts, retries, replace = False):
+    """_process_(parser, queue, waiting, urls, dir, verbose, nrows, jobs, chunksize, workers, cache,
+              layouts, retries, replace = False)
 
-    parser = IndexParser()
-    for url in urls:
-        zipfile = prepare_zipfile(url, dir, verbose = verbose)
-        parser.process_file(zipfile, verbose = verbose, nrows = nrows)
+    Used internally by process_files; downloads, parses and writes the
+    files and keeps track of their state in the job queue. Files with
+    records left in the buffer of the parser are appended to 'waiting'
+    (marked as ingested once written). If 'replace' is True, records
+    of files already ingested are replaced (see process_files).
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    from .prepare_zipfile import get_session
+    from .jobs import fetch_index
+    from . import metrics
+
+    def skip(url, state, attempts, error):
+        queue.set_state(url, state, error = error, attempts = attempts)
+        if verbose: print(f"    Skipping {os.path.basename(url)} ({state}); {error}")
+
+    write   = parser.replace_parsed if replace else parser.write_parsed
+    process = parser.replace_file if replace else parser.process_file
+
+    def ingest(url, attempts, fun, *args, **kwargs):
+        queue.set_state(url, "downloaded", attempts = attempts)
+        try:
+            fun(*args, **kwargs)
+        except Exception as e:
+            return skip(url, "failed", 0, f"Ingestion failed; {e}")
+        waiting.append(url)
+        pending = parser.pending_sources()
+        for x in [x for x in waiting if not os.path.basename(x) in pending]:
+            waiting.remove(x)
+            if _complete_(parser, x):
+                queue.set_state(x, "ingested")
+            else:
+                skip(x, "failed", 0, "Ingestion incomplete; no completion record in the manifest")
+
+    # Parallel ingestion; workers parse, this process writes. Measurements
+    # of the workers are merged into the ones of this process.
+    if workers > 1:
+        measure = None if metrics.active() is None else metrics.active().trace_memory
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            for parsed in _bounded_map_(pool, _parse_worker_, urls, 2 * workers,
+                                        dir = dir, nrows = nrows, chunksize = chunksize, cache = cache,
+                                        layouts = layouts, measure = measure, retries = retries):
+                if "metrics" in parsed: metrics.active().merge(parsed.pop("metrics"))
+                if not parsed["state"] == "downloaded":
+                    skip(parsed["url"], parsed["state"], parsed["attempts"], parsed["error"])
+                    continue
+                ingest(parsed["url"], parsed["attempts"], write, parsed, verbose = verbose)
+        return
+
+    session = get_session(jobs)
+
+    # Serial mode, download and parse one after another
+    if jobs == 1:
+        for url in urls:
+            fetched, state, attempts, error = fetch_index(url, dir, cache = cache, session = session,
+                                                          retries = retries, verbose = verbose)
+            if fetched is None:
+                skip(url, state, attempts, error)
+                continue
+            name, file = fetched
+            ingest(url, attempts, process, file, verbose = verbose, nrows = nrows,
+                   chunksize = chunksize, name = name)
+        return
+
+    # Concurrent downloads; without cache the files are kept in memory
+    with ThreadPoolExecutor(max_workers = jobs) as pool:
+        for url, (fetched, state, attempts, error) in zip(urls,
+                _bounded_map_(pool, fetch_index, urls, 2 * jobs, dir = dir, cache = cache, session = session,
+                              retries = retries, preload = True, verbose = verbose)):
+            if fetched is None:
+                skip(url, state, attempts, error)
+                continue
+            name, file = fetched
+            ingest(url, attempts, process, file, verbose = verbose, nrows = nrows,
+                   chunksize = chunksize, name = name)
 
 # --------------------------------------------------------------
 # Helper function; sanity check for prepare_* functions.
@@ -55,20 +333,44 @@ def _check_years_months_(years, months):
 # --------------------------------------------------------------
 # Setting up analysis files/urls and process them
 # --------------------------------------------------------------
-def prepare_analysis(baseurl, dir, years, months, nrows = None):
-    """prepare_analysis(baseurl, dir, years, months, nrows = None)
+def urls_analysis(baseurl, year, months):
+    """urls_analysis(baseurl, year, months)
+
+    Returns the list of URLs of all analysis GRIB index files
+    for one year and the months given.
+
+    Parameters
+    ==========
+    baseurl : str
+        Base URL to the server where the data are stored.
+    year : int
+    months : list of int
+
+    Returns
+    =======
+    List of str.
+    """
+    urls = []
+    for month in months:
+        urls.append(f"{baseurl}/data/ana/pressure/EU_analysis_pressure_params_{year:04d}-{month:02d}.grb.index")
+        urls.append(f"{baseurl}/data/ana/surf/EU_analysis_surf_params_{year:04d}-{month:02d}.grb.index")
+    return urls
+
+
+def prepare_analysis(baseurl, dir, years, months,
+                     nrows = None, jobs = 1, chunksize = None, workers = 1, cache = "zip",
+                     layout = None, queue = None, retries = 3, buffer_rows = None):
+    """prepare_analysis(baseurl, dir, years, months,
+                     nrows = None, jobs = 1, chunksize = None, workers = 1, cache = "zip",
+                     layout = None, queue = None, retries = 3, buffer_rows = None)
 
     Prepares URLs to the GRIB index files on the server. These
     URLs are then handed over to 'process_files' which itself
-    makes use of 'prepare_zipfile'. The latter downloads the
-    GRIB index file and stores a local copy in a zip archive
-    in the directory 'dir'. This is mainly done to not download
-    the same file multiple times during development.
-
-    Todo
-    ====
-    I may need an option to directly parse the return of
-    the request (no need to zip and store in an operational setting).
+    makes use of 'prepare_index'. The latter downloads the
+    GRIB index file and stores a local copy (by default in a zip
+    archive) in the directory 'dir'. This is mainly done to not download
+    the same file multiple times during development. In an operational
+    setting 'cache = None' parses the response directly (no disc I/O).
 
     Parameters
     ==========
@@ -87,6 +389,30 @@ def prepare_analysis(baseurl, dir, years, months, nrows = None):
         If None the entire GRIB index is porcessed. If set to
         a positive integer, only 'nrows' lines/entries will be
         processed.
+    jobs : positive int
+        Number of concurrent downloads (see process_files), defaults to 1.
+    chunksize : None or positive int
+        If set, index files are processed in batches of 'chunksize'
+        records to bound memory usage (see process_files).
+    workers : positive int
+        Number of worker processes parsing index files in parallel
+        (see process_files), defaults to 1.
+    cache : None or str
+        Format of the local copies of the GRIB index files (see
+        process_files), defaults to 'zip'. None to parse the files
+        directly without writing anything to disc.
+    layout : None, str or list of str
+        Partitioning layout (see layout.LAYOUTS) if the dataset is
+        created; defaults to the layout of the existing dataset or
+        layout.DEFAULT_LAYOUTS.
+    queue : None, str, or jobs.JobQueue
+        Job queue (see process_files); a file name to resume interrupted
+        runs without processing files ingested before again.
+    retries : int
+        Maximum number of retries per download (see process_files).
+    buffer_rows : None or positive int
+        Write records of consecutive files in fragments of about this
+        many records per partition (see process_files).
 
     Returns
     =======
@@ -98,19 +424,68 @@ def prepare_analysis(baseurl, dir, years, months, nrows = None):
     # Processing 'analysis'
     #for year in range(1997, 1998):
     for year in years:
-        urls = []
-        for month in months:
-            urls.append(f"{baseurl}/data/ana/pressure/EU_analysis_pressure_params_{year:04d}-{month:02d}.grb.index")
-            urls.append(f"{baseurl}/data/ana/surf/EU_analysis_surf_params_{year:04d}-{month:02d}.grb.index")
-
-        process_files(urls, dir, nrows = nrows, verbose = True)
+        urls = urls_analysis(baseurl, year, months)
+        process_files(urls, dir, nrows = nrows, verbose = True, jobs = jobs,
+                      chunksize = chunksize, workers = workers, cache = cache,
+                      layouts = None if layout is None else {"analysis": layout},
+                      queue = queue, retries = retries, buffer_rows = buffer_rows)
 
 
 # --------------------------------------------------------------
 # Forecasts
 # --------------------------------------------------------------
-def prepare_forecast(baseurl, dir, years, months, version = 0, nrows = None):
-    """prepare_forecasts(baseurl, dir, years, months, version = 0, nrows = None)
+def urls_forecast(baseurl, year, months, version = 0):
+    """urls_forecast(baseurl, year, months, version = 0)
+
+    Returns the list of URLs of all forecast GRIB index files
+    (control run, high resolution run, efi, ensemble) for one year
+    and the months given.
+
+    Parameters
+    ==========
+    baseurl : str
+    year : int
+    months : list of int
+    version : int
+        Defaults to 0, version of the GRIB index files/GRIB files.
+
+    Returns
+    =======
+    List of str.
+    """
+    import datetime as dt
+
+    urls = []
+    for month in months:
+        ## Control run
+        urls.append(f"{baseurl}/data/fcs/pressure/EU_forecast_ctr_pressure_params_{year:04d}-{month:02d}_{version}.grb.index")
+        urls.append(f"{baseurl}/data/fcs/surf/EU_forecast_ctr_surf_params_{year:04d}-{month:02d}_{version}.grb.index")
+        
+        # high resolution run
+        urls.append(f"{baseurl}/data/fcs/surf/EU_forecast_hr_surf_params_{year:04d}-{month:02d}_{version}.grb.index")
+
+        # EFI
+        urls.append(f"{baseurl}/data/fcs/efi/EU_forecast_efi_params_{year:04d}-{month:02d}_{version}.grb.index")
+        # High resolution run
+
+        # Ensemble members
+        curr = dt.date(year, month, 1)
+        end  = (dt.date(year, month + 1, 1) if month < 12 else dt.date(year + 1, 1, 1)) - dt.timedelta(1)
+        while curr <= end:
+            date = curr.strftime("%Y-%m-%d")
+            # Enemble
+            urls.append(f"{baseurl}/data/fcs/pressure/EU_forecast_ens_pressure_params_{date}_{version}.grb.index")
+            urls.append(f"{baseurl}/data/fcs/surf/EU_forecast_ens_surf_params_{date}_{version}.grb.index")
+            curr += dt.timedelta(1)
+    return urls
+
+
+def prepare_forecast(baseurl, dir, years, months, version = 0,
+                     nrows = None, jobs = 1, chunksize = None, workers = 1, cache = "zip",
+                     layout = None, queue = None, retries = 3, buffer_rows = None):
+    """prepare_forecasts(baseurl, dir, years, months, version = 0,
+                     nrows = None, jobs = 1, chunksize = None, workers = 1, cache = "zip",
+                     layout = None, queue = None, retries = 3, buffer_rows = None)
 
     Processes all forecasts. This includes control run, ensemble, efi, and hr.
     See 'prepare_analysis' for details.
@@ -124,6 +499,14 @@ def prepare_forecast(baseurl, dir, years, months, version = 0, nrows = None):
     version : int
         Defaults to 0, version of the GRIB index files/GRIB files.
     nrows : None or positive int
+    jobs : positive int
+    chunksize : None or positive int
+    workers : positive int
+    cache : None or str
+    layout : None, str or list of str
+    queue : None, str, or jobs.JobQueue
+    retries : int
+    buffer_rows : None or positive int
 
     Returns
     =======
@@ -132,40 +515,66 @@ def prepare_forecast(baseurl, dir, years, months, version = 0, nrows = None):
     from .prepare_parquet import _check_years_months_
     years, months = _check_years_months_(years, months)
 
-    import datetime as dt
-
     for year in years:
-        urls = []
-        for month in months:
-            ## Control run
-            urls.append(f"{baseurl}/data/fcs/pressure/EU_forecast_ctr_pressure_params_{year:04d}-{month:02d}_{version}.grb.index")
-            urls.append(f"{baseurl}/data/fcs/surf/EU_forecast_ctr_surf_params_{year:04d}-{month:02d}_{version}.grb.index")
-            
-            # high resolution run
-            urls.append(f"{baseurl}/data/fcs/surf/EU_forecast_hr_surf_params_{year:04d}-{month:02d}_{version}.grb.index")
-
-            # EFI
-            urls.append(f"{baseurl}/data/fcs/efi/EU_forecast_efi_params_{year:04d}-{month:02d}_{version}.grb.index")
-            # High resolution run
-
-            # Ensemble members
-            curr = dt.date(year, month, 1)
-            end  = (dt.date(year, month + 1, 1) if month < 12 else dt.date(year + 1, 1, 1)) - dt.timedelta(1)
-            while curr <= end:
-                date = curr.strftime("%Y-%m-%d")
-                # Enemble
-                urls.append(f"{baseurl}/data/fcs/pressure/EU_forecast_ens_pressure_params_{date}_{version}.grb.index")
-                urls.append(f"{baseurl}/data/fcs/surf/EU_forecast_ens_surf_params_{date}_{version}.grb.index")
-                curr += dt.timedelta(1)
-
-        process_files(urls, dir, nrows = nrows, verbose = True)
+        urls = urls_forecast(baseurl, year, months, version)
+        process_files(urls, dir, nrows = nrows, verbose = True, jobs = jobs,
+                      chunksize = chunksize, workers = workers, cache = cache,
+                      layouts = None if layout is None else {"forecast": layout},
+                      queue = queue, retries = retries, buffer_rows = buffer_rows)
 
 
 # --------------------------------------------------------------
 # Reforecasts
 # --------------------------------------------------------------
-def prepare_reforecast(baseurl, dir, years, months, version = 0, nrows = None):
-    """prepare_forecasts(baseurl, dir, years, months, version = 0, nrows = None)
+def urls_reforecast(baseurl, year, months, version = 0):
+    """urls_reforecast(baseurl, year, months, version = 0)
+
+    Returns the list of URLs of all reforecast GRIB index files
+    (control run, ensemble on Mondays and Thursdays) for one year
+    and the months given.
+
+    Parameters
+    ==========
+    baseurl : str
+    year : int
+    months : list of int
+    version : int
+        Defaults to 0, version of the GRIB index files/GRIB files.
+
+    Returns
+    =======
+    List of str.
+    """
+    import datetime as dt
+
+    urls = []
+    for month in months:
+        ## Control run
+        urls.append(f"{baseurl}/data/rfcs/surf/EU_reforecast_ctr_surf_params_{year:04d}-{month:02d}_{version}.grb.index")
+        urls.append(f"{baseurl}/data/rfcs/pressure/EU_reforecast_ctr_pressure_params_{year:04d}-{month:02d}_{version}.grb.index")
+
+        # Ensemble members
+        curr = dt.date(year, month, 1)
+        end  = (dt.date(year, month + 1, 1) if month < 12 else dt.date(year + 1, 1, 1)) - dt.timedelta(1)
+        while curr <= end:
+            # Skip if not Monday (0) or Thursday (3)
+            if not  curr.timetuple().tm_wday in [0, 3]:
+                curr += dt.timedelta(1)
+                continue
+            date = curr.strftime("%Y-%m-%d")
+            # Enemble
+            urls.append(f"{baseurl}/data/rfcs/surf/EU_reforecast_ens_surf_params_{date}_{version}.grb.index")
+            urls.append(f"{baseurl}/data/rfcs/pressure/EU_reforecast_ens_pressure_params_{date}_{version}.grb.index")
+            curr += dt.timedelta(1)
+    return urls
+
+
+def prepare_reforecast(baseurl, dir, years, months, version = 0,
+                     nrows = None, jobs = 1, chunksize = None, workers = 1, cache = "zip",
+                     layout = None, queue = None, retries = 3, buffer_rows = None):
+    """prepare_forecasts(baseurl, dir, years, months, version = 0,
+                     nrows = None, jobs = 1, chunksize = None, workers = 1, cache = "zip",
+                     layout = None, queue = None, retries = 3, buffer_rows = None)
 
     Processes all reforecasts (or hindcasts). This includes control run and
     ensemble. See 'prepare_analysis' for details.
@@ -179,6 +588,14 @@ def prepare_reforecast(baseurl, dir, years, months, version = 0, nrows = None):
     version : int
         Defaults to 0, version of the GRIB index files/GRIB files.
     nrows : None or positive int
+    jobs : positive int
+    chunksize : None or positive int
+    workers : positive int
+    cache : None or str
+    layout : None, str or list of str
+    queue : None, str, or jobs.JobQueue
+    retries : int
+    buffer_rows : None or positive int
 
     Returns
     =======
@@ -187,30 +604,12 @@ def prepare_reforecast(baseurl, dir, years, months, version = 0, nrows = None):
     from .prepare_parquet import _check_years_months_
     years, months = _check_years_months_(years, months)
 
-    import datetime as dt
-
     for year in years:
-        urls = []
-        for month in months:
-            ## Control run
-            urls.append(f"{baseurl}/data/rfcs/surf/EU_reforecast_ctr_surf_params_{year:04d}-{month:02d}_{version}.grb.index")
-            urls.append(f"{baseurl}/data/rfcs/pressure/EU_reforecast_ctr_pressure_params_{year:04d}-{month:02d}_{version}.grb.index")
-
-            # Ensemble members
-            curr = dt.date(year, month, 1)
-            end  = (dt.date(year, month + 1, 1) if month < 12 else dt.date(year + 1, 1, 1)) - dt.timedelta(1)
-            while curr <= end:
-                # Skip if not Monday (0) or Thursday (3)
-                if not  curr.timetuple().tm_wday in [0, 3]:
-                    curr += dt.timedelta(1)
-                    continue
-                date = curr.strftime("%Y-%m-%d")
-                # Enemble
-                urls.append(f"{baseurl}/data/rfcs/surf/EU_reforecast_ens_surf_params_{date}_{version}.grb.index")
-                urls.append(f"{baseurl}/data/rfcs/pressure/EU_reforecast_ens_pressure_params_{date}_{version}.grb.index")
-                curr += dt.timedelta(1)
-
-        process_files(urls, dir, nrows = nrows, verbose = True)
+        urls = urls_reforecast(baseurl, year, months, version)
+        process_files(urls, dir, nrows = nrows, verbose = True, jobs = jobs,
+                      chunksize = chunksize, workers = workers, cache = cache,
+                      layouts = None if layout is None else {"reforecast": layout},
+                      queue = queue, retries = retries, buffer_rows = buffer_rows)
 
 
 
@@ -1,9 +1,29 @@
 
+# --------------------------------------------------------------
+# Error raised if the server does not deliver a GRIB index file
+# --------------------------------------------------------------
+class DownloadError(Exception):
+    """DownloadError(status, url)
+
+    Raised if a GRIB index file cannot be downloaded; 'status' is the
+    HTTP status code of the response (e.g., 404 if the file does not
+    exist upstream).
+    """
+    def __init__(self, status, url):
+        self.status = status
+        self.url    = url
+        super().__init__(f"Got {status} for {url}")
+
+
+# Pooled HTTP session (shared with the client)
+from ..session import get_session
+
+
 # --------------------------------------------------------------
 # Helper function to get ziped index files
 # --------------------------------------------------------------
-def prepare_zipfile(url, dir, verbose = True):
-    """prepare_zipfile(url, dir, verbose = True)
+def prepare_zipfile(url, dir, verbose = True, session = None):
+    """prepare_zipfile(url, dir, verbose = True, session = None)
 
     Used for development or if the parquet dataset is created
     on a machine which is not the server (no local access to the
@@ -24,6 +44,9 @@ def prepare_zipfile(url, dir, verbose = True):
         Where to store the zip file. 
     verbose : bool
         Verbosity level, defaults to True.
+    session : None or requests.Session
+        If set, this session is used for the download (see get_session).
+        Else a plain requests.get is used.
 
     Return
     ======
@@ -34,20 +57,29 @@ def prepare_zipfile(url, dir, verbose = True):
     import requests
     import zipfile
     import tempfile
+    from . import metrics
 
     local_index = os.path.join(dir, os.path.basename(url))
     local_zip   = os.path.join(dir, os.path.basename(url) + ".zip")
     if not os.path.isfile(local_zip):
         if verbose: print(f"Downloading {url}\nCreating {local_zip}")
-        req = requests.get(url)
-        if not req.status_code == 200:
-            raise Exception("Got 404 for {url}")
-        with open(local_index, "w") as fid: fid.write(req.text)
-
-        # Create zip file
-        zip = zipfile.ZipFile(local_zip, "w", zipfile.ZIP_DEFLATED)
-        zip.write(local_index, os.path.basename(local_index))
-        zip.close()
+        with metrics.stage("download", file = os.path.basename(url)) as m:
+            req = requests.get(url) if session is None else session.get(url)
+            if not req.status_code == 200:
+                raise DownloadError(req.status_code, url)
+            with open(local_index, "w") as fid: fid.write(req.text)
+            m.add(bytes = len(req.content))
+
+        # Create zip file; written to a temporary name first such that
+        # an interrupted run never leaves a broken zip file behind.
+        with metrics.stage("zip", file = os.path.basename(url)) as m:
+            tmp = tempfile.NamedTemporaryFile(dir = dir, suffix = ".zip", delete = False)
+            tmp.close()
+            zip = zipfile.ZipFile(tmp.name, "w", zipfile.ZIP_DEFLATED)
+            zip.write(local_index, os.path.basename(local_index))
+            zip.close()
+            m.add(bytes = os.path.getsize(tmp.name))
+        os.replace(tmp.name, local_zip)
         os.remove(local_index)
 
     return local_zip
@@ -0,0 +1,272 @@
+
+
+# --------------------------------------------------------------
+# Publishing datasets to object storage (fsspec). Only files new
+# or changed since the last publish are uploaded; readers see
+# them once the snapshot pointer has been replaced (one atomic
+# write), never a half-uploaded dataset.
+# --------------------------------------------------------------
+
+import os
+import json
+import uuid
+import hashlib
+import datetime as dt
+
+# Snapshot pointer (remote); names the manifest of the current snapshot
+SNAPSHOT = "_snapshot.json"
+
+# Directory (remote) holding the manifests of the snapshots
+SNAPSHOT_DIR = "_snapshots"
+
+# Files published in addition to the parquet files (if present)
+PUBLISH_FILES = ["_layout.json", "_common_metadata", "_metadata"]
+
+
+def _local_files_(dataset):
+    """_local_files_(dataset)
+
+    Used internally; returns the files of a local dataset to be
+    published (relative to 'dataset', '/' as separator). Hidden files
+    and files starting with an underscore (manifest, journals) are
+    skipped except PUBLISH_FILES.
+    """
+    res = [x for x in PUBLISH_FILES if os.path.isfile(os.path.join(dataset, x))]
+    for root, dirs, files in os.walk(dataset):
+        dirs[:] = sorted([x for x in dirs if not x[0] in "._"])
+        rel     = os.path.relpath(root, dataset)
+        for file in sorted(files):
+            if not file.endswith(".parquet") or file[0] in "._": continue
+            res.append(file if rel == "." else "/".join(rel.split(os.sep) + [file]))
+    return res
+
+
+def _md5_(file):
+    """_md5_(file)
+
+    Used internally; returns the md5 hex digest of a local file.
+    """
+    md5 = hashlib.md5()
+    with open(file, "rb") as fid:
+        for chunk in iter(lambda: fid.read(8 * 1024 * 1024), b""): md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _read_json_(fs, path):
+    """_read_json_(fs, path)
+
+    Used internally; reads a remote JSON file, returns None if it does not exist.
+    """
+    try:
+        with fs.open(path, "rb") as fid: return json.loads(fid.read().decode("utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+def _write_atomic_(fs, path, content):
+    """_write_atomic_(fs, path, content)
+
+    Used internally; writes a (small) remote file such that readers
+    either see the old or the new content. Object stores replace an
+    object with a single PUT; on local filesystems the file is written
+    under a temporary name and renamed.
+    """
+    protocol = fs.protocol if isinstance(fs.protocol, (tuple, list)) else [fs.protocol]
+    if "file" in protocol or "local" in protocol:
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        fs.pipe_file(tmp, content)
+        fs.mv(tmp, path)
+    else:
+        fs.pipe_file(path, content)
+
+
+def read_snapshot(target, storage_options = None):
+    """read_snapshot(target, storage_options = None)
+
+    Returns the manifest of the current snapshot of a published dataset
+    (dictionary with 'snapshot', 'parent', 'created', and 'files') or
+    None if nothing has been published yet.
+
+    Parameters
+    ==========
+    target : str
+        fsspec URL of the published dataset (e.g., 's3://euppparquet-analysis').
+    storage_options : None or dict
+        Passed to fsspec (e.g., credentials, 'endpoint_url').
+    """
+    import fsspec
+    fs, root = fsspec.core.url_to_fs(target, **({} if storage_options is None else storage_options))
+    root     = root.rstrip("/")
+    pointer  = _read_json_(fs, f"{root}/{SNAPSHOT}")
+    if pointer is None: return None
+    return _read_json_(fs, f"{root}/{pointer['manifest']}")
+
+
+def publish_dataset(dataset, target, jobs = 8, keep = 3, storage_options = None, verbose = False):
+    """publish_dataset(dataset, target, jobs = 8, keep = 3, storage_options = None, verbose = False)
+
+    Publishes a local parquet dataset to object storage (or any other
+    fsspec filesystem). The local files are compared to the manifest of
+    the current remote snapshot (size, modification time and md5); only
+    new or changed files are uploaded (in parallel). A new snapshot
+    manifest ('_snapshots/<id>.json') is written and made visible by
+    replacing the snapshot pointer ('_snapshot.json'). The summary
+    ('_metadata') is uploaded last, listing the files as named remotely.
+
+    Uploaded files are never overwritten while referenced by a snapshot;
+    changed files get a new name (md5 suffix). Files only referenced by
+    snapshots older than the last 'keep' are removed.
+
+    Parameters
+    ==========
+    dataset : str
+        Path to the local parquet dataset (e.g., 'analysis.parquet').
+    target : str
+        fsspec URL (e.g., 's3://euppparquet-analysis', 'file:///tmp/pub',
+        'memory://test').
+    jobs : positive int
+        Number of concurrent uploads, defaults to 8.
+    keep : positive int
+        Number of snapshots kept (readers may still use older ones).
+    storage_options : None or dict
+        Passed to fsspec (e.g., credentials, 'endpoint_url').
+    verbose : bool
+        Set verbosity level, defaults to False.
+
+    Returns
+    =======
+    Dictionary with the 'snapshot' id, the number of files 'uploaded',
+    'unchanged', and 'removed', and the bytes uploaded.
+
+    Raises
+    ======
+    Exception: If another publish replaced the snapshot meanwhile.
+    """
+    import fsspec
+    from concurrent.futures import ThreadPoolExecutor
+    from .summary import METADATA, summary_is_current, write_summary, build_summary
+    from .replace import _recover_
+
+    if not isinstance(dataset, str):
+        raise TypeError("Input 'dataset' must be string.")
+    if not os.path.isdir(dataset):
+        raise Exception(f"Dataset '{dataset}' does not exist.")
+    if not isinstance(target, str):
+        raise TypeError("Input 'target' must be string.")
+    for x in [jobs, keep]:
+        if not isinstance(x, int) or not x > 0:
+            raise ValueError("Inputs 'jobs' and 'keep' must be positive integers.")
+
+    # Complete an interrupted replacement first (see replace.replace_source)
+    _recover_(dataset, verbose = verbose)
+
+    fs, root = fsspec.core.url_to_fs(target, **({} if storage_options is None else storage_options))
+    root     = root.rstrip("/")
+
+    pointer = _read_json_(fs, f"{root}/{SNAPSHOT}")
+    current = None if pointer is None else _read_json_(fs, f"{root}/{pointer['manifest']}")
+    remote  = dict() if current is None else current["files"]
+
+    # Summary ('_metadata') outdated; rebuilt before publishing
+    if os.path.isfile(os.path.join(dataset, METADATA)) and not summary_is_current(dataset):
+        write_summary(dataset, verbose = verbose)
+
+    res   = dict(snapshot = None, uploaded = 0, unchanged = 0, removed = 0, bytes_uploaded = 0)
+    files = dict()
+    def compare(rel, src):
+        # Returns True if the file has to be uploaded
+        stat  = os.stat(src)
+        entry = dict(size = stat.st_size, mtime = stat.st_mtime)
+        old   = remote.get(rel)
+        # Unchanged size and modification time; no need to compute the md5
+        if old is not None and old["size"] == entry["size"] and old["mtime"] == entry["mtime"]:
+            files[rel] = old
+            res["unchanged"] += 1
+            return False
+        entry["md5"] = _md5_(src)
+        if old is not None and old["size"] == entry["size"] and old["md5"] == entry["md5"]:
+            files[rel] = dict(old, mtime = entry["mtime"])
+            res["unchanged"] += 1
+            return False
+        files[rel] = dict(entry, key = rel)
+        return True
+
+    def upload(rel, src):
+        # Changed files (or names existing remotely) get a new name
+        if rel in remote or fs.exists(f"{root}/{rel}"):
+            stem, ext = os.path.splitext(rel)
+            files[rel]["key"] = f"{stem}.{files[rel]['md5'][:12]}{ext}"
+        rpath = f"{root}/{files[rel]['key']}"
+        fs.makedirs(rpath.rsplit("/", 1)[0], exist_ok = True)
+        fs.put_file(src, rpath)
+        if not fs.size(rpath) == files[rel]["size"]:
+            raise Exception(f"Upload of {rel} to {rpath} incomplete.")
+        if verbose: print(f"    Uploaded {rel}")
+
+    todo = [x for x in _local_files_(dataset) if not x == METADATA and compare(x, os.path.join(dataset, x))]
+    if verbose: print(f"Publishing {dataset} to {target}: {len(todo)} of {len(files)} files to be uploaded")
+    with ThreadPoolExecutor(max_workers = jobs) as pool:
+        list(pool.map(lambda x: upload(x, os.path.join(dataset, x)), todo))
+
+    # Summary last; the file paths it contains must match the remote names
+    if os.path.isfile(os.path.join(dataset, METADATA)):
+        src    = os.path.join(dataset, METADATA)
+        rename = dict([(k, v["key"]) for k, v in files.items() if not k == v["key"]])
+        try:
+            if len(rename) > 0:
+                src = os.path.join(dataset, f".{METADATA}.publish.tmp")
+                build_summary(dataset, rename = rename).write_metadata_file(src)
+            if compare(METADATA, src):
+                upload(METADATA, src)
+                todo.append(METADATA)
+        finally:
+            if not src == os.path.join(dataset, METADATA) and os.path.isfile(src): os.remove(src)
+    res["uploaded"]       = len(todo)
+    res["bytes_uploaded"] = sum([files[x]["size"] for x in todo])
+
+    # Nothing changed; keep the current snapshot
+    if current is not None and len(todo) == 0 and set(files.keys()) == set(remote.keys()):
+        res["snapshot"] = current["snapshot"]
+        if verbose: print(f"Nothing to publish, snapshot {res['snapshot']} is up to date")
+        return res
+
+    # Writing the manifest of the new snapshot, replacing the pointer
+    # Ids start with a sequence number; sorting them gives the order of the snapshots
+    now  = dt.datetime.now(dt.timezone.utc)
+    seq  = 1 if current is None else int(current["snapshot"].split("-")[0]) + 1
+    snap = f"{seq:08d}-{now.strftime('%Y%m%dT%H%M%SZ')}"
+    manifest = dict(snapshot = snap, parent = None if current is None else current["snapshot"],
+                    created = now.strftime("%Y-%m-%dT%H:%M:%SZ"), files = files)
+    fs.makedirs(f"{root}/{SNAPSHOT_DIR}", exist_ok = True)
+    fs.pipe_file(f"{root}/{SNAPSHOT_DIR}/{snap}.json", json.dumps(manifest, indent = 1).encode("utf-8"))
+
+    check = _read_json_(fs, f"{root}/{SNAPSHOT}")
+    if not (check is None if pointer is None else check is not None and check["snapshot"] == pointer["snapshot"]):
+        raise Exception(f"Snapshot of {target} has been replaced by another publish; try again.")
+    _write_atomic_(fs, f"{root}/{SNAPSHOT}",
+                   json.dumps(dict(snapshot = snap, manifest = f"{SNAPSHOT_DIR}/{snap}.json")).encode("utf-8"))
+    res["snapshot"] = snap
+
+    # Removing snapshots older than the last 'keep' and files only they reference
+    snaps = sorted([x.rsplit("/", 1)[-1][:-5] for x in fs.ls(f"{root}/{SNAPSHOT_DIR}", detail = False)
+                    if x.endswith(".json")])
+    old, kept = snaps[:-keep], snaps[-keep:]
+    if len(old) > 0:
+        used = set()
+        for x in kept:
+            tmp = _read_json_(fs, f"{root}/{SNAPSHOT_DIR}/{x}.json")
+            if tmp is not None: used.update([v["key"] for v in tmp["files"].values()])
+        for x in old:
+            tmp = _read_json_(fs, f"{root}/{SNAPSHOT_DIR}/{x}.json")
+            for key in ([] if tmp is None else set([v["key"] for v in tmp["files"].values()]) - used):
+                if fs.exists(f"{root}/{key}"):
+                    fs.rm_file(f"{root}/{key}")
+                    res["removed"] += 1
+                used.add(key)
+            fs.rm_file(f"{root}/{SNAPSHOT_DIR}/{x}.json")
+
+    if verbose:
+        print(f"Published snapshot {snap}: {res['uploaded']} files uploaded ({res['bytes_uploaded']} bytes), " + \
+              f"{res['unchanged']} unchanged, {res['removed']} removed")
+
+    return res
@@ -0,0 +1,215 @@
+
+
+# --------------------------------------------------------------
+# Replaces the records of one source (GRIB index file) in a
+# dataset, e.g., when the file has been republished upstream.
+# Only the partitions holding records of the source (found via
+# the manifest) or receiving new records are rewritten. New
+# files are written under hidden names first; one journal at
+# the dataset level commits the replacement as a whole.
+# --------------------------------------------------------------
+
+import os
+import json
+import uuid
+
+from .schema import SCHEMA_KEY
+from .storage import ROW_GROUP_SIZE, sort_table, write_options
+from .compact import COMPACTED_KEY, _list_fragments_
+
+# Journal written into the dataset while a replacement is committed
+JOURNAL = "_replace.json"
+
+
+def _partition_dirs_(data, partition_cols):
+    """_partition_dirs_(data, partition_cols)
+
+    Used internally; splits a table by partition. Returns a dictionary
+    with the partition directory (relative, hive style as written by
+    pyarrow) and the records (without the partition columns).
+    """
+    import pyarrow.compute as pc
+
+    if len(partition_cols) == 0: return {".": data}
+    key  = pc.binary_join_element_wise(*[pc.cast(data.column(x), "string") for x in partition_cols], "\x00",
+                                       null_handling = "replace", null_replacement = "__HIVE_DEFAULT_PARTITION__")
+    key  = key.combine_chunks().dictionary_encode() if hasattr(key, "combine_chunks") else key.dictionary_encode()
+    res  = dict()
+    for i, k in enumerate(key.dictionary.to_pylist()):
+        dir = os.path.join(*[f"{c}={v}" for c, v in zip(partition_cols, k.split("\x00"))])
+        res[dir] = data.filter(pc.equal(key.indices, i)).drop_columns(partition_cols)
+    return res
+
+
+def _recover_(dataset, manifest = None, verbose = False):
+    """_recover_(dataset, manifest = None, verbose = False)
+
+    Completes an interrupted replacement; called before ingestion,
+    compaction, and publishing (see IndexParser, compact_dataset,
+    publish_dataset). If the journal exists all new files have been
+    written; old files are removed, new files renamed, the manifest, the
+    summary ('_metadata') and the lookup index (if existing) updated, and
+    the journal removed last (roll forward; calling it twice has no
+    effect).
+
+    Returns
+    =======
+    True if a replacement has been completed, else False.
+    """
+    from .Manifest import Manifest
+    from .summary import update_summary
+    from .lookup import read_lookup_info, update_lookup
+
+    journal = os.path.join(dataset, JOURNAL)
+    if not os.path.isfile(journal): return False
+    with open(journal, "r") as fid: jrnl = json.load(fid)
+
+    old, new, mine, parts = [], [], [], []
+    for part in jrnl["partitions"]:
+        dir = os.path.join(dataset, part["dir"])
+        for file in part["old"]:
+            if os.path.isfile(os.path.join(dir, file)): os.remove(os.path.join(dir, file))
+        for tmp, final in part["new"]:
+            if os.path.isfile(os.path.join(dir, tmp)): os.replace(os.path.join(dir, tmp), os.path.join(dir, final))
+        parts.append(([os.path.normpath(os.path.join(part["dir"], x)) for x in part["old"]],
+                      [os.path.normpath(os.path.join(part["dir"], x[1])) for x in part["new"]]))
+        old  += parts[-1][0]
+        new  += parts[-1][1]
+        mine += parts[-1][1] if part["rows"] > 0 else []
+
+    own      = manifest is None
+    manifest = Manifest(dataset) if own else manifest
+    # Other sources keep their records (now in the new file of the same partition)
+    for x, y in parts: manifest.replace_fragments(x, y)
+    manifest.replace_source(jrnl["source"], jrnl["paths"], mine, digest = jrnl["digest"])
+    if own: manifest.close()
+
+    update_summary(dataset, removed = old, added = new, verbose = verbose)
+    if read_lookup_info(dataset) is not None: update_lookup(dataset, verbose = verbose)
+    os.remove(journal)
+    return True
+
+
+def replace_source(dataset, source, data, partition_cols, digest = None, manifest = None,
+                   row_group_size = ROW_GROUP_SIZE, verbose = False):
+    """replace_source(dataset, source, data, partition_cols, digest = None, manifest = None,
+                   row_group_size = ROW_GROUP_SIZE, verbose = False)
+
+    Replaces all records of 'source' in 'dataset' by 'data'. The records
+    of the source are identified by their GRIB files ('_path') recorded
+    in the manifest; only partitions containing such records (fragments
+    of the source, see Manifest.fragments) or receiving new records are
+    read and rewritten, each into one sorted file. Costs are thus
+    proportional to the days affected, not to the size of the dataset.
+
+    All new files are written under hidden temporary names before one
+    journal ('_replace.json') is written; the replacement is then rolled
+    forward (see _recover_), also by the next ingestion, compaction, or
+    publish if interrupted. The row groups of the files rewritten are
+    replaced in the summary ('_metadata', see summary.update_summary);
+    the lookup index (if existing) is updated. Remote readers see the
+    replacement with the next publish_dataset (one snapshot).
+
+    Parameters
+    ==========
+    dataset : str
+        Path to the parquet dataset.
+    source : str
+        Name of the GRIB index file (see Manifest).
+    data : None, pyarrow.Table or list of pyarrow.Table
+        New records of the source (see IndexParser.parse_file), including
+        the partition columns. If None, the records of the source are
+        removed.
+    partition_cols : list of str
+        Columns used for partitioning the dataset.
+    digest : None or str
+        Content hash of the new source file.
+    manifest : None or Manifest
+        Manifest of the dataset; opened if None.
+    row_group_size : positive int
+        Number of rows per row group.
+    verbose : bool
+        Set verbosity level, defaults to False.
+
+    Returns
+    =======
+    Dictionary with the number of 'partitions' rewritten and the number
+    of records 'removed' and 'added'.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as parquet
+    from .Manifest import Manifest
+    from . import metrics
+
+    own      = manifest is None
+    manifest = Manifest(dataset) if own else manifest
+    if not manifest.exists():
+        raise Exception(f"Dataset '{dataset}' has no manifest; cannot locate the records of {source}.")
+    _recover_(dataset, manifest, verbose = verbose)
+
+    if isinstance(data, list):
+        data = pa.concat_tables(data) if len(data) > 0 else None
+    new_paths = [] if data is None else [str(x) for x in data.column("_path").unique().to_pylist()]
+    old_paths = manifest.paths(source)
+
+    # Records of other sources must not be touched (would create duplicates)
+    other = [x for x in new_paths if not x in old_paths and manifest.has_paths(x)]
+    if len(other) > 0:
+        raise Exception(f"Records of {other} have been ingested from another source than {source}.")
+
+    # Partitions affected; holding records of the source or receiving new ones
+    new   = dict() if data is None else _partition_dirs_(data, partition_cols)
+    dirs  = set([os.path.dirname(x) or "." for x in manifest.fragments(source)]) | set(new.keys())
+    dirs  = sorted([os.path.normpath(x) for x in dirs])
+    paths = pa.array(list(old_paths.keys()), pa.string())
+    res   = dict(partitions = len(dirs), removed = 0, added = 0 if data is None else data.num_rows)
+
+    guid, parts = uuid.uuid4().hex, []
+    with metrics.stage("replace", file = source) as m:
+        for dir in dirs:
+            partition = os.path.join(dataset, dir)
+            old       = _list_fragments_(partition) if os.path.isdir(partition) else []
+            # Temporary files of a replacement interrupted before its journal was written
+            for x in (os.listdir(partition) if os.path.isdir(partition) else []):
+                if x.startswith(".replace-"): os.remove(os.path.join(partition, x))
+            tables    = [parquet.read_table(os.path.join(partition, x)) for x in old]
+            if dir in new: tables.append(new[dir])
+            if len(tables) == 0: continue
+            schema    = tables[0].schema
+            keep      = dict([(k, v) for k, v in (schema.metadata or dict()).items() if k == SCHEMA_KEY])
+            schema    = schema.remove_metadata()
+            kept      = []
+            for i, x in enumerate(tables):
+                x = x.cast(schema)
+                if i < len(old):
+                    mask = pc.is_in(x.column("_path").cast(pa.string()), value_set = paths)
+                    res["removed"] += pc.sum(mask).as_py() or 0
+                    x = x.filter(pc.invert(mask))
+                kept.append(x)
+            table = sort_table(pa.concat_tables(kept))
+            table = table.replace_schema_metadata(dict(list(keep.items()) + [(COMPACTED_KEY, b"1")]))
+
+            files = []
+            if table.num_rows > 0:
+                if not os.path.isdir(partition): os.makedirs(partition)
+                tmp, final = f".replace-{guid}-0.parquet", f"{guid}-0.parquet"
+                parquet.write_table(table, os.path.join(partition, tmp),
+                                    **write_options(table, row_group_size = row_group_size))
+                files.append([tmp, final])
+            parts.append(dict(dir = dir, old = old, new = files, rows = 0 if not dir in new else new[dir].num_rows))
+            if verbose: print(f"    Replacing {source} in {partition}: {len(old)} -> {len(files)} fragments")
+        m.add(rows = res["added"])
+
+    # Commit; write the journal, roll forward
+    counts = dict()
+    if data is not None:
+        tmp    = data.group_by("_path").aggregate([("_path", "count")])
+        counts = dict(zip([str(x) for x in tmp.column("_path").to_pylist()], tmp.column("_path_count").to_pylist()))
+    journal = os.path.join(dataset, JOURNAL)
+    with open(journal + ".tmp", "w") as fid:
+        json.dump(dict(source = source, digest = digest, paths = counts, partitions = parts), fid)
+    os.replace(journal + ".tmp", journal)
+    _recover_(dataset, manifest, verbose = verbose)
+    if own: manifest.close()
+    return res
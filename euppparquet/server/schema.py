@@ -0,0 +1,240 @@
+
+
+# --------------------------------------------------------------
+# Declared (versioned) Arrow schemas of the parquet datasets.
+# Every batch is conformed to the schema before being written;
+# strings are dictionary encoded and integers as narrow as
+# possible. Datasets written with an older version are rewritten
+# with migrate_dataset.
+# --------------------------------------------------------------
+
+import os
+import uuid
+import warnings
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Increase when changing SCHEMAS; older datasets must be migrated
+SCHEMA_VERSION = 2
+
+# Dataset types whose schema changed with a version (see schema_outdated);
+# version 2 adds the time of day to analyses.
+SCHEMA_CHANGES = {1: ["analysis", "forecast", "reforecast"], 2: ["analysis"]}
+
+# Key stored in the footer of the files (value: SCHEMA_VERSION)
+SCHEMA_KEY = b"euppparquet.schema"
+
+# Date keys; only present if not used for partitioning (see layout.py)
+DATE_KEYS = ["year", "month", "day", "date"]
+
+_COMMON = [
+    pa.field("param",   pa.dictionary(pa.int16(), pa.string()), nullable = True),
+    pa.field("_offset", pa.int64(),                             nullable = False),
+    pa.field("_length", pa.int32(),                             nullable = False),
+    pa.field("_path",   pa.dictionary(pa.int32(), pa.string()), nullable = False)
+]
+
+_DATE = [
+    pa.field("year",  pa.int16(), nullable = False),
+    pa.field("month", pa.int8(),  nullable = False),
+    pa.field("day",   pa.int8(),  nullable = False),
+    pa.field("date",  pa.int32(), nullable = False)
+]
+
+_FORECAST = [
+    pa.field("time",    pa.int16(), nullable = False),      # HHMM, e.g., 1200
+    pa.field("step",    pa.int16(), nullable = False),
+    pa.field("number",  pa.int8(),  nullable = False)
+] + _COMMON + [
+    pa.field("version", pa.int16(), nullable = False),
+    pa.field("product", pa.dictionary(pa.int8(), pa.string()), nullable = False)
+]
+
+_ANALYSIS = [
+    pa.field("time",    pa.int16(), nullable = True)        # HHMM of the valid time; missing if migrated from version 1
+]
+
+SCHEMAS = {
+    "analysis":   pa.schema(_ANALYSIS + _COMMON + _DATE),
+    "forecast":   pa.schema(_FORECAST + _DATE),
+    "reforecast": pa.schema(_FORECAST + [pa.field("hdate", pa.int32(), nullable = True)] + _DATE)
+}
+
+
+def schema_outdated(type, version):
+    """schema_outdated(type, version)
+
+    Returns True if files (or datasets) of 'type' written with schema
+    'version' have to be migrated (see migrate_dataset), i.e., if the
+    schema of 'type' changed since, else False.
+    """
+    if not type in SCHEMAS: return version < SCHEMA_VERSION
+    return any([type in types for v, types in SCHEMA_CHANGES.items() if v > version])
+
+
+def conform(table, type, partition_cols = None, strict = False):
+    """conform(table, type, partition_cols = None, strict = False)
+
+    Casts a table to the declared schema of a dataset. Columns are
+    ordered as in the schema; nullable columns not present are added
+    (all missing), the date keys and partition columns may be missing.
+    Columns not declared (e.g., a new key in the upstream GRIB index
+    files) are dropped with a warning unless 'strict = True'.
+
+    Parameters
+    ==========
+    table : pyarrow.Table
+    type : str
+        Type of the dataset ('analysis', 'forecast', 'reforecast').
+    partition_cols : None or list of str
+        Partition columns (not stored in the files).
+    strict : bool
+        If True, columns not declared raise an Exception.
+
+    Returns
+    =======
+    pyarrow.Table.
+
+    Raises
+    ======
+    Exception: If the table misses required columns, has missing values
+    in required columns, or contains columns not declared (strict only).
+    """
+    if not type in SCHEMAS:
+        raise ValueError(f"No schema for '{type}', allowed are {list(SCHEMAS.keys())}.")
+    schema = SCHEMAS[type]
+    skip   = DATE_KEYS + ([] if partition_cols is None else list(partition_cols))
+
+    unknown = [x for x in table.column_names if schema.get_field_index(x) < 0]
+    if len(unknown) > 0 and strict:
+        raise Exception(f"Column(s) {unknown} not declared in the schema of '{type}' (see schema.SCHEMAS).")
+    elif len(unknown) > 0:
+        warnings.warn(f"Column(s) {unknown} not declared in the schema of '{type}' (see schema.SCHEMAS); dropped.")
+
+    fields, arrays = [], []
+    for field in schema:
+        if field.name in table.column_names:
+            col = table.column(field.name)
+            if not field.nullable and col.null_count > 0:
+                raise Exception(f"Column '{field.name}' ({type}) must not contain missing values.")
+            try:
+                arrays.append(pc.cast(col, field.type))
+            except Exception as e:
+                raise Exception(f"Cannot convert column '{field.name}' ({type}) to {field.type}; {e}")
+        elif field.name in skip:
+            continue
+        elif field.nullable:
+            arrays.append(pa.nulls(table.num_rows, field.type))
+        else:
+            raise Exception(f"Required column '{field.name}' ({type}) missing.")
+        fields.append(field)
+
+    meta = {SCHEMA_KEY: str(SCHEMA_VERSION).encode()}
+    return pa.Table.from_arrays(arrays, schema = pa.schema(fields, metadata = meta))
+
+
+def file_version(file):
+    """file_version(file)
+
+    Returns the schema version stored in the footer of a parquet
+    file; 0 if written before schemas were declared.
+    """
+    import pyarrow.parquet as parquet
+    meta = parquet.read_schema(file).metadata
+    return int(meta[SCHEMA_KEY]) if meta is not None and SCHEMA_KEY in meta else 0
+
+
+def migrate_dataset(dataset, type = None, verbose = False):
+    """migrate_dataset(dataset, type = None, verbose = False)
+
+    Rewrites all files of a dataset written with an outdated schema
+    (see conform, schema_outdated). Analyses migrated from version 1 have
+    no time of day (missing); re-create the dataset to fill it in. Done partition by partition; the
+    new files get new names and replace the old ones atomically using
+    the journal of the compaction (see compact._recover_), the manifest
+    and the summary ('_metadata') are updated accordingly. Safe to be
+    interrupted and called again.
+
+    Parameters
+    ==========
+    dataset : str
+        Path to the parquet dataset (e.g., 'forecast.parquet').
+    type : None or str
+        Type of the dataset; derived from the name of the dataset if None.
+    verbose : bool
+        Set verbosity level, defaults to False.
+
+    Returns
+    =======
+    Dictionary with the number of partitions, files migrated, and
+    bytes before and after.
+    """
+    import json
+    import pyarrow.parquet as parquet
+    from .Manifest import Manifest
+    from .layout import read_layout, write_layout, resolve_layout, DEFAULT_LAYOUTS
+    from .compact import _partitions_, _list_fragments_, _recover_, JOURNAL, COMPACTED_KEY
+    from .storage import sort_table, write_options
+    from .summary import write_summary
+    from .lookup import read_lookup_info, update_lookup
+
+    if not isinstance(dataset, str):
+        raise TypeError("Input 'dataset' must be string.")
+    if not os.path.isdir(dataset):
+        raise Exception(f"Dataset '{dataset}' does not exist.")
+    if type is None:
+        type = os.path.basename(os.path.normpath(dataset)).replace(".parquet", "")
+    if not type in SCHEMAS:
+        raise ValueError(f"No schema for '{type}', allowed are {list(SCHEMAS.keys())}.")
+
+    partition_cols = read_layout(dataset)
+    if partition_cols is None: partition_cols = resolve_layout(DEFAULT_LAYOUTS[type])
+
+    manifest = Manifest(dataset)
+    manifest = manifest if manifest.exists() else None
+
+    res = dict(partitions = 0, files = 0, bytes_before = 0, bytes_after = 0)
+    for partition in _partitions_(dataset):
+        _recover_(partition, dataset, manifest)
+        res["partitions"] += 1
+
+        old = [x for x in _list_fragments_(partition) if schema_outdated(type, file_version(os.path.join(partition, x)))]
+        if len(old) == 0: continue
+
+        guid = uuid.uuid4().hex
+        new  = []
+        for i, file in enumerate(old):
+            data = parquet.read_table(os.path.join(partition, file))
+            meta = data.schema.metadata
+            data = data.drop_columns([x for x in data.column_names if x.startswith("__index_level_")])
+            data = conform(data, type, partition_cols)
+            # Keep the marker of compacted files
+            if meta is not None and COMPACTED_KEY in meta:
+                data = data.replace_schema_metadata({**data.schema.metadata, COMPACTED_KEY: b"1"})
+            tmp, final = f".compact-{guid}-{i}.parquet", f"{guid}-{i}.parquet"
+            data = sort_table(data)
+            parquet.write_table(data, os.path.join(partition, tmp), **write_options(data))
+            new.append([tmp, final])
+            res["bytes_before"] += os.path.getsize(os.path.join(partition, file))
+            res["bytes_after"]  += os.path.getsize(os.path.join(partition, tmp))
+
+        # Commit; write the journal, roll forward
+        journal = os.path.join(partition, JOURNAL)
+        with open(journal + ".tmp", "w") as fid: json.dump(dict(old = old, new = new), fid)
+        os.replace(journal + ".tmp", journal)
+        _recover_(partition, dataset, manifest)
+
+        res["files"] += len(old)
+        if verbose: print(f"    Migrated {len(old)} files in {partition}")
+
+    write_layout(dataset, partition_cols, schema = SCHEMA_VERSION)
+    if manifest is not None: manifest.close()
+    write_summary(dataset, verbose = verbose)
+    if read_lookup_info(dataset) is not None: update_lookup(dataset, rebuild = True, verbose = verbose)
+
+    if verbose:
+        print(f"Migrated {res['files']} files in {dataset} to schema version {SCHEMA_VERSION}")
+        print(f"    Bytes: {res['bytes_before']} -> {res['bytes_after']}")
+
+    return res
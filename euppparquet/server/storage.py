@@ -0,0 +1,101 @@
+
+
+# --------------------------------------------------------------
+# Physical layout of the parquet files written (IndexParser and
+# compaction). Rows are clustered by SORT_COLUMNS and written in
+# row groups of ROW_GROUP_SIZE with statistics, page index and
+# bloom filters such that readers can skip row groups.
+# --------------------------------------------------------------
+
+import inspect
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Rows are sorted by these columns (if present)
+SORT_COLUMNS = ["param", "step", "number"]
+
+# Number of rows per row group
+ROW_GROUP_SIZE = 20000
+
+# Columns with bloom filters and their false positive probability
+BLOOM_COLUMNS = {"param": 0.05, "_path": 0.01}
+
+
+def sort_table(table, columns = SORT_COLUMNS):
+    """sort_table(table, columns = SORT_COLUMNS)
+
+    Sorts a table by the columns given (if present). Dictionary
+    encoded columns are sorted by their values.
+
+    Parameters
+    ==========
+    table : pyarrow.Table
+    columns : list of str
+
+    Returns
+    =======
+    pyarrow.Table
+    """
+    columns = [x for x in columns if x in table.column_names]
+    if len(columns) == 0 or table.num_rows < 2: return table
+    keys = dict()
+    for x in columns:
+        col     = table.column(x)
+        keys[x] = pc.cast(col, col.type.value_type) if pa.types.is_dictionary(col.type) else col
+    idx = pc.sort_indices(pa.table(keys), [(x, "ascending") for x in columns])
+    return table.take(idx)
+
+
+def _supported_():
+    """_supported_()
+
+    Used internally; returns the (optional) writer options supported
+    by the installed pyarrow version.
+    """
+    import pyarrow.parquet as parquet
+    args = inspect.signature(parquet.write_table).parameters
+    return [x for x in ["write_page_index", "sorting_columns", "bloom_filter_options"] if x in args]
+
+
+def write_options(table, partition_cols = None, row_group_size = ROW_GROUP_SIZE):
+    """write_options(table, partition_cols = None, row_group_size = ROW_GROUP_SIZE)
+
+    Returns the keyword arguments for pyarrow.parquet.write_table or
+    write_to_dataset (row groups, statistics, page index, sort order,
+    bloom filters) for writing 'table' (sorted with sort_table).
+    Options not supported by the installed pyarrow version are skipped.
+
+    Parameters
+    ==========
+    table : pyarrow.Table
+        Data to be written.
+    partition_cols : None or list of str
+        Partition columns (not stored in the files).
+    row_group_size : positive int
+        Number of rows per row group.
+
+    Returns
+    =======
+    Dictionary.
+    """
+    import pyarrow.parquet as parquet
+
+    names = [x for x in table.column_names if partition_cols is None or not x in partition_cols]
+    res   = dict(row_group_size = row_group_size, write_statistics = True)
+    supported = _supported_()
+    if "write_page_index" in supported:
+        res["write_page_index"] = True
+    if "sorting_columns" in supported:
+        # Partition columns are constant within a file; the order holds for the others
+        sort = [names.index(x) for x in SORT_COLUMNS if x in names]
+        if len(sort) > 0:
+            res["sorting_columns"] = [parquet.SortingColumn(x) for x in sort]
+    if "bloom_filter_options" in supported:
+        bloom = dict()
+        for x, fpp in BLOOM_COLUMNS.items():
+            if not x in names: continue
+            ndv = len(table.column(x).unique())
+            bloom[x] = dict(ndv = max(1, min(ndv, row_group_size)), fpp = fpp)
+        if len(bloom) > 0: res["bloom_filter_options"] = bloom
+    return res
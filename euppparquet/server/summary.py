@@ -0,0 +1,373 @@
+
+
+# --------------------------------------------------------------
+# Dataset-level summary files ('_metadata', '_common_metadata').
+# '_metadata' holds the footers (row groups and statistics) of
+# all fragments; readers plan queries from this one file instead
+# of listing the partitions and reading every footer.
+# --------------------------------------------------------------
+
+import os
+
+# Footers of all fragments (file paths relative to the dataset)
+METADATA = "_metadata"
+
+# Schema of the fragments only
+COMMON_METADATA = "_common_metadata"
+
+
+def _fragments_(dataset):
+    """_fragments_(dataset)
+
+    Used internally; returns all fragments of a dataset (relative to
+    'dataset', '/' as separator) sorted by partition and name.
+    """
+    from .compact import _partitions_, _list_fragments_
+    res = []
+    for partition in _partitions_(dataset):
+        rel = os.path.relpath(partition, dataset)
+        for file in _list_fragments_(partition):
+            res.append(file if rel == "." else "/".join(rel.split(os.sep) + [file]))
+    return res
+
+
+def summary_files(dataset):
+    """summary_files(dataset)
+
+    Returns the set of fragments (relative paths) listed in '_metadata'
+    of a dataset or None if the dataset has no summary.
+    """
+    import pyarrow.parquet as parquet
+    file = os.path.join(dataset, METADATA)
+    if not os.path.isfile(file): return None
+    meta = parquet.read_metadata(file)
+    return set([meta.row_group(i).column(0).file_path for i in range(meta.num_row_groups)])
+
+
+def summary_is_current(dataset):
+    """summary_is_current(dataset)
+
+    Returns True if '_metadata' exists and lists exactly the fragments
+    of the dataset (fragments without rows are ignored), else False.
+    """
+    import pyarrow.parquet as parquet
+    listed = summary_files(dataset)
+    if listed is None: return False
+    files  = set(_fragments_(dataset))
+    if not listed <= files: return False
+    return all([parquet.read_metadata(os.path.join(dataset, x)).num_row_groups == 0 for x in files - listed])
+
+
+def build_summary(dataset, files = None, rename = None):
+    """build_summary(dataset, files = None, rename = None)
+
+    Reads the footers of the fragments and combines them into one
+    pyarrow.parquet.FileMetaData (the content of '_metadata').
+
+    Parameters
+    ==========
+    dataset : str
+        Path to the parquet dataset.
+    files : None or list of str
+        Fragments (relative to 'dataset'); all fragments if None.
+    rename : None or dict
+        File paths stored in the summary if they differ from the
+        fragment names (e.g., the names used when publishing).
+
+    Returns
+    =======
+    pyarrow.parquet.FileMetaData or None if there are no fragments.
+
+    Raises
+    ======
+    Exception: If the fragments have different schemas.
+    """
+    import pyarrow.parquet as parquet
+
+    files = _fragments_(dataset) if files is None else files
+    res   = None
+    for file in files:
+        meta = parquet.read_metadata(os.path.join(dataset, *file.split("/")))
+        meta.set_file_path(file if rename is None else rename.get(file, file))
+        if res is None:
+            res = meta
+        else:
+            try:
+                res.append_row_groups(meta)
+            except Exception as e:
+                raise Exception(f"Schema of {file} differs from the other fragments in {dataset}; {e}")
+    return res
+
+
+def _varint_(buf, pos):
+    """_varint_(buf, pos)
+
+    Used internally; decodes an unsigned varint (Thrift compact protocol).
+    Returns the value and the position after it.
+    """
+    res, shift = 0, 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        res |= (b & 0x7F) << shift
+        if b < 0x80: return res, pos
+        shift += 7
+
+
+def _encode_varint_(x):
+    """_encode_varint_(x)
+
+    Used internally; encodes an unsigned varint (Thrift compact protocol).
+    """
+    res = bytearray()
+    while x >= 0x80:
+        res.append((x & 0x7F) | 0x80)
+        x >>= 7
+    res.append(x)
+    return bytes(res)
+
+
+def _skip_(buf, pos, type, element = False):
+    """_skip_(buf, pos, type, element = False)
+
+    Used internally; returns the position after a value of 'type' (Thrift
+    compact protocol). Booleans are stored in the field header, except for
+    elements of lists, sets and maps ('element = True', one byte).
+    """
+    if type in (1, 2): return pos + 1 if element else pos
+    if type == 3:      return pos + 1
+    if type in (4, 5, 6): return _varint_(buf, pos)[1]
+    if type == 7:      return pos + 8
+    if type == 8:
+        n, pos = _varint_(buf, pos)
+        return pos + n
+    if type in (9, 10):
+        n, etype = buf[pos] >> 4, buf[pos] & 0x0F
+        pos += 1
+        if n == 15: n, pos = _varint_(buf, pos)
+        for i in range(n): pos = _skip_(buf, pos, etype, True)
+        return pos
+    if type == 11:
+        n, pos = _varint_(buf, pos)
+        if n == 0: return pos
+        ktype, vtype = buf[pos] >> 4, buf[pos] & 0x0F
+        pos += 1
+        for i in range(n):
+            pos = _skip_(buf, _skip_(buf, pos, ktype, True), vtype, True)
+        return pos
+    if type == 12: return _fields_(buf, pos)[1]
+    raise ValueError(f"Unknown Thrift type {type}.")
+
+
+def _fields_(buf, pos):
+    """_fields_(buf, pos)
+
+    Used internally; reads the fields of a struct (Thrift compact protocol).
+    Returns a list of tuples (field id, type, start of the field header,
+    start and end of the value) and the position after the struct.
+    """
+    res, fid = [], 0
+    while True:
+        start = pos
+        b     = buf[pos]
+        pos  += 1
+        if b == 0: return res, pos
+        delta, type = b >> 4, b & 0x0F
+        if delta == 0:
+            z, pos = _varint_(buf, pos)
+            fid    = (z >> 1) ^ -(z & 1)
+        else:
+            fid += delta
+        value = pos
+        pos   = _skip_(buf, pos, type)
+        res.append((fid, type, start, value, pos))
+
+
+def _drop_row_groups_(buf, files):
+    """_drop_row_groups_(buf, files)
+
+    Used internally; removes the row groups of 'files' (file paths as
+    stored in the summary) from the content of a '_metadata' file. The
+    footer (Thrift compact protocol) is copied field by field; only the
+    list of row groups (field 4) and the number of rows (field 3) of the
+    FileMetaData are rewritten. pyarrow offers no way to remove row groups
+    from a FileMetaData object.
+
+    Returns
+    =======
+    The new content of the '_metadata' file (bytes).
+    """
+    import struct
+    if not (buf[:4] == b"PAR1" and buf[-4:] == b"PAR1"):
+        raise ValueError("Not a parquet metadata file.")
+    size   = struct.unpack("<i", buf[-8:-4])[0]
+    footer = buf[-8 - size:-8]
+
+    fields, end = _fields_(footer, 0)
+    out, nrows = bytearray(), None
+    for fid, type, start, value, stop in fields:
+        if fid == 4:
+            n, etype, pos = footer[value] >> 4, footer[value] & 0x0F, value + 1
+            if n == 15: n, pos = _varint_(footer, pos)
+            keep, nrows = [], 0
+            for i in range(n):
+                rg, rg_end = _fields_(footer, pos)
+                rg         = dict([(x[0], x) for x in rg])
+                # File path of the first column chunk; number of rows
+                cols, cpos = rg[1][3], rg[1][3] + 1
+                if footer[cols] >> 4 == 15: cpos = _varint_(footer, cpos)[1]
+                chunk = dict([(x[0], x) for x in _fields_(footer, cpos)[0]])
+                path  = None
+                if 1 in chunk:
+                    length, ppos = _varint_(footer, chunk[1][3])
+                    path = footer[ppos:ppos + length].decode("utf-8")
+                if not path in files:
+                    keep.append(footer[pos:rg_end])
+                    z = _varint_(footer, rg[3][3])[0]
+                    nrows += (z >> 1) ^ -(z & 1)
+                pos = rg_end
+            out += footer[start:value]
+            out += bytes([(len(keep) << 4) | etype]) if len(keep) < 15 else \
+                   bytes([0xF0 | etype]) + _encode_varint_(len(keep))
+            for x in keep: out += x
+        else:
+            out += footer[start:stop]
+    out += b"\x00"
+
+    # Number of rows (field 3, before the row groups); rewritten
+    if nrows is not None:
+        fields, end = _fields_(bytes(out), 0)
+        start, value, stop = [x[2:] for x in fields if x[0] == 3][0]
+        out = out[:value] + _encode_varint_((nrows << 1) ^ (nrows >> 63)) + out[stop:]
+    return b"PAR1" + bytes(out) + struct.pack("<i", len(out)) + b"PAR1"
+
+
+def _write_(dataset, meta):
+    """_write_(dataset, meta)
+
+    Used internally; writes '_metadata' and '_common_metadata' under
+    temporary names first and renames them (readers never see a
+    partially written summary).
+    """
+    import pyarrow.parquet as parquet
+    for name in [COMMON_METADATA, METADATA]:
+        tmp = os.path.join(dataset, f".{name}.tmp")
+        if name == METADATA:
+            meta.write_metadata_file(tmp)
+        else:
+            parquet.write_metadata(meta.schema.to_arrow_schema(), tmp)
+        os.replace(tmp, os.path.join(dataset, name))
+
+
+def remove_summary(dataset):
+    """remove_summary(dataset)
+
+    Removes the summary files of a dataset (readers fall back to
+    listing the fragments).
+    """
+    for name in [METADATA, COMMON_METADATA]:
+        if os.path.isfile(os.path.join(dataset, name)): os.remove(os.path.join(dataset, name))
+
+
+def write_summary(dataset, verbose = False):
+    """write_summary(dataset, verbose = False)
+
+    (Re-)writes the summary files of a dataset from the footers of all
+    fragments. If the fragments do not share one schema (datasets written
+    by older versions; see schema.migrate_dataset) the summary is removed.
+
+    Parameters
+    ==========
+    dataset : str
+        Path to the parquet dataset.
+    verbose : bool
+        Set verbosity level, defaults to False.
+
+    Returns
+    =======
+    Number of fragments in the summary (None if no summary written).
+    """
+    if not os.path.isdir(dataset):
+        raise Exception(f"Dataset '{dataset}' does not exist.")
+    files = _fragments_(dataset)
+    try:
+        meta = build_summary(dataset, files)
+    except Exception as e:
+        if verbose: print(f"    No summary for {dataset}; {e}")
+        remove_summary(dataset)
+        return None
+    if meta is None:
+        remove_summary(dataset)
+        return None
+    _write_(dataset, meta)
+    if verbose: print(f"    Written summary of {dataset} ({len(files)} fragments, {meta.num_row_groups} row groups)")
+    return len(files)
+
+
+def update_summary(dataset, removed = None, added = None, verbose = False):
+    """update_summary(dataset, removed = None, added = None, verbose = False)
+
+    Removes fragments from and adds fragments to the summary of a dataset
+    (e.g., fragments rewritten by replace.replace_source). Only the footers
+    of the fragments added are read; the row groups of the fragments
+    removed are dropped from '_metadata'. If the dataset has no (current)
+    summary it is rebuilt from all fragments.
+
+    Parameters
+    ==========
+    dataset : str
+        Path to the parquet dataset.
+    removed : None or list of str
+        Fragments removed (relative to 'dataset').
+    added : None or list of str
+        Fragments written (relative to 'dataset').
+    verbose : bool
+        Set verbosity level, defaults to False.
+
+    Returns
+    =======
+    Number of fragments in the summary (None if no summary written).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as parquet
+
+    removed = set([x.replace(os.sep, "/") for x in ([] if removed is None else removed)])
+    added   = [x.replace(os.sep, "/") for x in ([] if added is None else added)]
+    listed  = summary_files(dataset)
+    if listed is None or not (listed - removed) | set(added) >= set(_fragments_(dataset)):
+        return write_summary(dataset, verbose = verbose)
+
+    file = os.path.join(dataset, METADATA)
+    try:
+        if len(listed & removed) > 0:
+            with open(file, "rb") as fid:
+                meta = parquet.read_metadata(pa.BufferReader(_drop_row_groups_(fid.read(), removed)))
+        else:
+            meta = parquet.read_metadata(file)
+        listed = listed - removed
+        new    = build_summary(dataset, [x for x in added if not x in listed])
+        if new is not None: meta.append_row_groups(new)
+    except Exception:
+        return write_summary(dataset, verbose = verbose)
+    _write_(dataset, meta)
+    if verbose: print(f"    Updated summary of {dataset} ({len(listed | set(added))} fragments)")
+    return len(listed | set(added))
+
+
+def append_summary(dataset, fragments, verbose = False):
+    """append_summary(dataset, fragments, verbose = False)
+
+    Adds new fragments to the summary of a dataset (called by the
+    writer, see IndexParser.flush). If the dataset has no (current)
+    summary it is rebuilt from all fragments (see update_summary).
+
+    Parameters
+    ==========
+    dataset : str
+        Path to the parquet dataset.
+    fragments : list of str
+        Fragments written (relative to 'dataset').
+    verbose : bool
+        Set verbosity level, defaults to False.
+    """
+    return update_summary(dataset, added = fragments, verbose = verbose)
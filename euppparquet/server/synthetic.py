@@ -0,0 +1,214 @@
+
+
+# --------------------------------------------------------------
+# Synthetic GRIB index files for offline testing and benchmarks.
+# Names and records follow the files on the ECMWF storage (see
+# prepare_parquet.urls_* and IndexParser._parse_filename_); the
+# number of parameters, steps, members, and dates is configurable.
+# --------------------------------------------------------------
+
+import os
+import json
+import random
+import datetime as dt
+
+# Default parameters (surface; pressure levels x LEVELS)
+SURF_PARAMS     = ["2t", "10u", "10v", "msl", "tcc", "tp", "sd", "cape", "100u", "100v"]
+PRESSURE_PARAMS = ["t", "z", "u", "v", "q"]
+LEVELS          = ["500", "700", "850"]
+
+# Accumulated parameters; the step is a range ('0-6')
+ACCUMULATED = ["tp"]
+
+# Default forecast steps (hours)
+STEPS = list(range(0, 121, 6))
+
+# Number of years of reforecasts (hindcast dates) per reforecast run
+HINDCAST_YEARS = 20
+
+
+def _records_(type, kind, dates, path, params, steps, members, hdates = 0, seed = None):
+    """_records_(type, kind, dates, path, params, steps, members, hdates = 0, seed = None)
+
+    Used internally; generator of the records (dictionaries) of one
+    GRIB index file. 'members' is None for files without ensemble
+    member ('ctr', 'hr', analysis). Offsets are consecutive in '_path',
+    the length of the messages is random but reproducible.
+    """
+    rnd    = random.Random(seed if seed is not None else path)
+    offset = 0
+    levels = LEVELS if kind == "pressure" else [None]
+    stream = "eefo" if type == "reforecast" else "enfo"
+    for date in dates:
+        if type == "analysis":
+            runs = [(date, "0000", 0), (date, "1200", 0)]
+        elif hdates > 0:
+            runs = [(date.replace(year = date.year - i), "0000", None) for i in range(1, hdates + 1)]
+        else:
+            runs = [(date, "0000", None)]
+        for rdate, time, step0 in runs:
+            for step in ([step0] if step0 is not None else steps):
+                for number in ([None] if members is None else range(1, members + 1)):
+                    for param in params:
+                        for level in levels:
+                            rec = {"domain": "g", "date": f"{date:%Y%m%d}", "time": time, "expver": "0001",
+                                   "class": "od", "type": "cf" if number is None else "pf", "stream": stream,
+                                   "step": f"{max(step - 6, 0)}-{step}" if param in ACCUMULATED else str(step),
+                                   "levtype": "pl" if level is not None else "sfc", "param": param}
+                            if level is not None:  rec["levelist"] = level
+                            if number is not None: rec["number"]   = str(number)
+                            if hdates > 0:         rec["hdate"]    = f"{rdate:%Y%m%d}"
+                            length = rnd.randint(50000, 1500000)
+                            rec.update({"_offset": offset, "_length": length, "_path": path})
+                            offset += length
+                            yield rec
+
+
+def write_index(dir, name, records, format = "zip"):
+    """write_index(dir, name, records, format = "zip")
+
+    Writes one GRIB index file (one JSON record per line).
+
+    Parameters
+    ==========
+    dir : str
+        Target directory.
+    name : str
+        Name of the GRIB index file (e.g., 'EU_..._params_2017-01.grb.index').
+    records : iterable of dict
+        Records of the file.
+    format : str
+        'zip' (default, as prepare_zipfile), 'gzip', 'zstd', or 'none'
+        (uncompressed).
+
+    Returns
+    =======
+    Name of the file written (in 'dir').
+    """
+    import io
+    if format == "zip":
+        import zipfile
+        file = name + ".zip"
+        with zipfile.ZipFile(os.path.join(dir, file), "w", zipfile.ZIP_DEFLATED) as zip:
+            with zip.open(name, "w") as fid:
+                with io.TextIOWrapper(fid, encoding = "utf-8") as txt:
+                    for rec in records: txt.write(json.dumps(rec) + "\n")
+    elif format == "gzip":
+        import gzip
+        file = name + ".gz"
+        with gzip.open(os.path.join(dir, file), "wt", compresslevel = 1) as fid:
+            for rec in records: fid.write(json.dumps(rec) + "\n")
+    elif format == "zstd":
+        import zstandard
+        file = name + ".zst"
+        with open(os.path.join(dir, file), "wb") as raw:
+            with zstandard.ZstdCompressor().stream_writer(raw) as fid:
+                for rec in records: fid.write((json.dumps(rec) + "\n").encode("utf-8"))
+    elif format == "none":
+        file = name
+        with open(os.path.join(dir, file), "w") as fid:
+            for rec in records: fid.write(json.dumps(rec) + "\n")
+    else:
+        raise ValueError("Input 'format' must be one of 'zip', 'gzip', 'zstd', or 'none'.")
+    return file
+
+
+def make_archive(dir, begin, end, types = ("analysis", "forecast", "reforecast"),
+                 products = ("ens", "ctr", "hr"), kinds = ("surf", "pressure"),
+                 params = None, steps = None, members = 10, hindcast_years = HINDCAST_YEARS,
+                 version = 0, format = "zip"):
+    """make_archive(dir, begin, end, types = ("analysis", "forecast", "reforecast"),
+                 products = ("ens", "ctr", "hr"), kinds = ("surf", "pressure"),
+                 params = None, steps = None, members = 10, hindcast_years = HINDCAST_YEARS,
+                 version = 0, format = "zip")
+
+    Writes synthetic GRIB index files for all dates in [begin, end]
+    named as on the ECMWF storage:
+
+    * analysis: monthly files ('EU_analysis_surf_params_2017-01.grb.index'),
+      00 and 12 UTC of each day.
+    * forecast: daily ensemble files ('EU_forecast_ens_surf_params_2017-01-02_0'),
+      monthly control run and high resolution files ('ctr', 'hr').
+    * reforecast: ensemble files on Mondays and Thursdays with
+      'hindcast_years' hindcast dates each, monthly control run files.
+
+    Parameters
+    ==========
+    dir : str
+        Target directory (created if needed).
+    begin, end : datetime.date or str ('YYYY-MM-DD')
+        First and last date.
+    types : list of str
+        Dataset types to be generated.
+    products : list of str
+        Forecast products ('ens', 'ctr', 'hr').
+    kinds : list of str
+        Level types ('surf', 'pressure').
+    params : None or dict
+        Parameters per kind (e.g., {'surf': ['2t']}); defaults to
+        SURF_PARAMS and PRESSURE_PARAMS.
+    steps : None or list of int
+        Forecast steps in hours, defaults to STEPS.
+    members : positive int
+        Number of perturbed ensemble members (control run separately).
+    hindcast_years : positive int
+        Number of hindcast dates per reforecast run.
+    version : int
+        Version in the file names.
+    format : str
+        Compression of the files (see write_index).
+
+    Returns
+    =======
+    List of file names (in 'dir'), sorted.
+    """
+    if isinstance(begin, str): begin = dt.datetime.strptime(begin, "%Y-%m-%d").date()
+    if isinstance(end, str):   end   = dt.datetime.strptime(end, "%Y-%m-%d").date()
+    if end < begin:
+        raise ValueError("Input 'end' must not be before 'begin'.")
+    if not isinstance(members, int) or not members > 0:
+        raise ValueError("Input 'members' must be a positive integer.")
+    params = dict(surf = SURF_PARAMS, pressure = PRESSURE_PARAMS) if params is None else params
+    steps  = STEPS if steps is None else steps
+    if not os.path.isdir(dir): os.makedirs(dir)
+
+    dates  = [begin + dt.timedelta(i) for i in range((end - begin).days + 1)]
+    months = sorted(set([(x.year, x.month) for x in dates]))
+    folder = dict(analysis = "ana", forecast = "fcs", reforecast = "rfcs")
+
+    files = []
+    def add(type, name, dates, members, hdates = 0):
+        path = f"data/{folder[type]}/{kind}/{name}".replace(".grb.index", ".grb")
+        recs = _records_(type, kind, dates, path, params[kind], steps, members, hdates)
+        files.append(write_index(dir, name, recs, format = format))
+
+    for kind in kinds:
+        if "analysis" in types:
+            for year, month in months:
+                days = [x for x in dates if (x.year, x.month) == (year, month)]
+                add("analysis", f"EU_analysis_{kind}_params_{year:04d}-{month:02d}.grb.index", days, None)
+        if "forecast" in types:
+            if "ens" in products:
+                for date in dates:
+                    add("forecast", f"EU_forecast_ens_{kind}_params_{date:%Y-%m-%d}_{version}.grb.index",
+                        [date], members)
+            for product in [x for x in ["ctr", "hr"] if x in products]:
+                if product == "hr" and not kind == "surf": continue
+                for year, month in months:
+                    days = [x for x in dates if (x.year, x.month) == (year, month)]
+                    add("forecast", f"EU_forecast_{product}_{kind}_params_{year:04d}-{month:02d}_{version}.grb.index",
+                        days, None)
+        if "reforecast" in types:
+            runs = [x for x in dates if x.weekday() in [0, 3]]
+            if "ens" in products:
+                for date in runs:
+                    add("reforecast", f"EU_reforecast_ens_{kind}_params_{date:%Y-%m-%d}_{version}.grb.index",
+                        [date], members, hindcast_years)
+            if "ctr" in products:
+                for year, month in months:
+                    days = [x for x in runs if (x.year, x.month) == (year, month)]
+                    if len(days) == 0: continue
+                    add("reforecast", f"EU_reforecast_ctr_{kind}_params_{year:04d}-{month:02d}_{version}.grb.index",
+                        days, None, hindcast_years)
+
+    return sorted(files)
@@ -0,0 +1,193 @@
+
+
+# --------------------------------------------------------------
+# Vectorized (pyarrow.compute) transformations applied to the
+# records read from the GRIB index files before they are written
+# into the parquet datasets. Used by IndexParser.
+# --------------------------------------------------------------
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Columns not stored in the parquet datasets
+DROP_COLUMNS = ["domain", "levtype", "class", "type", "stream", "expver",
+                "_leg_number", "_param_id"]
+
+
+def decode_step(step):
+    """decode_step(step)
+
+    Decodes the forecast step. The GRIB index contains either
+    a single step (e.g., '12') or a step range (e.g., '6-12'); in
+    the latter case the end of the range is returned.
+
+    Parameters
+    ==========
+    step : pyarrow.Array or pyarrow.ChunkedArray
+        Steps as read from the GRIB index file.
+
+    Returns
+    =======
+    pyarrow.ChunkedArray of type int64.
+
+    Raises
+    ======
+    Exception: If one of the steps cannot be decoded.
+    """
+    step = pc.cast(step, pa.string())
+    ok   = pc.match_substring_regex(step, "^([0-9]+-)?([0-9]+)$")
+    if not pc.all(ok).as_py():
+        bad = pc.filter(step, pc.invert(pc.fill_null(ok, False)))
+        bad = bad[0].as_py() if len(bad) > 0 else None
+        raise Exception(f"Cannot decode step = '{bad}'.")
+    end = pc.extract_regex(step, "(?P<end>[0-9]+)$")
+    return pc.cast(pc.struct_field(end, [0]), pa.int64())
+
+
+def merge_param_levelist(param, levelist):
+    """merge_param_levelist(param, levelist)
+
+    Appends the level to the parameter name (e.g., 't' and '700'
+    gives 't700'). As for string concatenation in pandas, the
+    result is missing if one of the two is missing.
+
+    Parameters
+    ==========
+    param : pyarrow.Array or pyarrow.ChunkedArray
+    levelist : pyarrow.Array or pyarrow.ChunkedArray
+
+    Returns
+    =======
+    pyarrow.ChunkedArray of type string.
+    """
+    return pc.binary_join_element_wise(pc.cast(param, pa.string()),
+                                       pc.cast(levelist, pa.string()), "")
+
+
+def analysis_valid_time(date, time, step):
+    """analysis_valid_time(date, time, step)
+
+    Valid time of analysis fields, i.e., date and time
+    ('%Y%m%d' and '%H%M') plus step hours.
+
+    Parameters
+    ==========
+    date : pyarrow.Array or pyarrow.ChunkedArray
+    time : pyarrow.Array or pyarrow.ChunkedArray
+    step : pyarrow.Array or pyarrow.ChunkedArray
+        Decoded step in hours (see decode_step).
+
+    Returns
+    =======
+    pyarrow.ChunkedArray of type timestamp[s].
+    """
+    stamp = pc.binary_join_element_wise(pc.cast(date, pa.string()),
+                                        pc.cast(time, pa.string()), "")
+    stamp = pc.strptime(stamp, format = "%Y%m%d%H%M", unit = "s")
+    delta = pc.cast(pc.multiply(pc.cast(step, pa.int64()), 3600), pa.duration("s"))
+    return pc.add(stamp, delta)
+
+
+def partition_keys(datetime):
+    """partition_keys(datetime)
+
+    Derives the date keys used for partitioning the datasets.
+
+    Parameters
+    ==========
+    datetime : pyarrow.Array or pyarrow.ChunkedArray
+        Timestamps.
+
+    Returns
+    =======
+    Dictionary with 'year', 'month', and 'day' (int32).
+    """
+    return dict(year  = pc.cast(pc.year(datetime),  pa.int32()),
+                month = pc.cast(pc.month(datetime), pa.int32()),
+                day   = pc.cast(pc.day(datetime),   pa.int32()))
+
+
+def drop_columns(table, columns = DROP_COLUMNS):
+    """drop_columns(table, columns = DROP_COLUMNS)
+
+    Removes columns from a table if present.
+
+    Parameters
+    ==========
+    table : pyarrow.Table
+    columns : list of str
+        Columns to be removed, defaults to DROP_COLUMNS.
+
+    Returns
+    =======
+    pyarrow.Table
+    """
+    return table.drop_columns([x for x in columns if x in table.column_names])
+
+
+def _set_column_(table, name, values):
+    """_set_column_(table, name, values)
+
+    Replaces column 'name' (in place) or appends it if not yet existing.
+    """
+    if name in table.column_names:
+        return table.set_column(table.column_names.index(name), name, values)
+    return table.append_column(name, values)
+
+
+def transform_table(table, file_info):
+    """transform_table(table, file_info)
+
+    Prepares one batch of GRIB index records for the parquet dataset.
+    Decodes the step, merges param and levelist, derives the date
+    partition keys (valid time for analyses, model initialization
+    for forecasts/reforecasts), keeps the time of day of the valid
+    time for analyses, and drops columns not needed.
+
+    Parameters
+    ==========
+    table : pyarrow.Table
+        Records as read from the GRIB index file.
+    file_info : dict
+        Return of IndexParser._parse_filename_.
+
+    Returns
+    =======
+    pyarrow.Table
+    """
+
+    step  = decode_step(table.column("step"))
+    table = _set_column_(table, "step", step)
+
+    # Manipulate parameter name if we have levelist.
+    if "levelist" in table.column_names:
+        param = merge_param_levelist(table.column("param"), table.column("levelist"))
+        table = _set_column_(table, "param", param).drop_columns(["levelist"])
+
+    if file_info["type"] == "analysis":
+        valid = analysis_valid_time(table.column("date"), table.column("time"), step)
+        keys  = partition_keys(valid)
+        # Time of day of the valid time (HHMM); several analyses per day
+        table = _set_column_(table, "time", pc.add(pc.multiply(pc.hour(valid), 100), pc.minute(valid)))
+        table = table.drop_columns(["step", "date"])
+
+    else:
+        # In case we have an ensemble but no number we got
+        # forecast control run. Set number to 0.
+        if not "number" in table.column_names:
+            table = table.append_column("number", pa.repeat(pa.scalar(0, pa.int64()), table.num_rows))
+
+        # Adding file/dataset version and product. Either ens (ctr
+        # gets ens in _parse_filename_) or efi.
+        table = table.append_column("version", pa.repeat(pa.scalar(file_info["version"], pa.int64()), table.num_rows))
+        table = table.append_column("product", pa.repeat(pa.scalar(file_info["product"], pa.string()), table.num_rows))
+
+        # Model run initialization
+        keys  = partition_keys(pc.strptime(pc.cast(table.column("date"), pa.string()),
+                                           format = "%Y%m%d", unit = "s"))
+        table = table.drop_columns(["date"])
+
+    for key, values in keys.items():
+        table = _set_column_(table, key, values)
+
+    return drop_columns(table)
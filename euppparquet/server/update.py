@@ -0,0 +1,224 @@
+
+
+# --------------------------------------------------------------
+# Incremental update; checks the upstream GRIB index files using
+# conditional HTTP requests (ETag/Last-Modified) and ingests new
+# files only.
+# --------------------------------------------------------------
+
+import os
+
+
+def check_upstream(url, etag = None, last_modified = None, session = None):
+    """check_upstream(url, etag = None, last_modified = None, session = None)
+
+    Sends a conditional HEAD request ('If-None-Match', 'If-Modified-Since')
+    to check whether the GRIB index file on the server is available and
+    has changed compared to the validators given.
+
+    Parameter
+    =========
+    url : str
+        URL of the GRIB index file.
+    etag : None or str
+        Value of the 'ETag' header when the file was last ingested.
+    last_modified : None or str
+        Value of the 'Last-Modified' header when the file was last ingested.
+    session : None or requests.Session
+        Session used for the request (see get_session).
+
+    Return
+    ======
+    Dictionary with 'status' ('missing', 'unchanged', or 'modified')
+    and the current validators 'etag' and 'last_modified'.
+    """
+    import requests
+
+    headers = dict()
+    if not etag is None:          headers["If-None-Match"]     = etag
+    if not last_modified is None: headers["If-Modified-Since"] = last_modified
+
+    head = requests.head if session is None else session.head
+    req  = head(url, headers = headers, allow_redirects = True)
+    if req.status_code == 304:
+        status = "unchanged"
+    elif req.status_code == 200:
+        status = "modified"
+    elif req.status_code in [403, 404]:
+        status = "missing"
+    else:
+        raise Exception(f"Got {req.status_code} for {url}")
+
+    # If the server ignores the conditional headers, compare ourselves
+    new_etag = req.headers.get("ETag", etag)
+    new_lm   = req.headers.get("Last-Modified", last_modified)
+    if status == "modified" and (not etag is None or not last_modified is None):
+        if (etag is None or new_etag == etag) and (last_modified is None or new_lm == last_modified):
+            status = "unchanged"
+
+    return dict(status = status, etag = new_etag, last_modified = new_lm)
+
+
+def _update_months_(since, now):
+    """_update_months_(since, now)
+
+    Returns a dictionary {year: [months]} covering all months
+    from 'since' to 'now' (both datetime.date or datetime.datetime).
+    """
+    res = dict()
+    year, month = since.year, since.month
+    while (year, month) <= (now.year, now.month):
+        res.setdefault(year, []).append(month)
+        year, month = (year, month + 1) if month < 12 else (year + 1, 1)
+    return res
+
+
+def update_product(product, baseurl, dir, years = None, months = None, version = 0,
+                   jobs = 1, chunksize = None, workers = 1, cache = "zip", layout = None, queue = None,
+                   retries = 3, buffer_rows = None, replace = True, verbose = True):
+    """update_product(product, baseurl, dir, years = None, months = None, version = 0,
+                   jobs = 1, chunksize = None, workers = 1, cache = "zip", layout = None, queue = None,
+                   retries = 3, buffer_rows = None, replace = True, verbose = True)
+
+    Incremental update of one product. Checks all GRIB index files of the
+    months to be considered with conditional HEAD requests (see check_upstream)
+    and only ingests files which are new or modified. The validators ('ETag',
+    'Last-Modified') of the ingested files and the run itself are
+    recorded in the manifest of the dataset (see Manifest).
+
+    If neither 'years' nor 'months' are set, all months from the start of
+    the last recorded update run up to today are checked. Files of earlier
+    months republished upstream are therefore only found if 'years' (and
+    'months') are set explicitly.
+
+    Files which changed upstream after they have been ingested (e.g.,
+    republished with corrected records) are downloaded again and their
+    records replaced (see replace.replace_source); only the partitions
+    affected are rewritten. If 'replace' is False they are reported only.
+
+    Parameters
+    ==========
+    product : str
+        One of 'analysis', 'forecast', or 'reforecast'.
+    baseurl : str
+        Base URL to the server where the data are stored.
+    dir : str
+        Directory for local copies of the GRIB index files (see prepare_index).
+    years : None, int or list of int
+    months : None, int or list of int
+        Defaults to all months if 'years' is set.
+    version : int
+        Version of the GRIB index files (forecast/reforecast only).
+    jobs, chunksize, workers, cache, queue, retries, buffer_rows :
+        See process_files.
+    layout : None, str or list of str
+        Partitioning layout if the dataset is created (see prepare_analysis).
+    replace : bool
+        Whether to replace the records of files modified upstream,
+        defaults to True.
+    verbose : bool
+        Verbosity level, defaults to True.
+
+    Returns
+    =======
+    Dictionary with the lists of URLs 'new', 'modified', 'unchanged', and 'missing'.
+    """
+    import datetime as dt
+    from concurrent.futures import ThreadPoolExecutor
+    from .Manifest import Manifest
+    from .prepare_index import CACHE_FORMATS
+    from .prepare_zipfile import get_session
+    from . import prepare_parquet
+
+    if not product in ["analysis", "forecast", "reforecast"]:
+        raise ValueError("Wrong input on 'product'.")
+
+    started  = dt.datetime.now(dt.timezone.utc)
+    manifest = Manifest(f"{product}.parquet")
+
+    # Months to be checked
+    if years is None:
+        if not months is None:
+            raise ValueError("Input 'years' required if 'months' is set.")
+        since = manifest.last_run("update")
+        if since is None:
+            raise Exception(f"No previous update run recorded for {product}; specify years/months.")
+        todo = _update_months_(since, started)
+    else:
+        if months is None: months = list(range(1, 13))
+        years, months = prepare_parquet._check_years_months_(years, months)
+        todo = dict([(year, months) for year in years])
+
+    urls = []
+    for year, mon in todo.items():
+        if product == "analysis":
+            urls += prepare_parquet.urls_analysis(baseurl, year, mon)
+        else:
+            urls += getattr(prepare_parquet, f"urls_{product}")(baseurl, year, mon, version)
+
+    # Checking upstream files (concurrently, 'jobs' requests at a time)
+    session = get_session(jobs)
+    known   = dict([(url, manifest.upstream(os.path.basename(url))) for url in urls])
+    def check(url):
+        if known[url] is None:
+            return check_upstream(url, session = session)
+        return check_upstream(url, known[url]["etag"], known[url]["last_modified"], session = session)
+
+    res = dict(new = [], modified = [], unchanged = [], missing = [])
+    validators = dict()
+    with ThreadPoolExecutor(max_workers = jobs) as pool:
+        for url, chk in zip(urls, pool.map(check, urls)):
+            source = os.path.basename(url)
+            if chk["status"] == "missing":
+                res["missing"].append(url)
+            elif chk["status"] == "unchanged":
+                res["unchanged"].append(url)
+            elif manifest.has_source(source) is None:
+                res["new"].append(url)
+                validators[url] = (source, chk)
+            elif known[url] is None:
+                # Ingested before updates were recorded; store validators
+                manifest.set_upstream(source, url, chk["etag"], chk["last_modified"])
+                res["unchanged"].append(url)
+            else:
+                res["modified"].append(url)
+                validators[url] = (source, chk)
+
+    if verbose:
+        print(f"Update {product}: {len(res['new'])} new, {len(res['modified'])} modified, " + \
+              f"{len(res['unchanged'])} unchanged, {len(res['missing'])} missing")
+        for url in res["modified"]:
+            print(f"    Changed upstream (already ingested{'' if replace else ', not replaced'}): {url}")
+    modified = res["modified"] if replace else []
+
+    # Remove local copies of new files older than the upstream file; local
+    # copies of modified files are outdated anyways
+    if not cache is None:
+        from email.utils import parsedate_to_datetime
+        for url in res["new"] + modified:
+            local = os.path.join(dir, os.path.basename(url) + CACHE_FORMATS[cache])
+            lm    = validators[url][1]["last_modified"]
+            if not os.path.isfile(local): continue
+            if url in modified or (not lm is None and os.path.getmtime(local) < parsedate_to_datetime(lm).timestamp()):
+                if verbose: print(f"    Removing outdated local copy {local}")
+                os.remove(local)
+
+    # Ingest new files; record validators of the files ingested. Files
+    # which failed are not recorded and therefore retried by the next run.
+    nfiles = 0
+    for urls, repl in [(res["new"], False), (modified, True)]:
+        if len(urls) == 0: continue
+        done = prepare_parquet.process_files(urls, dir, verbose = verbose, jobs = jobs,
+                                             chunksize = chunksize, workers = workers, cache = cache,
+                                             layouts = None if layout is None else {product: layout},
+                                             queue = queue, retries = retries, buffer_rows = buffer_rows,
+                                             replace = repl)
+        for url in done["ingested"]:
+            source, chk = validators[url]
+            manifest.set_upstream(source, url, chk["etag"], chk["last_modified"])
+        nfiles += len(done["ingested"])
+
+    manifest.add_run(started, "update", nfiles)
+    manifest.close()
+
+    return res
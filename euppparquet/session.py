@@ -0,0 +1,46 @@
+
+
+# --------------------------------------------------------------
+# Pooled HTTP session shared by the server (downloading the GRIB
+# index files) and the client (fetching GRIB messages).
+# --------------------------------------------------------------
+
+def get_session(jobs = 1, retries = 0):
+    """get_session(jobs = 1, retries = 0)
+
+    Creates a requests.Session with a connection pool large enough
+    to serve 'jobs' concurrent requests. The session is shared by all
+    requests of one run such that connections (and TLS handshakes)
+    are reused instead of opening a new connection for each request.
+
+    Parameter
+    =========
+    jobs : positive int
+        Number of concurrent requests, defaults to 1.
+    retries : int
+        Number of retries on connection errors and server errors
+        (500, 502, 503, 504) with exponential backoff, defaults to 0
+        (the caller handles retries).
+
+    Return
+    ======
+    Returns a requests.Session object.
+    """
+
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    if not isinstance(jobs, int) or not jobs > 0:
+        raise ValueError("Input 'jobs' must be a positive integer.")
+    if not isinstance(retries, int) or retries < 0:
+        raise ValueError("Input 'retries' must be a non-negative integer.")
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = max(jobs, 10), pool_maxsize = max(jobs, 10),
+                          max_retries = Retry(total = retries, backoff_factor = 0.5,
+                                              status_forcelist = [500, 502, 503, 504]))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
@@ -1,19 +1,17 @@
-
-
-
 import os
-import pyarrow.parquet as parquet
+import pyarrow.fs
 import s3fs
 import pandas as pd
+from euppparquet.client import Dataset
 
 
 if __name__ == "__main__":
 
-    s3 = s3fs.S3FileSystem()
+    # Fragments and row group statistics are read from the summary
+    # ('_metadata') of the snapshot published; no listing of the bucket
+    s3 = pyarrow.fs.PyFileSystem(pyarrow.fs.FSSpecHandler(s3fs.S3FileSystem()))
     s3URL = "https://s3.console.aws.amazon.com/s3/buckets/euppparquet-analysis"
-    bucket = "s3://euppparquet-analysis"
-    filters = [("time", "=", 12), ("time", "=", "6"), ("day", "=", 1)]
-    data = parquet.ParquetDataset(bucket, filesystem = s3,
-            use_legacy_dataset = True, filters = filters).read_pandas().to_pandas()
+    bucket = "euppparquet-analysis"
+    data = Dataset(bucket, filesystem = s3).query(time = [6, 12], day = 1, as_pandas = True)
 
     print(data)
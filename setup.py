@@ -46,7 +46,7 @@ setup(name        = "euppparquet",     # This is the package name
       author           = "Reto Stauffer [aut,cre]",
       license          = "GPL-2",
       install_requires = ["requests", "pandas", "pyarrow"],
-      packages         = ["euppparquet"],
+      packages         = ["euppparquet", "euppparquet.server", "euppparquet.client"],
 
       scripts = ["bin/eupp_make_parquet",
                  "bin/eupp_get_parquet"],
@@ -0,0 +1,174 @@
+
+
+# --------------------------------------------------------------
+# Shared fixtures; datasets are created in a temporary working
+# directory (the datasets are named relative to the current
+# directory, e.g., 'forecast.parquet').
+# --------------------------------------------------------------
+
+import os
+import gzip
+import json
+import time
+import pytest
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Temporary working directory."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def forecast_index(dir, date = "2017-01-02", steps = (0, 6, 12), members = 2):
+    """Writes one (small) synthetic ensemble forecast index file (gzip);
+    returns the path and the records (list of dict)."""
+    from euppparquet.server.synthetic import make_archive
+    name = make_archive(dir, date, date, types = ["forecast"], products = ["ens"], kinds = ["surf"],
+                        params = dict(surf = ["2t", "tp"]), steps = list(steps), members = members,
+                        format = "gzip")[0]
+    file = os.path.join(dir, name)
+    with gzip.open(file, "rt") as fid: records = [json.loads(x) for x in fid]
+    return file, records
+
+
+def grib_file(dir, sizes, gaps):
+    """Writes a fake GRIB file; messages of 'sizes' bytes separated by 'gaps'
+    bytes. Returns the query result (dict) and the messages."""
+    content, res, msgs = b"", dict(_path = [], _offset = [], _length = []), []
+    for i, (size, gap) in enumerate(zip(sizes, gaps)):
+        content += b"x" * gap
+        msg = b"GRIB" + bytes([i]) * (size - 8) + b"7777"
+        res["_path"].append("data/test.grb")
+        res["_offset"].append(len(content))
+        res["_length"].append(size)
+        content += msg
+        msgs.append(msg)
+    os.makedirs(os.path.join(dir, "data"), exist_ok = True)
+    with open(os.path.join(dir, "data", "test.grb"), "wb") as fid: fid.write(content)
+    return res, msgs
+
+
+def write_records(file, records):
+    """(Over)writes a gzip compressed index file."""
+    with gzip.open(file, "wt") as fid:
+        for rec in records: fid.write(json.dumps(rec) + "\n")
+
+
+def count_rows(dataset, **kwargs):
+    """Number of records in a dataset (optionally filtered by column = value)."""
+    import pyarrow.dataset as ds
+    data = ds.dataset(dataset, format = "parquet", partitioning = "hive")
+    expr = None
+    for key, val in kwargs.items():
+        expr = (ds.field(key) == val) if expr is None else expr & (ds.field(key) == val)
+    return data.count_rows(filter = expr)
+
+
+@pytest.fixture
+def datasets(workdir):
+    """Forecasts of 2017-01-02 and 03 (ens, 2t/tp, steps 0/6/12, 2 members) and
+    analyses of 2017-01-01 to 03 (2t, 00/12 UTC)."""
+    from euppparquet.server import IndexParser
+    from euppparquet.server.synthetic import make_archive
+    parser = IndexParser()
+    for d in [2, 3]: parser.process_file(forecast_index("src", f"2017-01-0{d}")[0])
+    for file in make_archive("src", "2017-01-01", "2017-01-03", types = ["analysis"], kinds = ["surf"],
+                             params = dict(surf = ["2t"]), format = "gzip"):
+        parser.process_file(f"src/{file}")
+    parser.flush()
+
+
+# --------------------------------------------------------------
+# Local HTTP stand-in for the ECMWF storage: serves the files of
+# a directory with ETag/Last-Modified validators (conditional
+# requests) and single byte ranges ('Range: bytes=a-b').
+# --------------------------------------------------------------
+
+def _make_handler_(root, log):
+    import hashlib
+    from email.utils import formatdate, parsedate_to_datetime
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _serve_(self, body):
+            file = os.path.join(root, self.path.lstrip("/"))
+            log.append((self.command, self.path, self.headers.get("Range")))
+            if not os.path.isfile(file):
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            with open(file, "rb") as fid: content = fid.read()
+            etag  = '"' + hashlib.md5(content).hexdigest() + '"'
+            mtime = int(os.path.getmtime(file))
+            since = self.headers.get("If-Modified-Since")
+            if self.headers.get("If-None-Match") == etag or \
+               (since is not None and self.headers.get("If-None-Match") is None and
+                parsedate_to_datetime(since).timestamp() >= mtime):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            rng = self.headers.get("Range")
+            if rng is not None:
+                start, end = [int(x) for x in rng.split("=")[1].split("-")]
+                content    = content[start:end + 1]
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{os.path.getsize(file)}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(content)))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", formatdate(mtime, usegmt = True))
+            self.end_headers()
+            if body: self.wfile.write(content)
+
+        def do_GET(self):
+            self._serve_(True)
+
+        def do_HEAD(self):
+            self._serve_(False)
+
+    return Handler
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    """HTTP server serving 'tmp_path/www'; attributes 'root' (directory),
+    'url' (base URL), and 'log' (list of requests: method, path, range)."""
+    import threading
+    from types import SimpleNamespace
+    from http.server import ThreadingHTTPServer
+
+    root = tmp_path / "www"
+    root.mkdir()
+    log    = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler_(str(root), log))
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield SimpleNamespace(root = str(root), url = f"http://127.0.0.1:{server.server_port}", log = log)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def service(datasets):
+    """Query service for the datasets (see datasets) on a Unix socket in
+    the working directory; returns the client."""
+    import threading
+    from euppparquet.client import QueryService, ServiceClient
+
+    svc    = QueryService(".")
+    thread = threading.Thread(target = svc.serve, args = ("test.sock",), daemon = True)
+    thread.start()
+    client = ServiceClient("test.sock", timeout = 10)
+    for i in range(200):
+        if client.available(): break
+        time.sleep(0.02)
+    yield client
+    svc.shutdown()
+    thread.join()
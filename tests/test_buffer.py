@@ -0,0 +1,43 @@
+
+
+import os
+import glob
+
+from conftest import forecast_index, count_rows
+from euppparquet.server import IndexParser, Manifest
+
+DATASET = "forecast.parquet"
+
+
+def _fragments_():
+    return sorted(glob.glob(f"{DATASET}/**/*.parquet", recursive = True))
+
+
+def test_buffer_rows(workdir):
+    # Monthly partitions; daily files of 12 records each
+    parser = IndexParser(layouts = dict(forecast = ["year", "month"]), buffer_rows = 24)
+    files  = [forecast_index("src", f"2017-01-0{d}")[0] for d in range(2, 7)]
+    for file in files[:3]: assert parser.process_file(file) == 12
+
+    # One fragment of 24 records written; the third file is still buffered
+    assert len(_fragments_()) == 1 and count_rows(DATASET) == 24
+    manifest = Manifest(DATASET)
+    done     = [manifest.is_complete(os.path.basename(x)[:-3]) for x in files[:3]]
+    assert done == [True, True, False]
+    assert parser.pending_sources() == set([os.path.basename(files[2])[:-3]])
+
+    # Buffered records of a file already seen are skipped
+    assert parser.process_file(files[2]) == 0
+    for file in files[3:]: parser.process_file(file)
+    parser.flush()
+    assert len(_fragments_()) == 3 and count_rows(DATASET) == 5 * 12
+    assert parser.pending_sources() == set()
+    assert all([manifest.is_complete(os.path.basename(x)[:-3]) for x in files])
+    manifest.close()
+
+
+def test_buffer_bytes(workdir):
+    parser = IndexParser(layouts = dict(forecast = ["year", "month"]), buffer_rows = 10**6, buffer_bytes = 1)
+    parser.process_file(forecast_index("src", "2017-01-02")[0])
+    # Buffer exceeds 'buffer_bytes'; written
+    assert len(_fragments_()) == 1 and parser.pending_sources() == set()
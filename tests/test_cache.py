@@ -0,0 +1,56 @@
+
+
+import os
+import glob
+
+from conftest import grib_file
+from euppparquet.client import fetch
+from euppparquet.client import MessageCache, Fetcher
+
+
+def test_cache_lru_eviction(tmp_path):
+    cache = MessageCache(str(tmp_path / "cache"), max_size = 300, blob_size = 100)
+    for i in range(3): cache.put("a.grb", i * 100, 100, bytes([i]) * 100)
+    assert cache.info() == dict(messages = 3, blobs = 3, size = 300)
+
+    # Message 0 used recently; the blob of message 1 is evicted first
+    assert cache.get("a.grb", 0, 100) == bytes([0]) * 100
+    cache.put("a.grb", 300, 100, bytes([3]) * 100)
+    assert cache.get("a.grb", 100, 100) is None
+    assert [cache.get("a.grb", i * 100, 100) is not None for i in [0, 2, 3]] == [True] * 3
+    assert cache.stats["evicted"] == 1 and cache.info()["size"] == 300
+    assert len(glob.glob(str(tmp_path / "cache" / "blob-*.bin"))) == 3
+    cache.close()
+
+
+def test_fetch_cached_in_batches(http_server, tmp_path, monkeypatch):
+    result, msgs = grib_file(http_server.root, [100] * 7, [0] * 7)
+    cache = MessageCache(str(tmp_path / "cache"))
+    assert dict(Fetcher(http_server.url, cache = cache).iter_messages(result)) == dict(enumerate(msgs))
+    assert cache.info()["messages"] == 7 and len(http_server.log) == 1
+
+    # Cached messages are read when needed, at most CACHE_BATCH at once
+    monkeypatch.setattr(fetch, "CACHE_BATCH", 3)
+    reads = []
+    get_many = cache.get_many
+    def read(keys):
+        reads.append(len(keys))
+        return get_many(keys)
+    monkeypatch.setattr(cache, "get_many", read)
+    fetcher = Fetcher(http_server.url, cache = cache)
+    res     = fetcher.iter_messages(result)
+    assert next(res) == (0, msgs[0]) and reads == [3]
+    assert dict(res) == dict(enumerate(msgs[1:], 1)) and reads == [3, 3, 1]
+    assert len(http_server.log) == 1 and fetcher.stats["requests"] == 0
+
+    # Evicted since looked up; downloaded
+    find_many = cache.find_many
+    def evict(keys):
+        res = find_many(keys)
+        cache.clear()
+        return res
+    monkeypatch.setattr(cache, "find_many", evict)
+    fetcher = Fetcher(http_server.url, cache = cache)
+    assert dict(fetcher.iter_messages(result)) == dict(enumerate(msgs))
+    assert fetcher.stats["requests"] == 7 and len(http_server.log) == 1 + 7
+    cache.close()
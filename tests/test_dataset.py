@@ -0,0 +1,43 @@
+
+
+import pytest
+
+from euppparquet.server import IndexParser
+from euppparquet.server.synthetic import make_archive
+from euppparquet.client import Dataset
+
+
+def test_query_date_range_and_filters(datasets):
+    ds  = Dataset("forecast.parquet")
+    res = ds.query("2017-01-02", "2017-01-03", param = "2t", step = [0, 12], number = 1, time = 0)
+    assert res.num_rows == 2 * 2
+    assert ds.query("2017-01-02", "2017-01-03", param = "2t", time = 12).num_rows == 0
+    assert ds.query("2017-01-03", param = "tp").num_rows == 3 * 2
+
+
+def test_query_analysis_time_of_day(datasets):
+    ds = Dataset("analysis.parquet")
+    assert ds.query("2017-01-01", "2017-01-03").num_rows == 3 * 2
+    assert ds.query("2017-01-01", "2017-01-03", time = 12).num_rows == 3
+    assert ds.query("2017-01-01", "2017-01-03", time = 6).num_rows == 0
+
+
+@pytest.mark.parametrize("layout", ["ymd", ["step"]])
+def test_query_non_default_layout(workdir, layout):
+    parser = IndexParser(layouts = dict(forecast = layout))
+    for file in make_archive("src", "2017-01-02", "2017-01-03", types = ["forecast"], products = ["ens", "hr"],
+                             kinds = ["surf"], params = dict(surf = ["2t"]), steps = [0, 12], members = 1,
+                             format = "gzip"):
+        parser.process_file(f"src/{file}")
+    parser.flush()
+
+    ds  = Dataset("forecast.parquet")
+    ens = ds.query("2017-01-02", product = "ens")
+    hr  = ds.query("2017-01-02", product = "hr")
+    assert ens.num_rows == 2 and hr.num_rows == 2
+    assert set(ens.column("product").to_pylist()) == set(["ens"])
+    assert ds.query("2017-01-02", "2017-01-03", product = ["ens", "hr"], step = 12).num_rows == 2 * 2
+    assert ds.query("2017-01-03").num_rows == 2 * 2
+    assert ds.query().num_rows == 2 * 2 * 2
+    with pytest.raises(ValueError, match = "bogus"):
+        ds.query("2017-01-02", bogus = 3)
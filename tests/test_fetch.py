@@ -0,0 +1,42 @@
+
+
+import os
+import pytest
+
+from conftest import grib_file
+from euppparquet.client.fetch import coalesce, Fetcher
+
+
+def test_coalesce():
+    paths   = ["b", "a", "a", "a", "a"]
+    offsets = [0, 100, 0, 50, 1000]
+    lengths = [10, 50, 50, 50, 20]
+    res = coalesce(paths, offsets, lengths)
+    assert [(x["path"], x["start"], x["end"], x["rows"]) for x in res] == \
+           [("a", 0, 150, [2, 3, 1]), ("a", 1000, 1020, [4]), ("b", 0, 10, [0])]
+    assert len(coalesce(paths, offsets, lengths, gap = 850)) == 2
+    assert len(coalesce(paths, offsets, lengths, gap = 850, max_size = 100)) == 4
+    with pytest.raises(ValueError):
+        coalesce(paths, offsets, lengths[1:])
+
+
+@pytest.mark.parametrize("gap,requests", [(0, 2), (2000, 1)])
+def test_fetch_range_requests(http_server, gap, requests):
+    result, msgs = grib_file(http_server.root, [100, 60, 80, 100, 40, 20], [0, 0, 0, 1000, 0, 0])
+    # Unordered input; messages are returned with their row
+    order  = [3, 0, 5, 1, 4, 2]
+    result = dict([(k, [v[i] for i in order]) for k, v in result.items()])
+
+    fetcher = Fetcher(http_server.url, gap = gap, jobs = 2)
+    res     = dict(fetcher.iter_messages(result))
+    assert [res[i] for i in range(len(order))] == [msgs[i] for i in order]
+    assert fetcher.stats["requests"] == requests and len(http_server.log) == requests
+    assert all([x[0] == "GET" and x[2].startswith("bytes=") for x in http_server.log])
+    assert fetcher.stats["bytes_messages"] == sum([len(x) for x in msgs])
+
+
+def test_fetch_not_a_grib_message(http_server):
+    result, msgs = grib_file(http_server.root, [100, 60], [0, 0])
+    result["_length"][0] -= 1
+    with pytest.raises(Exception, match = "Not a GRIB message"):
+        list(Fetcher(http_server.url).iter_messages(result))
@@ -0,0 +1,46 @@
+
+
+import pytest
+
+from conftest import forecast_index, write_records, count_rows
+from euppparquet.server import IndexParser, Manifest
+
+
+def _broken_(records, i):
+    res = [dict(x) for x in records]
+    res[i]["step"] = "x"
+    return res
+
+
+def test_process_file_returns_records_written(workdir):
+    file, records = forecast_index("src")
+    for chunksize in [None, 5]:
+        parser = IndexParser()
+        assert parser.process_file(file, chunksize = chunksize) == (len(records) if chunksize is None else 0)
+    assert count_rows("forecast.parquet") == len(records)
+
+
+def test_chunked_partial_failure_is_ingested_again(workdir):
+    file, records = forecast_index("src")
+    source = file.split("/")[-1][:-3]
+    write_records(file, _broken_(records, 8))
+
+    # First batch (5 records) is written, second one fails
+    with pytest.raises(Exception, match = "step"):
+        IndexParser().process_file(file, chunksize = 5)
+    assert count_rows("forecast.parquet") == 5
+    manifest = Manifest("forecast.parquet")
+    assert not manifest.is_complete(source)
+    assert manifest.has_paths(records[0]["_path"]) is None
+
+    # Fixed upstream; records of the failed attempt are replaced
+    write_records(file, records)
+    assert IndexParser().process_file(file, chunksize = 5) == len(records)
+    assert count_rows("forecast.parquet") == len(records)
+    assert manifest.is_complete(source)
+    assert manifest.has_paths(records[0]["_path"]) == len(records)
+
+    # Nothing to do
+    assert IndexParser().process_file(file, chunksize = 5) == 0
+    assert count_rows("forecast.parquet") == len(records)
+    manifest.close()
@@ -0,0 +1,44 @@
+
+
+import os
+import json
+
+from conftest import forecast_index, count_rows
+from euppparquet.server import JobQueue, Manifest
+from euppparquet.server.prepare_parquet import process_files
+
+
+def _publish_(http_server, records, name):
+    """Serves the (uncompressed) index file as the ECMWF storage does."""
+    file = os.path.join(http_server.root, name)
+    with open(file, "w") as fid:
+        for rec in records: fid.write(json.dumps(rec) + "\n")
+    return f"{http_server.url}/{name}"
+
+
+def test_resume_does_not_trust_partial_records(workdir, http_server):
+    file, records = forecast_index("src")
+    name   = os.path.basename(file)[:-3]
+    broken = [dict(x) for x in records]
+    broken[8]["step"] = "x"
+    url    = _publish_(http_server, broken, name)
+
+    kwargs = dict(verbose = False, chunksize = 5, cache = None, queue = "queue.sqlite", retries = 0)
+    res    = process_files([url], "cache", **kwargs)
+    assert res["failed"] == [url]
+    assert count_rows("forecast.parquet") == 5
+
+    # Resume after the file has been fixed upstream; not skipped
+    _publish_(http_server, records, name)
+    res = process_files([url], "cache", **kwargs)
+    assert res["ingested"] == [url]
+    assert count_rows("forecast.parquet") == len(records)
+    assert Manifest("forecast.parquet").is_complete(name)
+
+    # Skipped (ingested completely by the previous run)
+    n   = len(http_server.log)
+    res = process_files([url], "cache", **kwargs)
+    assert res["ingested"] == [url] and len(http_server.log) == n
+    queue = JobQueue("queue.sqlite")
+    assert queue.get(url)["state"] == "ingested"
+    queue.close()
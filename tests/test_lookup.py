@@ -0,0 +1,42 @@
+
+
+import pytest
+
+from conftest import forecast_index
+from euppparquet.server import IndexParser, update_lookup, compact_dataset
+from euppparquet.client import Dataset, LookupIndex
+
+
+def test_lookup_roundtrip(datasets):
+    assert update_lookup("forecast.parquet")["segments"] == 1
+    idx = LookupIndex("forecast.parquet")
+    assert len(idx) == 24 and "product" in idx.fields
+
+    # Same messages as a query
+    ref = Dataset("forecast.parquet").query("2017-01-03", param = "2t", step = 6).to_pylist()
+    res = idx.lookup(date = "2017-01-03", param = "2t", step = 6, number = [x["number"] for x in ref])
+    assert res["found"].all()
+    assert list(res["_offset"]) == [x["_offset"] for x in ref]
+    assert list(res["_path"]) == [x["_path"] for x in ref]
+
+    # Not found; all matches
+    res = idx.lookup(date = [20170103, 20170105], param = "2t", step = 6, number = 1)
+    assert list(res["found"]) == [True, False] and res["_offset"][1] == -1
+    res = idx.lookup(all = True, date = [20170102, 20170103], param = "tp")
+    assert list(res["query"]) == [0] * 6 + [1] * 6
+    with pytest.raises(ValueError, match = "hdate"):
+        idx.lookup(hdate = 20170102)
+
+    # Kept up to date by later ingestion (new segment) and compaction (rebuilt)
+    parser = IndexParser()
+    parser.process_file(forecast_index("src", "2017-01-05")[0])
+    parser.flush()
+    idx.refresh()
+    assert len(idx.info["segments"]) == 2 and len(idx) == 36
+    assert idx.lookup(date = "2017-01-05", param = "2t", step = 0, number = 1)["found"].all()
+    compact_dataset("forecast.parquet")
+    idx.refresh()
+    assert len(idx) == 36
+    res = idx.lookup(date = "2017-01-02", param = "2t", step = 6, number = 1)
+    ref = Dataset("forecast.parquet").query("2017-01-02", param = "2t", step = 6, number = 1)
+    assert list(res["_offset"]) == ref.column("_offset").to_pylist()
@@ -0,0 +1,39 @@
+
+
+import csv
+import json
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as parquet
+
+from euppparquet.client import Dataset
+from euppparquet.client.output import output_format, write_batches
+
+
+@pytest.mark.parametrize("format", ["arrow", "parquet", "jsonl", "csv"])
+def test_write_formats(datasets, format):
+    ds   = Dataset("forecast.parquet")
+    file = f"res.{format}"
+    assert ds.write(file, begin = "2017-01-02", param = "2t") == 6
+    if format == "arrow":
+        with pa.ipc.open_stream(open(file, "rb")) as reader: res = reader.read_all().to_pylist()
+    elif format == "parquet":
+        res = parquet.read_table(file).to_pylist()
+    elif format == "jsonl":
+        res = [json.loads(x) for x in open(file)]
+    else:
+        res = list(csv.DictReader(open(file)))
+    assert len(res) == 6 and set([x["param"] for x in res]) == set(["2t"])
+
+
+def test_write_batches(tmp_path):
+    schema  = pa.schema([("x", pa.int32())])
+    batches = [pa.record_batch([pa.array([1, 2], pa.int32())], schema = schema),
+               pa.record_batch([pa.array([], pa.int32())], schema = schema),
+               pa.record_batch([pa.array([3], pa.int32())], schema = schema)]
+    file = str(tmp_path / "x.jsonl")
+    assert write_batches(iter(batches), schema, file, "jsonl") == 3
+    assert [json.loads(x)["x"] for x in open(file)] == [1, 2, 3]
+    assert output_format("res.csv") == "csv"
+    with pytest.raises(ValueError):
+        write_batches(iter(batches), schema, file, "xml")
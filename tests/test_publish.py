@@ -0,0 +1,86 @@
+
+
+import os
+import json
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as parquet
+
+from conftest import forecast_index
+from euppparquet.server import IndexParser
+from euppparquet.server.publish import publish_dataset, read_snapshot, SNAPSHOT
+
+DATASET = "forecast.parquet"
+
+
+def _ingest_(date):
+    parser = IndexParser()
+    parser.process_file(forecast_index("src", date)[0])
+    parser.flush()
+
+
+def _remote_files_(target, snapshot):
+    """Files of a snapshot as stored remotely (name: bytes)."""
+    root = target[len("file://"):]
+    res  = dict()
+    for rel, entry in snapshot["files"].items():
+        with open(os.path.join(root, entry["key"]), "rb") as fid: res[rel] = fid.read()
+    return res
+
+
+def test_publish_incremental(workdir):
+    target = f"file://{workdir}/remote"
+    _ingest_("2017-01-02")
+    res   = publish_dataset(DATASET, target)
+    first = read_snapshot(target)
+    assert first["snapshot"] == res["snapshot"] and first["parent"] is None
+    assert res["uploaded"] == len(first["files"]) and "_metadata" in first["files"]
+
+    # Nothing changed; same snapshot
+    res = publish_dataset(DATASET, target)
+    assert res["snapshot"] == first["snapshot"] and res["uploaded"] == 0
+
+    # New day; only the new files and the summary are uploaded
+    _ingest_("2017-01-03")
+    res    = publish_dataset(DATASET, target)
+    second = read_snapshot(target)
+    assert second["parent"] == first["snapshot"]
+    assert res["unchanged"] == len(first["files"]) - 1
+    assert res["uploaded"] == len(second["files"]) - res["unchanged"]
+
+    # The previous snapshot is still complete (readers may still use it)
+    old = _remote_files_(target, first)
+    assert old["_metadata"] != _remote_files_(target, second)["_metadata"]
+    meta = parquet.read_metadata(pa.BufferReader(old["_metadata"]))
+    assert meta.num_rows == sum([parquet.read_metadata(pa.BufferReader(v)).num_rows
+                                 for k, v in old.items() if k.endswith(".parquet")])
+
+
+def test_publish_interrupted(workdir, monkeypatch):
+    import fsspec.implementations.local as local
+    target = f"file://{workdir}/remote"
+    _ingest_("2017-01-02")
+    publish_dataset(DATASET, target)
+    first   = read_snapshot(target)
+    before  = _remote_files_(target, first)
+    pointer = open(os.path.join(workdir, "remote", SNAPSHOT)).read()
+
+    # Upload fails halfway; readers keep seeing the previous snapshot
+    _ingest_("2017-01-03")
+    put, calls = local.LocalFileSystem.put_file, []
+    def failing(self, *args, **kwargs):
+        calls.append(args)
+        if len(calls) > 1: raise OSError("connection lost")
+        return put(self, *args, **kwargs)
+    monkeypatch.setattr(local.LocalFileSystem, "put_file", failing)
+    with pytest.raises(OSError):
+        publish_dataset(DATASET, target, jobs = 1)
+    assert open(os.path.join(workdir, "remote", SNAPSHOT)).read() == pointer
+    assert read_snapshot(target) == first
+    assert _remote_files_(target, first) == before
+
+    # Next publish completes
+    monkeypatch.setattr(local.LocalFileSystem, "put_file", put)
+    res = publish_dataset(DATASET, target)
+    assert read_snapshot(target)["parent"] == first["snapshot"]
+    assert json.loads(open(os.path.join(workdir, "remote", SNAPSHOT)).read())["snapshot"] == res["snapshot"]
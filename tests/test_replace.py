@@ -0,0 +1,144 @@
+
+
+import os
+import glob
+import gzip
+import json
+import pytest
+
+from conftest import forecast_index, write_records, count_rows
+from euppparquet.server import IndexParser, Manifest, compact_dataset
+from euppparquet.server import replace, summary
+
+DATASET = "forecast.parquet"
+
+
+def _files_():
+    return dict([(x, os.path.getmtime(x)) for x in glob.glob(f"{DATASET}/**/*.parquet", recursive = True)])
+
+
+def _summary_rows_():
+    import pyarrow.parquet as parquet
+    meta = parquet.read_metadata(os.path.join(DATASET, summary.METADATA))
+    return meta.num_rows, summary.summary_files(DATASET)
+
+
+@pytest.fixture
+def archive(workdir):
+    """Three daily index files ingested; returns the files and records."""
+    res    = [forecast_index("src", f"2017-01-0{d}") for d in [2, 3, 4]]
+    parser = IndexParser()
+    for file, records in res: parser.process_file(file)
+    parser.flush()
+    return res
+
+
+def _republish_(file, records):
+    """Republished file: one record less, other offsets."""
+    new = [dict(x, _offset = x["_offset"] + 7) for x in records[1:]]
+    write_records(file, new)
+    return new
+
+
+def test_replace_source(archive, monkeypatch):
+    file, records = archive[1]
+    source  = os.path.basename(file)[:-3]
+    new     = _republish_(file, records)
+    total   = sum([len(x[1]) for x in archive])
+    before  = _files_()
+
+    # Only footers of the new fragments are read for the summary
+    read = []
+    def build_summary(dataset, files = None, rename = None):
+        read.extend(files)
+        return orig(dataset, files, rename)
+    orig = summary.build_summary
+    monkeypatch.setattr(summary, "build_summary", build_summary)
+
+    assert IndexParser().replace_file(file) == len(new)
+    after = _files_()
+    assert count_rows(DATASET) == total - 1
+    assert count_rows(DATASET, _path = records[0]["_path"]) == len(new)
+    assert len(set(before) - set(after)) == 1 and len(set(after) - set(before)) == 1
+    assert len(read) == 1
+    assert _summary_rows_() == (total - 1, set([os.path.relpath(x, DATASET) for x in after]))
+
+    manifest = Manifest(DATASET)
+    assert manifest.paths(source) == {records[0]["_path"]: len(new)}
+    assert manifest.is_complete(source)
+
+    # Idempotent; nothing is rewritten
+    assert IndexParser().replace_file(file) == 0
+    assert _files_() == after
+    manifest.close()
+
+
+def test_replace_recovered_after_crash(archive, monkeypatch):
+    file, records = archive[1]
+    source  = os.path.basename(file)[:-3]
+    new     = _republish_(file, records)
+    total   = sum([len(x[1]) for x in archive])
+
+    # Interrupted once the journal has been written (before roll forward)
+    orig = replace._recover_
+    def crash(dataset, *args, **kwargs):
+        if os.path.isfile(os.path.join(dataset, replace.JOURNAL)): raise KeyboardInterrupt()
+        return orig(dataset, *args, **kwargs)
+    monkeypatch.setattr(replace, "_recover_", crash)
+    with pytest.raises(KeyboardInterrupt):
+        IndexParser().replace_file(file)
+    monkeypatch.setattr(replace, "_recover_", orig)
+    assert os.path.isfile(os.path.join(DATASET, replace.JOURNAL))
+
+    # Completed by the next entry point (compaction)
+    compact_dataset(DATASET)
+    assert not os.path.isfile(os.path.join(DATASET, replace.JOURNAL))
+    assert count_rows(DATASET) == total - 1
+    assert count_rows(DATASET, _path = records[0]["_path"]) == len(new)
+    assert _summary_rows_()[0] == total - 1
+    manifest = Manifest(DATASET)
+    assert manifest.paths(source) == {records[0]["_path"]: len(new)}
+    assert IndexParser().replace_file(file) == 0
+    manifest.close()
+
+
+def test_process_changed_file_keeps_digest(archive):
+    file, records = archive[1]
+    source = os.path.basename(file)[:-3]
+    total  = sum([len(x[1]) for x in archive])
+    digest = Manifest(DATASET).has_source(source)["digest"]
+    new    = _republish_(file, records)
+
+    # Records skipped (already processed); the digest of the old content is kept
+    with pytest.warns(UserWarning, match = "has changed"):
+        assert IndexParser().process_file(file) == 0
+    assert Manifest(DATASET).has_source(source)["digest"] == digest
+    assert count_rows(DATASET) == total
+
+    # Such that the file is replaced later on
+    assert IndexParser().replace_file(file) == len(new)
+    assert count_rows(DATASET) == total - 1
+
+
+def test_replace_keeps_fragments_per_partition(workdir):
+    from euppparquet.server.synthetic import make_archive
+    parser = IndexParser(layouts = dict(forecast = "ymd"))
+    files  = make_archive("src", "2017-01-02", "2017-01-04", types = ["forecast"], products = ["ens", "hr"],
+                          kinds = ["surf"], params = dict(surf = ["2t"]), steps = [0], members = 1,
+                          format = "gzip")
+    for file in files: parser.process_file(f"src/{file}")
+    parser.flush()
+
+    # Monthly file (records on all days) republished
+    hr = [x for x in files if "_hr_" in x][0]
+    with gzip.open(f"src/{hr}", "rt") as fid: records = [json.loads(x) for x in fid]
+    write_records(f"src/{hr}", [dict(x, _offset = x["_offset"] + 7) for x in records])
+    assert IndexParser().replace_file(f"src/{hr}") == len(records)
+
+    # Daily sources are only linked to the fragments of their day
+    manifest = Manifest(DATASET)
+    for file in [x for x in files if "_ens_" in x]:
+        day = f"day={int(file.split('_')[-2].split('-')[-1])}"
+        assert set([x.split(os.sep)[2] for x in manifest.fragments(file[:-3])]) == set([day])
+    assert len(set([x.split(os.sep)[2] for x in manifest.fragments(hr[:-3])])) == 3
+    manifest.close()
@@ -0,0 +1,40 @@
+
+
+from conftest import forecast_index
+from euppparquet.server import IndexParser
+from euppparquet.client import Dataset, ResultCache
+from euppparquet.client.result_cache import normalize_filters
+
+
+def test_normalize_filters():
+    assert normalize_filters([("month", "=", 1), ("year", "==", 2017), ("month", "=", 1)]) == \
+           [[["month", "=", 1], ["year", "=", 2017]]]
+    assert normalize_filters([("step", "in", [12, 0, 12])]) == normalize_filters([("step", "in", (0, 12))])
+
+
+def test_result_cache_hit_and_invalidation(datasets):
+    cache = ResultCache("cache")
+    ds    = Dataset("forecast.parquet", cache = cache)
+    res   = ds.query("2017-01-02", "2017-01-03", param = "2t", step = [0, 6])
+    assert res.num_rows == 2 * 2 * 2 and cache.stats["misses"] == 1
+
+    # Same query (order and duplicates of values do not matter)
+    assert ds.query("2017-01-02", "2017-01-03", param = ["2t", "2t"], step = [6, 0]).equals(res)
+    assert cache.stats["hits"] == 1 and cache.stats["memory_hits"] == 1
+
+    # From disk (new cache object, same directory)
+    other = ResultCache("cache")
+    assert Dataset("forecast.parquet", cache = other).query("2017-01-02", "2017-01-03", param = "2t",
+                                                            step = [0, 6]).to_pylist() == res.to_pylist()
+    assert other.stats["disk_hits"] == 1
+
+    # Dataset changed; the entries of the previous state are removed
+    parser = IndexParser()
+    parser.process_file(forecast_index("src", "2017-01-04")[0])
+    parser.flush()
+    token = ds.token
+    ds.refresh()
+    assert not ds.token == token
+    assert ds.query("2017-01-02", "2017-01-04", param = "2t", step = [0, 6]).num_rows == 3 * 2 * 2
+    assert cache.stats["misses"] == 2 and cache.stats["invalidated"] == 2
+    assert cache.info()["files"] == 1
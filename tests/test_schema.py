@@ -0,0 +1,91 @@
+
+
+import pytest
+import pyarrow as pa
+
+from euppparquet.server.schema import conform, schema_outdated, SCHEMA_VERSION, SCHEMA_KEY
+
+
+def _table_(**extra):
+    cols = dict(param = ["2t"], _offset = [0], _length = [10], _path = ["a.grb"], time = [1200],
+                year = [2017], month = [1], day = [2])
+    cols.update(extra)
+    return pa.table(cols)
+
+
+def test_conform_drops_undeclared_columns():
+    with pytest.warns(UserWarning, match = "newkey"):
+        res = conform(_table_(newkey = ["x"]), "analysis")
+    assert not "newkey" in res.column_names
+    assert res.schema.field("time").type == pa.int16()
+    with pytest.raises(Exception, match = "not declared"):
+        conform(_table_(newkey = ["x"]), "analysis", strict = True)
+
+
+def test_conform_required_columns():
+    with pytest.raises(Exception, match = "_offset"):
+        conform(_table_().drop_columns(["_offset"]), "analysis")
+
+
+def test_schema_outdated():
+    assert schema_outdated("analysis", 1)
+    assert not schema_outdated("forecast", 1)
+    assert schema_outdated("forecast", 0)
+    assert not schema_outdated("analysis", SCHEMA_VERSION)
+
+
+def _downgrade_(dataset):
+    """Rewrites an analysis dataset as written by schema version 1 (no
+    'time'); the first fragment as written before version 1 (plain types,
+    no version in the footer)."""
+    import glob
+    import pyarrow.parquet as parquet
+    from euppparquet.server.layout import read_layout, write_layout
+    from euppparquet.server.summary import write_summary
+    files = sorted(glob.glob(f"{dataset}/**/*.parquet", recursive = True))
+    for i, file in enumerate(files):
+        data = parquet.read_table(file).drop_columns(["time"])
+        if i == 0:
+            data = pa.Table.from_pandas(data.to_pandas().astype(dict(param = str, _path = str)), preserve_index = False)
+        else:
+            data = data.replace_schema_metadata({SCHEMA_KEY: b"1"})
+        parquet.write_table(data, file)
+    write_layout(dataset, read_layout(dataset), schema = 1)
+    write_summary(dataset)
+    return files
+
+
+def test_migrate_dataset(workdir):
+    import pyarrow.parquet as parquet
+    from euppparquet.server import IndexParser, migrate_dataset
+    from euppparquet.server.synthetic import make_archive
+    from euppparquet.server.schema import file_version
+    from euppparquet.server.summary import summary_is_current
+    from euppparquet.client import Dataset
+
+    def ingest(begin, end):
+        parser = IndexParser()
+        for file in make_archive("src", begin, end, types = ["analysis"], kinds = ["surf"],
+                                 params = dict(surf = ["2t"]), format = "gzip"):
+            parser.process_file(f"src/{file}")
+        parser.flush()
+
+    ingest("2017-01-01", "2017-01-03")
+    files = _downgrade_("analysis.parquet")
+    assert [file_version(x) for x in files] == [0] + [1] * (len(files) - 1)
+    with pytest.raises(Exception, match = "migrate it first"):
+        ingest("2017-02-01", "2017-02-01")
+
+    res = migrate_dataset("analysis.parquet")
+    assert res["files"] == len(files) and res["partitions"] == 3
+    new = Dataset("analysis.parquet")
+    assert all([file_version(x.path) == SCHEMA_VERSION for x in new.fragments])
+    assert summary_is_current("analysis.parquet")
+    tab = new.query("2017-01-01", "2017-01-03")
+    assert tab.num_rows == 6 and tab.column("time").null_count == 6
+    assert tab.schema.field("param").type == pa.dictionary(pa.int16(), pa.string())
+
+    # Migrated once; new records with the time of day
+    assert migrate_dataset("analysis.parquet")["files"] == 0
+    ingest("2017-02-01", "2017-02-01")
+    assert Dataset("analysis.parquet").query("2017-02-01", time = 12).num_rows == 1
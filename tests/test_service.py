@@ -0,0 +1,36 @@
+
+
+import os
+import io
+import pytest
+
+from euppparquet.client import Dataset
+
+
+def test_service_query(service):
+    res = service.query("forecast", begin = "2017-01-02", end = "2017-01-03", param = "2t", step = 0)
+    assert len(res["param"]) == 2 * 2 and set(res["param"]) == set(["2t"])
+
+    tab = service.query("forecast", format = "arrow", begin = "2017-01-02", param = "tp")
+    ref = Dataset("forecast.parquet").query("2017-01-02", param = "tp")
+    assert tab.num_rows == ref.num_rows == 6
+    assert sorted(tab.column("_offset").to_pylist()) == sorted(ref.column("_offset").to_pylist())
+
+    status = service.status()
+    assert status["requests"] == 2 and status["datasets"] == dict(forecast = len(Dataset("forecast.parquet").fragments))
+
+    # Errors of the query are reported to the client
+    with pytest.raises(Exception, match = "bogus"):
+        service.query("forecast", begin = "2017-01-02", bogus = 1)
+    with pytest.raises(Exception, match = "product"):
+        service.query("nowcast", begin = "2017-01-02")
+
+
+def test_service_write(service):
+    n = service.write("res.csv", "analysis", begin = "2017-01-01", end = "2017-01-03", time = 12)
+    assert n == os.path.getsize("res.csv")
+    assert len(open("res.csv").read().splitlines()) == 1 + 3
+
+    sink = io.BytesIO()
+    assert service.write(sink, "forecast", format = "jsonl", begin = "2017-01-03") == len(sink.getvalue())
+    assert len(sink.getvalue().splitlines()) == 12
@@ -0,0 +1,59 @@
+
+
+import os
+import pyarrow as pa
+import pyarrow.parquet as parquet
+
+from euppparquet.bloom import xxh64, read_bloom_filter
+from euppparquet.server.storage import sort_table, write_options
+from euppparquet.client import Dataset
+
+PARAMS = ["tp", "2t", "10u", "msl", "t850", "10v", "tcc", "sp"]
+
+
+def _write_(dir, row_group_size = 8):
+    """One fragment; 4 steps per parameter, 2 parameters per row group."""
+    n     = len(PARAMS) * 4
+    table = pa.table(dict(param = [x for x in PARAMS for s in range(4)], step = list(range(4)) * len(PARAMS),
+                          number = [1] * n, _path = [f"data/{x}.grb" for x in PARAMS for s in range(4)],
+                          _offset = list(range(n)), _length = [10] * n))
+    table = sort_table(table)
+    os.makedirs(dir)
+    file  = os.path.join(dir, "part-0.parquet")
+    parquet.write_table(table, file, **write_options(table, row_group_size = row_group_size))
+    return file
+
+
+def test_xxh64():
+    assert xxh64(b"") == 0xEF46DB3751D8E999
+    assert xxh64(b"a") == 0xD24EC4F1A98C6E5B
+
+
+def test_bloom_filters(workdir):
+    file = _write_("x")
+    meta = parquet.read_metadata(file)
+    assert meta.num_row_groups == 4
+    assert parquet.read_table(file).column("param").to_pylist()[::8] == ["10u", "2t", "sp", "tcc"]
+    with open(file, "rb") as fid:
+        for i in range(meta.num_row_groups):
+            names = set(parquet.ParquetFile(file).read_row_group(i).column("param").to_pylist())
+            bloom = read_bloom_filter(fid, meta.row_group(i).column(0))
+            assert all([x in bloom for x in names])
+            assert not any([x in bloom for x in set(PARAMS) - names])
+
+
+def test_prune_row_groups(workdir):
+    _write_("forecast.parquet/year=2017/month=1/day=2")
+    ds    = Dataset("forecast.parquet")
+    frags = ds.select_fragments("2017-01-02")
+    def row_groups(**kwargs):
+        filter, expr = ds._filter_(**kwargs)
+        values = dict([(k, [v]) for k, v in kwargs.items() if k == "param"])
+        return sum([x.num_row_groups for x in ds._prune_(frags, expr, values)])
+
+    # Statistics (sorted by param); bloom filter for values within min/max
+    assert row_groups(param = "2t") == 1
+    assert row_groups(step = 2) == 4
+    assert row_groups(param = "t2m") == 0
+    assert ds.query("2017-01-02", param = "t2m").num_rows == 0
+    assert ds.query("2017-01-02", param = ["2t", "sp"], step = 3).num_rows == 2
@@ -0,0 +1,68 @@
+
+
+import os
+import pytest
+import pyarrow.parquet as parquet
+
+from conftest import forecast_index, count_rows
+from euppparquet.server import IndexParser, summary
+from euppparquet.client import Dataset
+
+DATASET = "forecast.parquet"
+
+
+def _ingest_(days):
+    parser = IndexParser()
+    for d in days: parser.process_file(forecast_index("src", f"2017-01-{d:02d}")[0])
+    parser.flush()
+
+
+def _no_rewrite_(monkeypatch):
+    """Fails if the summary is rebuilt from all fragments."""
+    def write_summary(dataset, verbose = False):
+        raise AssertionError("summary rebuilt")
+    monkeypatch.setattr(summary, "write_summary", write_summary)
+
+
+@pytest.mark.parametrize("remove", [3, 10])
+def test_update_summary(workdir, monkeypatch, remove):
+    # More than 14 row groups (long form of the list header in the footer)
+    _ingest_(range(2, 19))
+    assert summary.write_summary(DATASET) == 17
+    assert summary.summary_is_current(DATASET)
+    files = sorted(summary.summary_files(DATASET))
+
+    # Fragments removed and added (e.g., by replace_source)
+    _no_rewrite_(monkeypatch)
+    for x in files[:remove]: os.remove(os.path.join(DATASET, x))
+    _ingest_([20])
+    added = sorted(set(summary._fragments_(DATASET)) - set(files))
+    assert summary.update_summary(DATASET, removed = files[:remove], added = added) == 17 - remove + 1
+
+    meta = parquet.read_metadata(os.path.join(DATASET, summary.METADATA))
+    summary.build_summary(DATASET, files[remove:] + added).write_metadata_file("ref")
+    ref  = parquet.read_metadata("ref")
+    assert meta.num_rows == ref.num_rows == count_rows(DATASET)
+    assert meta.to_dict() == ref.to_dict()
+    assert meta.schema.equals(ref.schema) and meta.metadata == ref.metadata
+    assert summary.summary_is_current(DATASET)
+    assert Dataset(DATASET).query("2017-01-02", "2017-01-31").num_rows == count_rows(DATASET)
+
+
+def test_summary_appended_on_ingest(workdir, monkeypatch):
+    _ingest_([2, 3])
+    assert summary.summary_is_current(DATASET)
+    _no_rewrite_(monkeypatch)
+    _ingest_([4])
+    assert summary.summary_is_current(DATASET)
+    assert parquet.read_metadata(os.path.join(DATASET, summary.METADATA)).num_rows == 3 * 12
+
+    # Readers plan the query from the summary
+    ds = Dataset(DATASET)
+    assert ds._snapshot_files_()[1] is not None
+    assert ds.query("2017-01-03", "2017-01-04", param = "2t").num_rows == 2 * 6
+
+
+def test_drop_row_groups_errors():
+    with pytest.raises(ValueError):
+        summary._drop_row_groups_(b"PAR1xxxx", set())
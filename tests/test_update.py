@@ -0,0 +1,47 @@
+
+
+import os
+import json
+
+from conftest import count_rows
+from euppparquet.server import Manifest, update_product
+from euppparquet.server.synthetic import make_archive
+
+
+def _archive_(http_server):
+    dir  = os.path.join(http_server.root, "data", "ana", "surf")
+    name = make_archive(dir, "2017-01-01", "2017-01-02", types = ["analysis"], kinds = ["surf"],
+                        params = dict(surf = ["2t", "tp"]), format = "none")[0]
+    return os.path.join(dir, name)
+
+
+def test_update_detects_new_and_modified_files(workdir, http_server):
+    file   = _archive_(http_server)
+    url    = f"{http_server.url}/data/ana/surf/{os.path.basename(file)}"
+    kwargs = dict(years = 2017, months = 1, cache = None, verbose = False)
+    with open(file, "r") as fid: records = [json.loads(x) for x in fid]
+
+    res = update_product("analysis", http_server.url, "cache", **kwargs)
+    assert res["new"] == [url] and len(res["missing"]) == 1
+    assert count_rows("analysis.parquet") == len(records)
+
+    # Unchanged upstream; answered by conditional requests (304)
+    res = update_product("analysis", http_server.url, "cache", **kwargs)
+    assert res["unchanged"] == [url] and res["new"] == [] and res["modified"] == []
+
+    # Republished with one record less; reported only, then replaced
+    with open(file, "w") as fid:
+        for rec in records[1:]: fid.write(json.dumps(rec) + "\n")
+    res = update_product("analysis", http_server.url, "cache", replace = False, **kwargs)
+    assert res["modified"] == [url]
+    assert count_rows("analysis.parquet") == len(records)
+
+    res = update_product("analysis", http_server.url, "cache", **kwargs)
+    assert res["modified"] == [url]
+    assert count_rows("analysis.parquet") == len(records) - 1
+    manifest = Manifest("analysis.parquet")
+    assert manifest.paths(os.path.basename(file)) == {records[0]["_path"]: len(records) - 1}
+
+    res = update_product("analysis", http_server.url, "cache", **kwargs)
+    assert res["unchanged"] == [url]
+    manifest.close()